@@ -0,0 +1,189 @@
+# async_handler.py
+#
+# asyncio facade over metadata_handler for services with an event loop. The
+# blocking read/apply/clear calls run on a bounded thread pool, and each
+# filesystem (st_dev) gets its own concurrency limit, so thousands of
+# concurrent requests queue cheaply on the loop instead of piling onto one
+# disk or stalling the loop.
+#
+#   async with AsyncMetadataHandler(max_workers=16, per_device=4) as handler:
+#       metadata = await handler.read("photo.jpg")
+#       async for result in handler.iter_batch(mh.apply_metadata_to_image, paths, plan):
+#           ...
+
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+import metadata_handler as mh
+
+# Concurrent operations allowed on one filesystem
+DEFAULT_PER_DEVICE = 8
+# Directories whose filesystem is remembered before the memo starts over
+DEVICE_CACHE_SIZE = 4096
+
+def _device_of(directory):
+    try:
+        return os.stat(directory).st_dev
+    except OSError:
+        return None  # Missing directories share one limit; the operation reports the error
+
+class AsyncMetadataHandler:
+    """Runs metadata_handler operations for an event loop.
+
+    max_workers bounds the thread pool (default: the batch engine's worker
+    count). per_device caps how many operations run at once on each
+    filesystem; the rest wait on the loop without holding a thread. An
+    existing Executor may be passed instead and is not shut down by close().
+    Limits belong to the running event loop; moving to another loop starts
+    with fresh ones.
+    """
+
+    def __init__(self, max_workers=None, per_device=DEFAULT_PER_DEVICE, executor=None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.per_device = per_device
+        self._owned = executor is None
+        self.executor = executor or ThreadPoolExecutor(max_workers=self.max_workers,
+                                                       thread_name_prefix="metadata")
+        self._devices = {}       # directory -> st_dev
+        self._semaphores = {}    # st_dev -> asyncio.Semaphore
+        self._loop = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    def close(self):
+        if self._owned:
+            self.executor.shutdown(wait=True)
+
+    async def aclose(self):
+        """Shut down the pool without blocking the loop."""
+        if self._owned:
+            await asyncio.get_running_loop().run_in_executor(None, self.executor.shutdown)
+
+    async def _offload(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, functools.partial(func, *args))
+
+    async def _semaphore(self, path):
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop, self._semaphores = loop, {}
+        directory = os.path.dirname(os.path.abspath(path))
+        if directory in self._devices:
+            device = self._devices[directory]
+        else:
+            device = await self._offload(_device_of, directory)
+            if len(self._devices) >= DEVICE_CACHE_SIZE:
+                self._devices.clear()
+            self._devices[directory] = device
+        semaphore = self._semaphores.get(device)
+        if semaphore is None:
+            semaphore = self._semaphores[device] = asyncio.Semaphore(self.per_device)
+        return semaphore
+
+    async def run(self, func, path, *args):
+        """Await func(path, *args) on the pool, within the limit of path's filesystem."""
+        async with await self._semaphore(path):
+            return await self._offload(func, path, *args)
+
+    async def read(self, path, sidecar=True):
+        """Return an image's metadata fields; raises on unreadable files."""
+        return await self.run(mh.read_metadata_from_image, path, True, sidecar)
+
+    async def apply(self, path, metadata, dry_run=False, sidecar=False):
+        """Like metadata_handler.apply_metadata_to_image."""
+        return await self.run(mh.apply_metadata_to_image, path, mh.compile_metadata(metadata), dry_run, sidecar)
+
+    async def clear(self, path, sidecar=False):
+        """Like metadata_handler.clear_metadata_from_image."""
+        return await self.run(mh.clear_metadata_from_image, path, sidecar)
+
+    async def iter_batch(self, func, image_paths, *args, max_in_flight=None):
+        """Run func(path, *args) over many images, yielding results as they complete.
+
+        Results are metadata_handler.run_one dictionaries, so failures are
+        reported per file instead of raised. image_paths may be an iterable or
+        an async iterable; at most max_in_flight files (default: twice the
+        worker count) are taken from it at a time. Breaking out of the loop
+        cancels the files still waiting for their turn.
+        """
+        max_in_flight = max_in_flight or self.max_workers * 2
+        paths = _aiter(image_paths)
+        pending = set()
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and len(pending) < max_in_flight:
+                    try:
+                        path = await paths.__anext__()
+                    except StopAsyncIteration:
+                        exhausted = True
+                        break
+                    pending.add(asyncio.ensure_future(self._run_one(func, path, args)))
+                if not pending:
+                    return
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+            await paths.aclose()
+
+    async def _run_one(self, func, path, args):
+        async with await self._semaphore(path):
+            return await self._offload(mh.run_one, func, path, args)
+
+    async def run_batch(self, func, image_paths, *args, on_result=None, max_in_flight=None):
+        """Await a whole batch and return a summary like metadata_handler.run_batch."""
+        summary = {"total": 0, mh.STATUS_OK: 0, mh.STATUS_FAILED: 0, mh.STATUS_SKIPPED: 0,
+                   "elapsed": 0.0, "failures": [], "cancelled": False}
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        async for result in self.iter_batch(func, image_paths, *args, max_in_flight=max_in_flight):
+            summary["total"] += 1
+            summary[result["status"]] += 1
+            if result["status"] == mh.STATUS_FAILED:
+                summary["failures"].append(result)
+            if on_result:
+                on_result(result)
+        summary["elapsed"] = loop.time() - start
+        summary["files_per_second"] = summary["total"] / summary["elapsed"] if summary["elapsed"] else 0.0
+        return summary
+
+async def _aiter(iterable):
+    if hasattr(iterable, "__aiter__"):
+        async for item in iterable:
+            yield item
+    else:
+        for item in iterable:
+            yield item
+
+# ----------------------------
+# MODULE-LEVEL API
+# ----------------------------
+
+# Shared handler behind the functions below, created on first use
+_default = None
+
+def get_default_handler():
+    global _default
+    if _default is None:
+        _default = AsyncMetadataHandler()
+    return _default
+
+async def async_read(path, sidecar=True):
+    return await get_default_handler().read(path, sidecar)
+
+async def async_apply(path, metadata, dry_run=False, sidecar=False):
+    return await get_default_handler().apply(path, metadata, dry_run, sidecar)
+
+async def async_clear(path, sidecar=False):
+    return await get_default_handler().clear(path, sidecar)
+
+def async_iter_batch(func, image_paths, *args, max_in_flight=None):
+    """Async iterator of per-file results; see AsyncMetadataHandler.iter_batch."""
+    return get_default_handler().iter_batch(func, image_paths, *args, max_in_flight=max_in_flight)
@@ -0,0 +1,322 @@
+# benchmark.py
+#
+# Reproducible benchmarks for the metadata engine. A synthetic JPEG corpus is
+# generated locally (several resolutions, small and large EXIF blocks, with
+# and without embedded thumbnails), then every operation is run over it at
+# each worker count. Each case runs in its own subprocess so peak RSS and the
+# I/O counters belong to that case alone.
+#
+#   python3 benchmark.py --out before.json
+#   python3 benchmark.py --out after.json --compare before.json
+#   python3 benchmark.py --operations read preview --jobs 1 8 --count 50
+
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import piexif
+import PIL
+from PIL import Image
+import instrumentation
+import metadata_handler as mh
+import preview
+
+OPERATIONS = ("read", "apply", "clear", "preview")
+# Operations that change the files, so every repetition needs a fresh copy
+MUTATING = {"apply", "clear"}
+
+DEFAULT_RESOLUTIONS = ("1024x768", "4000x3000")
+DEFAULT_EXIF_SIZES = (0, 32 * 1024)
+DEFAULT_JOBS = (1, 4)
+DEFAULT_COUNT = 20
+
+# Roughly the preview canvas of the GUI; show_preview also converts the
+# result to a Tk PhotoImage, which needs a display and is not measured
+PREVIEW_SIZE = (900, 600)
+
+BENCHMARK_METADATA = {
+    "Title": "Benchmark title", "Subject": "Benchmark subject", "Tags": "bench; mark",
+    "Comments": "Written by the benchmark", "Authors": "Benchmark", "Copyright": "© Benchmark",
+}
+
+# ----------------------------
+# SYNTHETIC CORPUS
+# ----------------------------
+
+def parse_resolution(value):
+    try:
+        width, height = (int(n) for n in value.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid resolution '{value}' (expected e.g. 4000x3000)")
+    return width, height
+
+def variant_name(resolution, exif_size, thumbnail):
+    return f"{resolution[0]}x{resolution[1]}-exif{exif_size}-{'thumb' if thumbnail else 'nothumb'}"
+
+def synthetic_image(rng, resolution):
+    """A deterministic photo-like image: smooth colour areas plus some grain."""
+    tile = Image.frombytes("RGB", (32, 24), rng.randbytes(32 * 24 * 3))
+    image = tile.resize(resolution, Image.BICUBIC)
+    grain = Image.frombytes("L", (256, 256), rng.randbytes(256 * 256)).resize(resolution)
+    return Image.blend(image, Image.merge("RGB", (grain, grain, grain)), 0.08)
+
+def synthetic_exif(rng, image, exif_size, thumbnail):
+    exif = {"0th": {piexif.ImageIFD.ImageDescription: b"Original title",
+                    piexif.ImageIFD.Artist: b"Original author",
+                    piexif.ImageIFD.Make: b"Synthetic"},
+            "Exif": {piexif.ExifIFD.DateTimeOriginal: b"2024:05:01 10:00:00"},
+            "1st": {}, "thumbnail": None}
+    if exif_size:
+        # Stands in for maker notes and other bulky vendor data
+        exif["Exif"][piexif.ExifIFD.MakerNote] = rng.randbytes(exif_size)
+    if thumbnail:
+        thumb = image.copy()
+        thumb.thumbnail((160, 160))
+        buffer = io.BytesIO()
+        thumb.save(buffer, "JPEG", quality=75)
+        exif["thumbnail"] = buffer.getvalue()
+        exif["1st"] = {piexif.ImageIFD.Compression: 6}
+    return piexif.dump(exif)
+
+def generate_corpus(directory, resolutions=DEFAULT_RESOLUTIONS, exif_sizes=DEFAULT_EXIF_SIZES,
+                    count=DEFAULT_COUNT, seed=0):
+    """Write one folder of count JPEGs per variant; returns {variant: folder}.
+
+    The same arguments always produce the same files, and folders that
+    already hold count images are reused.
+    """
+    variants = {}
+    for resolution in resolutions:
+        for exif_size in exif_sizes:
+            for thumbnail in (False, True):
+                name = variant_name(resolution, exif_size, thumbnail)
+                folder = os.path.join(directory, name)
+                variants[name] = folder
+                if os.path.isdir(folder) and len(os.listdir(folder)) >= count:
+                    continue
+                os.makedirs(folder, exist_ok=True)
+                rng = random.Random(f"{seed}-{name}")
+                for i in range(count):
+                    image = synthetic_image(rng, resolution)
+                    exif = synthetic_exif(rng, image, exif_size, thumbnail)
+                    image.save(os.path.join(folder, f"IMG_{i:04d}.jpg"), "JPEG", quality=90, exif=exif)
+    return variants
+
+# ----------------------------
+# MEASUREMENT
+# ----------------------------
+
+def preview_one(path):
+    preview.load_preview(path, PREVIEW_SIZE)
+
+def read_one(path):
+    mh.read_metadata_from_image(path, raise_errors=True)
+
+def io_counters():
+    """Bytes read/written by this process (Linux only, else None).
+
+    rchar/wchar count every read()/write() call; read_bytes/write_bytes only
+    what reached the storage device, which is 0 when the page cache serves it.
+    """
+    try:
+        with open("/proc/self/io") as f:
+            return {key: int(value) for key, value in (line.split(": ") for line in f)}
+    except OSError:
+        return None
+
+def peak_rss():
+    """Peak resident set size of this process in bytes, or None."""
+    # VmHWM starts afresh at exec; ru_maxrss on Linux carries over the
+    # parent's peak, so it is only the fallback
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024  # Linux reports KiB
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def run_case(operation, folder, jobs, executor="thread", repeat=1):
+    """Run one operation over a corpus folder and return its metrics."""
+    if operation == "apply":
+        func, args = mh.apply_metadata_to_image, (mh.compile_metadata(BENCHMARK_METADATA),)
+    elif operation == "clear":
+        func, args = mh.clear_metadata_from_image, ()
+    elif operation == "read":
+        func, args = read_one, ()
+    else:
+        func, args = preview_one, ()
+
+    metrics = instrumentation.MetricsSink()
+    mh.set_instrumentation(metrics)
+    latencies = []
+    failed = 0
+    wall = 0.0
+    counters = {}
+    for _ in range(repeat):
+        scratch = None
+        if operation in MUTATING:
+            scratch = tempfile.mkdtemp(prefix="bench-")
+            folder_copy = os.path.join(scratch, "corpus")
+            shutil.copytree(folder, folder_copy)
+            paths = sorted(os.path.join(folder_copy, name) for name in os.listdir(folder_copy))
+        else:
+            paths = sorted(os.path.join(folder, name) for name in os.listdir(folder))
+        mh.invalidate_metadata_cache()
+        before = io_counters()
+        start = time.perf_counter()
+        for result in mh.iter_batch(func, paths, *args, jobs=jobs, executor=executor):
+            latencies.append(result["elapsed"])
+            failed += result["status"] == mh.STATUS_FAILED
+        wall += time.perf_counter() - start
+        after = io_counters()
+        if before and after:
+            for key in ("rchar", "wchar", "read_bytes", "write_bytes"):
+                counters[key] = counters.get(key, 0) + after[key] - before[key]
+        if scratch:
+            shutil.rmtree(scratch)
+
+    files = len(latencies)
+    return {
+        "files": files,
+        "failed": failed,
+        "wall_seconds": wall,
+        "files_per_second": files / wall if wall else None,
+        "latency_ms": {
+            "mean": statistics.fmean(latencies) * 1000,
+            "p50": percentile(latencies, 0.50) * 1000,
+            "p90": percentile(latencies, 0.90) * 1000,
+            "p99": percentile(latencies, 0.99) * 1000,
+            "max": max(latencies) * 1000,
+        } if latencies else None,
+        # With --executor process, the I/O and RSS of the workers are not included
+        "bytes_read": counters.get("rchar"),
+        "bytes_written": counters.get("wchar"),
+        "storage_bytes_read": counters.get("read_bytes"),
+        "storage_bytes_written": counters.get("write_bytes"),
+        "peak_rss_bytes": peak_rss(),
+        # Where the time went, from the metadata_handler instrumentation
+        "stages": metrics.snapshot()["stages"],
+    }
+
+def run_case_in_subprocess(operation, folder, jobs, executor, repeat):
+    command = [sys.executable, os.path.abspath(__file__), "--run-case",
+               json.dumps({"operation": operation, "folder": folder, "jobs": jobs,
+                           "executor": executor, "repeat": repeat})]
+    completed = subprocess.run(command, capture_output=True, text=True)
+    if completed.returncode:
+        raise RuntimeError(f"{operation} on {folder} failed:\n{completed.stderr}")
+    return json.loads(completed.stdout)
+
+# ----------------------------
+# REPORTING
+# ----------------------------
+
+def case_key(result):
+    return (result["operation"], result["variant"], result["jobs"], result["executor"])
+
+def environment():
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "pillow": PIL.__version__,
+        "piexif": piexif.VERSION,
+    }
+
+def format_row(result, baseline=None):
+    latency = result["latency_ms"] or {}
+    row = (f"{result['operation']:<8} {result['variant']:<32} {result['jobs']:>4} "
+           f"{result['files_per_second'] or 0:>10.1f} {latency.get('p50', 0):>9.2f} {latency.get('p99', 0):>9.2f} "
+           f"{(result['peak_rss_bytes'] or 0) / 2**20:>8.1f}")
+    if baseline and baseline.get("files_per_second") and result["files_per_second"]:
+        change = result["files_per_second"] / baseline["files_per_second"] - 1
+        row += f" {change:>+8.1%}"
+    return row
+
+def print_report(results, baseline=None):
+    header = f"{'op':<8} {'variant':<32} {'jobs':>4} {'files/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'RSS MiB':>8}"
+    if baseline is not None:
+        header += f" {'vs base':>8}"
+    print(header)
+    for result in results:
+        print(format_row(result, baseline.get(case_key(result)) if baseline is not None else None))
+
+def load_baseline(path):
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return {case_key(result): result for result in data["results"]}
+
+# ----------------------------
+# MAIN
+# ----------------------------
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Benchmark the metadata engine on a synthetic JPEG corpus.")
+    parser.add_argument("--operations", nargs="+", choices=OPERATIONS, default=list(OPERATIONS))
+    parser.add_argument("--jobs", nargs="+", type=int, default=list(DEFAULT_JOBS), help="worker counts to compare")
+    parser.add_argument("--executor", choices=("thread", "process"), default="thread", help="worker pool type")
+    parser.add_argument("--resolutions", nargs="+", type=parse_resolution,
+                        default=[parse_resolution(r) for r in DEFAULT_RESOLUTIONS])
+    parser.add_argument("--exif-sizes", nargs="+", type=int, default=list(DEFAULT_EXIF_SIZES),
+                        help="bytes of extra EXIF data per image (the EXIF block must stay under 64 KiB)")
+    parser.add_argument("--count", type=int, default=DEFAULT_COUNT, help="images per corpus variant")
+    parser.add_argument("--repeat", type=int, default=1, help="passes over the corpus per case")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--corpus", default=os.path.join(mh.CACHE_DIR, "benchmark-corpus"),
+                        help="where the synthetic corpus is kept between runs")
+    parser.add_argument("--out", help="save the results as JSON")
+    parser.add_argument("--compare", metavar="JSON", help="show the change against an earlier --out file")
+    parser.add_argument("--run-case", help=argparse.SUPPRESS)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.run_case:
+        case = json.loads(args.run_case)
+        print(json.dumps(run_case(case["operation"], case["folder"], case["jobs"], case["executor"], case["repeat"])))
+        return 0
+
+    baseline = load_baseline(args.compare) if args.compare else None
+    print(f"Generating corpus in {args.corpus}...", file=sys.stderr)
+    variants = generate_corpus(args.corpus, args.resolutions, args.exif_sizes, args.count, args.seed)
+
+    results = []
+    for operation in args.operations:
+        for variant, folder in variants.items():
+            for jobs in args.jobs:
+                print(f"{operation} {variant} jobs={jobs}", file=sys.stderr)
+                metrics = run_case_in_subprocess(operation, folder, jobs, args.executor, args.repeat)
+                results.append({"operation": operation, "variant": variant, "jobs": jobs,
+                                "executor": args.executor, **metrics})
+
+    print_report(results, baseline)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"environment": environment(), "settings": {
+                "count": args.count, "repeat": args.repeat, "seed": args.seed}, "results": results}, f, indent=2)
+        print(f"Saved {args.out}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,403 @@
+# cli.py
+#
+# Headless command-line interface to metadata_handler, for servers without a
+# display. Every per-file result is printed to stdout as one JSON line.
+#
+#   python3 cli.py apply --template Wedding --authors "Jane Doe" shoot/ --jobs 8
+#   python3 cli.py read "archive/**/*.jpg"
+#   python3 cli.py clear exports/
+#   python3 cli.py apply --tags "beach; sunset" --sidecar /archive/panoramas
+#   python3 cli.py template list
+#   python3 cli.py apply --template Wedding shoot/ --journal run.journal [--resume]
+#   python3 cli.py rollback run.journal
+#   python3 cli.py rename --pattern "{date}-{title}-{n:03}" shoot/ && python3 cli.py undo-rename LOG
+#   python3 cli.py --metrics run.prom apply --template Wedding shoot/ --progress
+#   python3 cli.py index archive/ && python3 cli.py search --tags beach --authors "Jane Doe"
+#   python3 cli.py serve --port 8765 --jobs 8
+#   python3 cli.py shard create /nas/run /nas/archive && python3 cli.py apply --template Wedding --manifest /nas/run
+
+import argparse
+import json
+import logging
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+import instrumentation
+import journal
+import metadata_handler as mh
+import rename_planner
+import sharding
+import xmp_sidecar
+from metadata_index import INDEX_PATH, MetadataIndex
+
+# ----------------------------
+# COMMANDS
+# ----------------------------
+
+def read_one(path, sidecar=True):
+    return {"metadata": mh.read_metadata_from_image(path, raise_errors=True, sidecar=sidecar)}
+
+def gather_metadata(args):
+    """Build a metadata dictionary from --template and per-field options.
+
+    As in the GUI, fields that are neither in the template nor given on the
+    command line are written empty.
+    """
+    metadata = mh.load_template(args.template) if args.template else {}
+    for key in mh.METADATA_FIELDS:
+        value = getattr(args, key.lower())
+        if value is not None:
+            metadata[key] = value
+    return {key: metadata.get(key, "") for key in mh.METADATA_FIELDS}
+
+def emit(record):
+    sys.stdout.write(json.dumps(record, ensure_ascii=False) + "\n")
+    sys.stdout.flush()
+
+def scan_filters(args):
+    return {"include": args.include, "exclude": args.exclude, "modified_since": args.since}
+
+class Progress:
+    """Wraps an on_result callback to show a live file count and files/s on stderr."""
+
+    def __init__(self, on_result):
+        self.on_result = on_result
+        self.rate = instrumentation.RateMeter()
+        self.done = 0
+        self.last_shown = time.monotonic()
+        self.shown = False
+
+    def __call__(self, result):
+        self.on_result(result)
+        self.done += 1
+        self.rate.tick()
+        now = time.monotonic()
+        if now - self.last_shown >= 0.5:
+            self.last_shown = now
+            self.shown = True
+            print(f"\r{self.done} file(s), {self.rate.rate():.1f} files/s", end="", file=sys.stderr, flush=True)
+
+    def finish(self):
+        if self.shown:
+            print(file=sys.stderr)
+
+def with_progress(args, on_result):
+    return Progress(on_result) if args.progress else on_result
+
+def finish_progress(on_result):
+    if isinstance(on_result, Progress):
+        on_result.finish()
+
+def run_batch_command(args, func, *func_args):
+    if args.manifest and getattr(args, "journal", None):
+        raise ValueError("--manifest cannot be combined with --journal.")
+    paths = mh.iter_image_paths(args.paths, recursive=not args.no_recursive, **scan_filters(args))
+    if getattr(args, "update_index", False):
+        # Refresh from results here rather than via write hooks so it also
+        # works when the writes happen in worker processes
+        index = MetadataIndex(args.db)
+
+        def emit_and_index(result):
+            emit(result)
+            if result["status"] == mh.STATUS_OK:
+                index.refresh(result["path"])
+
+        on_result = with_progress(args, emit_and_index)
+    else:
+        on_result = with_progress(args, emit)
+    options = {"jobs": args.jobs, "executor": args.executor, "on_result": on_result}
+    if args.manifest:
+        summary = sharding.run_shards(args.manifest, args.command, func, *func_args, worker_id=args.worker_id,
+                                      ttl=args.lease, wait=not args.no_wait, **options)
+    elif getattr(args, "journal", None):
+        # In sidecar mode the sidecar is what changes, so that is what gets backed up
+        backup_target = xmp_sidecar.sidecar_path if getattr(args, "sidecar", False) else None
+        summary = journal.run_journaled(args.journal, args.command, func, paths, *func_args, resume=args.resume,
+                                        backup=not args.no_backup, backup_target=backup_target,
+                                        fsync_every=args.fsync_every, **options)
+    else:
+        summary = mh.run_batch(func, paths, *func_args, **options)
+    finish_progress(on_result)
+    resumed = f", {summary['resumed']} already done" if summary.get("resumed") else ""
+    if "shards" in summary:
+        resumed += f", {summary['shards']} shard(s) finished"
+        if summary["lost"]:
+            resumed += f", {summary['lost']} taken over by other workers"
+    print(f"{summary['total']} file(s): {summary['ok']} ok, {summary['skipped']} skipped, "
+          f"{summary['failed']} failed in {summary['elapsed']:.2f}s "
+          f"({summary['files_per_second']:.1f} files/s){resumed}", file=sys.stderr)
+    return 1 if summary["failed"] else 0
+
+def cmd_apply(args):
+    if args.dry_run and (args.journal or args.manifest):
+        raise ValueError("--dry-run cannot be combined with --journal or --manifest.")
+    plan = mh.compile_metadata(gather_metadata(args))
+    return run_batch_command(args, mh.apply_metadata_to_image, plan, args.dry_run, args.sidecar)
+
+def cmd_read(args):
+    return run_batch_command(args, read_one, not args.no_sidecar)
+
+def cmd_clear(args):
+    return run_batch_command(args, mh.clear_metadata_from_image, args.sidecar)
+
+def cmd_rollback(args):
+    summary = journal.rollback(args.journal)
+    for failure in summary["failures"]:
+        emit(failure)
+    print(f"{summary['ok']} restored, {summary['failed']} failed in {summary['elapsed']:.2f}s", file=sys.stderr)
+    return 1 if summary["failed"] else 0
+
+def cmd_rename(args):
+    # Sorted so {n} numbers files in a predictable order
+    paths = sorted(mh.iter_image_paths(args.paths, recursive=not args.no_recursive, **scan_filters(args)))
+    plan = rename_planner.plan_renames(paths, args.pattern, base=args.base, start=args.start,
+                                        jobs=args.jobs, executor=args.executor)
+    if args.dry_run:
+        for old, new in plan.renames:
+            emit({"path": old, "status": mh.STATUS_OK, "new_path": new})
+        for conflict in plan.conflicts:
+            emit(conflict)
+        print(f"{len(plan.renames)} to rename, {len(plan.unchanged)} unchanged, "
+              f"{len(plan.conflicts)} conflict(s)", file=sys.stderr)
+        return 1 if plan.conflicts else 0
+    on_result = with_progress(args, emit)
+    summary = rename_planner.execute_renames(plan, undo_log=args.undo_log, jobs=args.jobs, on_result=on_result)
+    finish_progress(on_result)
+    if summary["rolled_back"]:
+        for failure in summary["failures"]:
+            emit(failure)
+    outcome = "rolled back" if summary["rolled_back"] else f"{summary['ok']} renamed"
+    print(f"{summary['total']} file(s): {outcome}, {summary['skipped']} unchanged, {summary['failed']} failed "
+          f"in {summary['elapsed']:.2f}s", file=sys.stderr)
+    if summary["undo_log"]:
+        print(f"Undo with: photo-metadata undo-rename {summary['undo_log']}", file=sys.stderr)
+    return 1 if summary["failed"] else 0
+
+def cmd_undo_rename(args):
+    summary = rename_planner.undo_renames(args.undo_log)
+    for failure in summary["failures"]:
+        emit(failure)
+    print(f"{summary['ok']} of {summary['total']} restored, {summary['failed']} failed "
+          f"in {summary['elapsed']:.2f}s", file=sys.stderr)
+    return 1 if summary["failed"] else 0
+
+def cmd_index(args):
+    index = MetadataIndex(args.db)
+    on_result = with_progress(args, lambda result: None)
+    summary = index.scan(args.paths, recursive=not args.no_recursive, prune=not args.no_prune,
+                         filters=scan_filters(args), on_result=on_result, jobs=args.jobs, executor=args.executor)
+    finish_progress(on_result)
+    for failure in summary["failures"]:
+        emit(failure)
+    print(f"{summary['ok']} indexed, {summary['unchanged']} unchanged, {summary['removed']} removed, "
+          f"{summary['failed']} failed in {summary['elapsed']:.2f}s ({index.count()} in index)", file=sys.stderr)
+    return 1 if summary["failed"] else 0
+
+def cmd_search(args):
+    fields = {key.lower(): getattr(args, key.lower()) for key in mh.METADATA_FIELDS}
+    for path, metadata in MetadataIndex(args.db).search(args.text, limit=args.limit, **fields):
+        emit({"path": path, "metadata": metadata})
+    return 0
+
+def cmd_template(args):
+    if args.action == "list":
+        for name in sorted(mh.list_templates()):
+            print(name)
+    elif args.action == "show":
+        emit(mh.load_template(args.name))
+    elif args.action == "save":
+        print(mh.save_template(args.name, gather_metadata(args)))
+    elif args.action == "delete":
+        mh.delete_template(args.name)
+    return 0
+
+# ----------------------------
+# ARGUMENT PARSING
+# ----------------------------
+
+def cmd_shard(args):
+    if args.action == "create":
+        paths = mh.iter_image_paths(args.paths, recursive=not args.no_recursive, **scan_filters(args))
+        manifest = sharding.create_manifest(args.manifest, paths, shard_size=args.shard_size)
+        print(f"{manifest['files']} file(s) in {manifest['shards']} shard(s)", file=sys.stderr)
+        return 0
+    status = sharding.shard_status(args.manifest, args.operation)
+    emit(status)
+    print(f"{args.operation}: {status['done']}/{status['shards']} shard(s) done, {status['leased']} leased, "
+          f"{status['expired']} expired, {status['pending']} pending; {status['failed']} file(s) failed",
+          file=sys.stderr)
+    return 0
+
+def cmd_serve(args):
+    import server  # Only needed for this command
+    server.serve(args.host, args.port, args.jobs, args.allow_host or ())
+    return 0
+
+def parse_since(value):
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid date '{value}' (expected e.g. 2025-07-24 or 2025-07-24T08:00)")
+
+def add_field_options(parser):
+    parser.add_argument("--template", help="start from a saved template")
+    for key in mh.METADATA_FIELDS:
+        parser.add_argument(f"--{key.lower()}", metavar="TEXT", help=f"set the {key} field")
+
+def add_batch_options(parser, paths_nargs="+"):
+    parser.add_argument("paths", nargs=paths_nargs, help="image files, directories or glob patterns")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="worker count (default: CPU count)")
+    parser.add_argument("--executor", choices=("thread", "process"), default="thread", help="worker pool type")
+    add_scan_options(parser)
+    parser.add_argument("--progress", action="store_true", help="show a live file count and files/s on stderr")
+
+def add_scan_options(parser):
+    parser.add_argument("--no-recursive", action="store_true", help="do not descend into subdirectories")
+    parser.add_argument("--include", action="append", metavar="PATTERN",
+                        help="only scan files matching this name or relative-path pattern (repeatable)")
+    parser.add_argument("--exclude", action="append", metavar="PATTERN",
+                        help="skip files and directories matching this pattern (repeatable)")
+    parser.add_argument("--since", type=parse_since, metavar="DATE",
+                        help="only scan files modified on or after this ISO date/time")
+
+def add_shard_options(parser):
+    parser.add_argument("--manifest", metavar="DIR",
+                        help="process the shards of a manifest made by 'shard create' instead of paths")
+    parser.add_argument("--lease", type=float, default=sharding.LEASE_SECONDS, metavar="SECONDS",
+                        help="seconds without renewal before a worker's shard is taken over")
+    parser.add_argument("--no-wait", action="store_true",
+                        help="exit when nothing is left to claim instead of waiting for other workers' shards")
+    parser.add_argument("--worker-id", help="name for this worker in leases and done markers (default: HOST:PID)")
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="photo-metadata", description="Bulk EXIF metadata tool.")
+    parser.add_argument("--log-level", default="warning", choices=("debug", "info", "warning", "error"),
+                        help="logging level; debug also logs every stage timing")
+    parser.add_argument("--metrics", metavar="FILE",
+                        help="write stage timings, counters and errors on exit (.json for JSON, else Prometheus text)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    apply_parser = commands.add_parser("apply", help="write metadata fields to images")
+    add_field_options(apply_parser)
+    add_batch_options(apply_parser, paths_nargs="*")
+    apply_parser.add_argument("--dry-run", action="store_true", help="report per-file changes without writing")
+    apply_parser.set_defaults(func=cmd_apply)
+
+    read_parser = commands.add_parser("read", help="print the metadata of images")
+    add_batch_options(read_parser, paths_nargs="*")
+    read_parser.add_argument("--no-sidecar", action="store_true", help="ignore XMP sidecars, read embedded EXIF only")
+    read_parser.set_defaults(func=cmd_read)
+
+    clear_parser = commands.add_parser("clear", help="remove all EXIF metadata from images")
+    add_batch_options(clear_parser, paths_nargs="*")
+    clear_parser.set_defaults(func=cmd_clear)
+
+    for batch_parser in (apply_parser, read_parser, clear_parser):
+        add_shard_options(batch_parser)
+
+    for batch_parser in (apply_parser, clear_parser):
+        batch_parser.add_argument("--sidecar", action="store_true",
+                                  help="write the fields to an XMP sidecar (IMAGE.xmp) and leave images untouched")
+        batch_parser.add_argument("--update-index", action="store_true", help="refresh changed files in the metadata index")
+        batch_parser.add_argument("--db", default=INDEX_PATH, help="metadata index database")
+        batch_parser.add_argument("--journal", metavar="FILE", help="record progress so the run can be resumed or rolled back")
+        batch_parser.add_argument("--resume", action="store_true", help="continue the run recorded in --journal")
+        batch_parser.add_argument("--no-backup", action="store_true", help="do not keep originals for rollback")
+        batch_parser.add_argument("--fsync-every", type=int, default=journal.FSYNC_EVERY, metavar="N",
+                                  help="fsync the journal every N files (0 = never)")
+
+    rollback_parser = commands.add_parser("rollback", help="restore originals from a batch journal")
+    rollback_parser.add_argument("journal", help="journal written by apply/clear --journal")
+    rollback_parser.set_defaults(func=cmd_rollback)
+
+    rename_parser = commands.add_parser("rename", help="rename images from a pattern, all or nothing")
+    add_batch_options(rename_parser)
+    rename_parser.add_argument("--pattern", default=rename_planner.DEFAULT_PATTERN,
+                               help=f"new name without extension, using {rename_planner.PATTERN_HELP}")
+    rename_parser.add_argument("--base", default="", help="value of {base}")
+    rename_parser.add_argument("--start", type=int, default=1, help="first value of {n}")
+    rename_parser.add_argument("--dry-run", action="store_true", help="print the new names and conflicts only")
+    rename_parser.add_argument("--undo-log", metavar="FILE", help="where to write the undo log (default: cache folder)")
+    rename_parser.set_defaults(func=cmd_rename)
+
+    undo_rename_parser = commands.add_parser("undo-rename", help="reverse a rename from its undo log")
+    undo_rename_parser.add_argument("undo_log", help="undo log written by rename")
+    undo_rename_parser.set_defaults(func=cmd_undo_rename)
+
+    index_parser = commands.add_parser("index", help="add images to the metadata index")
+    add_batch_options(index_parser)
+    index_parser.add_argument("--db", default=INDEX_PATH, help="metadata index database")
+    index_parser.add_argument("--no-prune", action="store_true", help="keep entries for files that were deleted")
+    index_parser.set_defaults(func=cmd_index)
+
+    search_parser = commands.add_parser("search", help="search the metadata index")
+    search_parser.add_argument("text", nargs="?", help="match any field")
+    for key in mh.METADATA_FIELDS:
+        search_parser.add_argument(f"--{key.lower()}", metavar="TEXT", help=f"match the {key} field")
+    search_parser.add_argument("--limit", type=int, default=None)
+    search_parser.add_argument("--db", default=INDEX_PATH, help="metadata index database")
+    search_parser.set_defaults(func=cmd_search)
+
+    template_parser = commands.add_parser("template", help="manage metadata templates")
+    template_parser.add_argument("action", choices=("list", "show", "save", "delete"))
+    template_parser.add_argument("name", nargs="?")
+    add_field_options(template_parser)
+    template_parser.set_defaults(func=cmd_template)
+
+    shard_parser = commands.add_parser("shard", help="split a batch run across workers and hosts")
+    shard_parser.add_argument("action", choices=("create", "status"))
+    shard_parser.add_argument("manifest", metavar="DIR", help="manifest directory on the shared filesystem")
+    shard_parser.add_argument("paths", nargs="*", help="create: image files, directories or glob patterns")
+    add_scan_options(shard_parser)
+    shard_parser.add_argument("--shard-size", type=int, default=sharding.DEFAULT_SHARD_SIZE, metavar="N",
+                              help="files per shard")
+    shard_parser.add_argument("--operation", choices=("apply", "read", "clear"), default="apply",
+                              help="status: which run to report on")
+    shard_parser.set_defaults(func=cmd_shard)
+
+    serve_parser = commands.add_parser("serve", help="run the local HTTP tagging service")
+    serve_parser.add_argument("--host", default="127.0.0.1", help="address to listen on (default: localhost only)")
+    serve_parser.add_argument("--port", type=int, default=8765)
+    serve_parser.add_argument("--jobs", type=int, default=None, help="worker threads (default: CPU count)")
+    serve_parser.add_argument("--allow-host", action="append", metavar="NAME",
+                              help="also accept requests addressed to this host name (repeatable)")
+    serve_parser.set_defaults(func=cmd_serve)
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command == "template" and args.action != "list" and not args.name:
+        parser.error(f"template {args.action} requires a template name")
+    if args.command == "shard" and args.action == "create" and not args.paths:
+        parser.error("shard create requires image paths")
+    if args.command in ("apply", "read", "clear") and bool(args.paths) == bool(args.manifest):
+        parser.error(f"{args.command} requires either image paths or --manifest")
+    if (args.command == "apply" and not args.template
+            and all(getattr(args, key.lower()) is None for key in mh.METADATA_FIELDS)):
+        # Otherwise every field would be written empty
+        parser.error("apply requires --template, a field option or both")
+    logging.basicConfig(level=args.log_level.upper(), format="%(levelname)s %(name)s: %(message)s")
+    sinks = []
+    if args.log_level == "debug":
+        sinks.append(instrumentation.LoggingSink())
+    if args.metrics:
+        metrics = instrumentation.MetricsSink()
+        sinks.append(metrics)
+    if sinks:
+        mh.set_instrumentation(sinks[0] if len(sinks) == 1 else instrumentation.MultiSink(*sinks))
+    try:
+        return args.func(args)
+    except (OSError, ValueError, sqlite3.Error) as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 2
+    finally:
+        if args.metrics:
+            with open(args.metrics, "w", encoding="utf-8") as f:
+                f.write(metrics.to_json() if args.metrics.endswith(".json") else metrics.to_prometheus())
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+# contact_sheet.py
+#
+# Scrollable thumbnail grid for the selected images. Only the rows in view
+# (plus one row of margin) have canvas items and PhotoImages; thumbnails are
+# loaded from the ThumbnailStore in the background and handed back to the Tk
+# main loop through a queue.
+
+import os
+import queue
+import tkinter as tk
+from tkinter import ttk
+from PIL import ImageTk
+
+CELL_PADDING = 12
+LABEL_HEIGHT = 20
+
+class ContactSheet:
+    def __init__(self, root, image_paths, store, on_select):
+        self.root = root
+        self.image_paths = image_paths
+        self.store = store
+        self.on_select = on_select
+        self.cell_width = store.size + CELL_PADDING
+        self.cell_height = store.size + CELL_PADDING + LABEL_HEIGHT
+        self.columns = 0
+        self.cells = {}  # index -> dict of canvas items, photo and pending future
+        self.results = queue.Queue()
+        self.render_after_id = None
+        self.closed = False
+
+        self.window = tk.Toplevel(root)
+        self.window.title(f"🗂️ Contact Sheet ({len(image_paths)} images)")
+        self.window.geometry("900x700")
+        self.canvas = tk.Canvas(self.window, bg="gray20", highlightthickness=0)
+        scrollbar = ttk.Scrollbar(self.window, orient="vertical", command=self._on_scrollbar)
+        self.canvas.configure(yscrollcommand=scrollbar.set)
+        self.canvas.pack(side="left", fill="both", expand=True)
+        scrollbar.pack(side="right", fill="y")
+
+        self.canvas.bind("<Configure>", lambda e: self._schedule_render())
+        self.canvas.bind("<MouseWheel>", self._on_mousewheel)
+        self.canvas.bind("<Button-4>", lambda e: self._scroll(-1))
+        self.canvas.bind("<Button-5>", lambda e: self._scroll(1))
+        self.canvas.bind("<Button-1>", self._on_click)
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+        self._poll_results()
+
+    # ----------------------------
+    # SCROLLING
+    # ----------------------------
+
+    def _on_scrollbar(self, *args):
+        self.canvas.yview(*args)
+        self._schedule_render()
+
+    def _on_mousewheel(self, event):
+        self._scroll(-1 * (event.delta // 120))
+
+    def _scroll(self, units):
+        self.canvas.yview_scroll(units, "units")
+        self._schedule_render()
+
+    def _schedule_render(self):
+        if self.render_after_id is None:
+            self.render_after_id = self.root.after(30, self._render)
+
+    # ----------------------------
+    # RENDERING
+    # ----------------------------
+
+    def _render(self):
+        self.render_after_id = None
+        width = max(self.canvas.winfo_width(), self.cell_width)
+        height = self.canvas.winfo_height()
+        columns = max(1, width // self.cell_width)
+        if columns != self.columns:
+            # Cell positions depend on the column count, so start over
+            for index in list(self.cells):
+                self._drop_cell(index)
+            self.columns = columns
+        rows = -(-len(self.image_paths) // columns)
+        self.canvas.configure(scrollregion=(0, 0, columns * self.cell_width, rows * self.cell_height),
+                              yscrollincrement=self.cell_height // 4)
+
+        top = self.canvas.canvasy(0)
+        first_row = max(0, int(top // self.cell_height) - 1)
+        last_row = int((top + height) // self.cell_height) + 1
+        visible = range(first_row * columns, min(len(self.image_paths), (last_row + 1) * columns))
+
+        for index in list(self.cells):
+            if index not in visible:
+                self._drop_cell(index)
+        for index in visible:
+            if index not in self.cells:
+                self._draw_cell(index)
+
+    def _cell_origin(self, index):
+        row, column = divmod(index, self.columns)
+        return column * self.cell_width, row * self.cell_height
+
+    def _draw_cell(self, index):
+        x, y = self._cell_origin(index)
+        size = self.store.size
+        path = self.image_paths[index]
+        name = os.path.basename(path)
+        if len(name) > 24:
+            name = name[:21] + "..."
+        items = [
+            self.canvas.create_rectangle(x + 6, y + 6, x + 6 + size, y + 6 + size, outline="gray40"),
+            self.canvas.create_text(x + self.cell_width // 2, y + size + 6 + LABEL_HEIGHT // 2 + 2,
+                                    text=name, fill="white", font=("Segoe UI", 8)),
+        ]
+        future = self.store.submit(path)
+        future.add_done_callback(lambda f, index=index, path=path: self.results.put((index, path, f)))
+        self.cells[index] = {"items": items, "photo": None, "future": future}
+
+    def _drop_cell(self, index):
+        cell = self.cells.pop(index)
+        cell["future"].cancel()
+        for item in cell["items"]:
+            self.canvas.delete(item)
+
+    def _poll_results(self):
+        try:
+            while True:
+                index, path, future = self.results.get_nowait()
+                cell = self.cells.get(index)
+                if cell is None or cell["future"] is not future or self.image_paths[index:index + 1] != [path]:
+                    continue
+                try:
+                    image = future.result()
+                except Exception:
+                    continue
+                x, y = self._cell_origin(index)
+                size = self.store.size
+                cell["photo"] = ImageTk.PhotoImage(image)
+                cell["items"].append(self.canvas.create_image(x + 6 + size // 2, y + 6 + size // 2,
+                                                              image=cell["photo"], anchor="center"))
+        except queue.Empty:
+            pass
+        if not self.closed:
+            self.root.after(50, self._poll_results)
+
+    # ----------------------------
+    # SELECTION
+    # ----------------------------
+
+    def _on_click(self, event):
+        if not self.columns:
+            return
+        x, y = self.canvas.canvasx(event.x), self.canvas.canvasy(event.y)
+        column = int(x // self.cell_width)
+        if column >= self.columns:
+            return
+        index = int(y // self.cell_height) * self.columns + column
+        if 0 <= index < len(self.image_paths):
+            self.on_select(index)
+
+    def close(self):
+        self.closed = True
+        for index in list(self.cells):
+            self._drop_cell(index)
+        self.window.destroy()
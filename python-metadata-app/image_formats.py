@@ -0,0 +1,408 @@
+# image_formats.py
+#
+# Structural metadata I/O for the non-JPEG formats the handler writes in place:
+# PNG (eXIf chunk), WebP (RIFF EXIF chunk) and TIFF (IFD entries). Only chunk
+# and directory headers are parsed; pixel data is copied through byte for byte
+# and never decoded. Like xmp_sidecar this module only deals in bytes and open
+# files; metadata_handler does the atomic writes, caching and instrumentation.
+
+import os
+import zlib
+
+# Byte size of one value of each TIFF field type (13 is IFD, an offset)
+TIFF_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8, 13: 4}
+TIFF_LONG = 4
+
+# Some writers wrongly keep the JPEG "Exif\0\0" header in PNG and WebP chunks
+_EXIF_PREFIX = b"Exif\x00\x00"
+
+# ----------------------------
+# COPYING
+# ----------------------------
+
+def copy_range(src, out, offset, length):
+    """Copy length bytes of src starting at offset to the end of out.
+
+    Uses copy_file_range where the OS has it, so the kernel (or a reflink on
+    filesystems that support it) does the copy without passing the data
+    through Python. Returns the number of bytes copied.
+    """
+    out.flush()
+    copied = 0
+    if hasattr(os, "copy_file_range"):
+        try:
+            while copied < length:
+                n = os.copy_file_range(src.fileno(), out.fileno(), length - copied, offset + copied)
+                if not n:
+                    break
+                copied += n
+        except OSError:
+            pass  # Not supported for these files; finish with a plain copy
+        out.seek(0, os.SEEK_END)
+    src.seek(offset + copied)
+    while copied < length:
+        block = src.read(min(length - copied, 1024 * 1024))
+        if not block:
+            break
+        out.write(block)
+        copied += len(block)
+    return copied
+
+def write_pieces(src, out, pieces):
+    """Write a list of bytes objects and (offset, length) ranges of src to out.
+
+    Adjacent ranges are merged so runs of untouched chunks (such as the many
+    IDAT chunks of a PNG) become a single copy.
+    """
+    merged = []
+    for piece in pieces:
+        if isinstance(piece, tuple) and merged and isinstance(merged[-1], tuple) \
+                and sum(merged[-1]) == piece[0]:
+            merged[-1] = (merged[-1][0], merged[-1][1] + piece[1])
+        else:
+            merged.append(piece)
+    for piece in merged:
+        if isinstance(piece, tuple):
+            copied = copy_range(src, out, *piece)
+            if copied < piece[1]:
+                raise ValueError("Image file was truncated while being rewritten.")
+        else:
+            out.write(piece)
+
+def _strip_exif_prefix(data):
+    return data[len(_EXIF_PREFIX):] if data.startswith(_EXIF_PREFIX) else data
+
+# ----------------------------
+# PNG
+# ----------------------------
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+PNG_TEXT_CHUNKS = (b"tEXt", b"zTXt", b"iTXt")
+# Text chunk keywords holding Exif (ImageMagick's raw profiles) and XMP
+PNG_EXIF_KEYWORDS = {b"Raw profile type exif", b"Raw profile type APP1"}
+PNG_XMP_KEYWORDS = {b"XML:com.adobe.xmp", b"Raw profile type xmp"}
+
+def iter_png_chunks(f, stop_at=None):
+    """Yield (type, offset, length, keyword) for each chunk of an open PNG.
+
+    Chunk data is skipped with seek; only text chunks have their keyword
+    read. offset is where the chunk's length field starts and length is the
+    size of its data, so the whole chunk spans 12 + length bytes. Stops after
+    IEND, or before the first chunk whose type is stop_at.
+    """
+    f.seek(0)
+    if f.read(8) != PNG_SIGNATURE:
+        raise ValueError("Not a PNG file.")
+    size = os.fstat(f.fileno()).st_size
+    offset = 8
+    while offset < size:
+        header = f.read(8)
+        if len(header) < 8:
+            raise ValueError("Unexpected end of file in PNG chunk header.")
+        length, chunk_type = int.from_bytes(header[:4], "big"), header[4:]
+        if offset + 12 + length > size:
+            raise ValueError(f"Truncated PNG chunk {chunk_type!r}.")
+        if chunk_type == stop_at:
+            return
+        keyword = None
+        if chunk_type in PNG_TEXT_CHUNKS:
+            keyword = f.read(min(length, 80)).split(b"\x00", 1)[0]
+        yield chunk_type, offset, length, keyword
+        if chunk_type == b"IEND":
+            return
+        offset += 12 + length
+        f.seek(offset)
+
+def find_png_exif(f):
+    """Return the TIFF data of a PNG's eXIf chunk, or None.
+
+    Only the chunks before the image data are looked at; eXIf has to come
+    before the first IDAT.
+    """
+    for chunk_type, offset, length, _ in iter_png_chunks(f, stop_at=b"IDAT"):
+        if chunk_type == b"eXIf":
+            f.seek(offset + 8)
+            return _strip_exif_prefix(f.read(length))
+    return None
+
+def encode_png_chunk(chunk_type, data):
+    crc = zlib.crc32(chunk_type + data)
+    return len(data).to_bytes(4, "big") + chunk_type + data + crc.to_bytes(4, "big")
+
+def _is_png_metadata(chunk_type, keyword, xmp):
+    if chunk_type == b"eXIf":
+        return True
+    if chunk_type in PNG_TEXT_CHUNKS:
+        return keyword in PNG_EXIF_KEYWORDS or (xmp and keyword in PNG_XMP_KEYWORDS)
+    return False
+
+def png_has_metadata(f, xmp=True):
+    return any(_is_png_metadata(t, k, xmp) for t, _, _, k in iter_png_chunks(f))
+
+def write_png(src, out, exif, xmp=False):
+    """Copy a PNG with its Exif replaced by exif (TIFF data, or None to remove).
+
+    Existing eXIf chunks and Exif text profiles are dropped and the new eXIf
+    goes right before the first IDAT. With xmp, XMP packets are dropped too.
+    """
+    pieces = [PNG_SIGNATURE]
+    inserted = exif is None
+    for chunk_type, offset, length, keyword in iter_png_chunks(src):
+        if _is_png_metadata(chunk_type, keyword, xmp):
+            continue
+        if not inserted and chunk_type in (b"IDAT", b"IEND"):
+            pieces.append(encode_png_chunk(b"eXIf", exif))
+            inserted = True
+        pieces.append((offset, 12 + length))
+    write_pieces(src, out, pieces)
+
+# ----------------------------
+# WEBP
+# ----------------------------
+
+# VP8X feature flags
+WEBP_ICC = 0x20
+WEBP_ALPHA = 0x10
+WEBP_EXIF = 0x08
+WEBP_XMP = 0x04
+WEBP_ANIMATION = 0x02
+
+def read_webp_chunks(f):
+    """Return [(fourcc, offset, size)] for the chunks of an open WebP file.
+
+    offset is where the chunk header starts and size is the payload size
+    without the pad byte.
+    """
+    f.seek(0)
+    header = f.read(12)
+    if header[:4] != b"RIFF" or header[8:12] != b"WEBP":
+        raise ValueError("Not a WebP file.")
+    end = min(8 + int.from_bytes(header[4:8], "little"), os.fstat(f.fileno()).st_size)
+    chunks = []
+    offset = 12
+    while offset + 8 <= end:
+        chunk_header = f.read(8)
+        fourcc, size = chunk_header[:4], int.from_bytes(chunk_header[4:8], "little")
+        if offset + 8 + size > end:
+            raise ValueError(f"Truncated WebP chunk {fourcc!r}.")
+        chunks.append((fourcc, offset, size))
+        offset += 8 + size + (size & 1)
+        f.seek(offset)
+    return chunks
+
+def _read_payload(f, chunk):
+    f.seek(chunk[1] + 8)
+    return f.read(chunk[2])
+
+def find_webp_exif(f):
+    """Return the TIFF data of a WebP's EXIF chunk, or None."""
+    for chunk in read_webp_chunks(f):
+        if chunk[0] == b"EXIF":
+            return _strip_exif_prefix(_read_payload(f, chunk))
+    return None
+
+def webp_has_metadata(f):
+    return any(fourcc in (b"EXIF", b"XMP ") for fourcc, _, _ in read_webp_chunks(f))
+
+def _encode_webp_chunk(fourcc, payload):
+    return fourcc + len(payload).to_bytes(4, "little") + payload + b"\x00" * (len(payload) & 1)
+
+def _webp_canvas(f, chunks):
+    """Return (width, height, has_alpha) from a simple WebP's bitstream header."""
+    for chunk in chunks:
+        if chunk[0] == b"VP8 ":
+            data = _read_payload(f, chunk)[:10]
+            if len(data) < 10 or data[3:6] != b"\x9d\x01\x2a":
+                raise ValueError("Invalid VP8 bitstream header.")
+            width = int.from_bytes(data[6:8], "little") & 0x3FFF
+            height = int.from_bytes(data[8:10], "little") & 0x3FFF
+            return width, height, False
+        if chunk[0] == b"VP8L":
+            data = _read_payload(f, chunk)[:5]
+            if len(data) < 5 or data[0] != 0x2F:
+                raise ValueError("Invalid VP8L bitstream header.")
+            bits = int.from_bytes(data[1:5], "little")
+            return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1, bool(bits >> 28 & 1)
+    raise ValueError("WebP file has no image data.")
+
+def write_webp(src, out, exif, xmp=False):
+    """Copy a WebP with its EXIF chunk replaced by exif (TIFF data, or None to remove).
+
+    Simple (VP8/VP8L only) files are converted to the extended format, since
+    only that can carry metadata; the VP8X flags are kept in step with the
+    chunks present. With xmp, the XMP chunk is dropped too.
+    """
+    chunks = read_webp_chunks(src)
+    dropped = {b"EXIF", b"XMP "} if xmp else {b"EXIF"}
+    kept = [chunk for chunk in chunks if chunk[0] not in dropped]
+    if kept and kept[0][0] == b"VP8X":
+        vp8x = bytearray(_read_payload(src, kept.pop(0)))
+    elif exif is not None:
+        width, height, alpha = _webp_canvas(src, kept)
+        vp8x = bytearray(b"\x00" * 4 + (width - 1).to_bytes(3, "little") + (height - 1).to_bytes(3, "little"))
+        vp8x[0] = WEBP_ALPHA if alpha else 0
+    else:
+        vp8x = None
+
+    new_chunks = [(chunk[0], (chunk[1], 8 + chunk[2] + (chunk[2] & 1))) for chunk in kept]
+    if exif is not None:
+        # EXIF goes after the image data and before XMP
+        position = next((i for i, (fourcc, _) in enumerate(new_chunks) if fourcc == b"XMP "), len(new_chunks))
+        new_chunks.insert(position, (b"EXIF", _encode_webp_chunk(b"EXIF", exif)))
+    if vp8x is not None:
+        present = {fourcc for fourcc, _ in new_chunks}
+        vp8x[0] &= ~(WEBP_EXIF | WEBP_XMP)
+        vp8x[0] |= (WEBP_EXIF if b"EXIF" in present else 0) | (WEBP_XMP if b"XMP " in present else 0)
+        new_chunks.insert(0, (b"VP8X", _encode_webp_chunk(b"VP8X", bytes(vp8x))))
+
+    pieces = [piece for _, piece in new_chunks]
+    riff_size = 4 + sum(piece[1] if isinstance(piece, tuple) else len(piece) for piece in pieces)
+    write_pieces(src, out, [b"RIFF" + riff_size.to_bytes(4, "little") + b"WEBP"] + pieces)
+
+# ----------------------------
+# TIFF
+# ----------------------------
+
+def tiff_header(buf):
+    """Return (byte order, IFD0 offset) of a classic TIFF file."""
+    if buf[:4] == b"II*\x00":
+        byte_order = "little"
+    elif buf[:4] == b"MM\x00*":
+        byte_order = "big"
+    elif buf[:4] in (b"II+\x00", b"MM\x00+"):
+        raise ValueError("BigTIFF files are not supported.")
+    else:
+        raise ValueError("Not a TIFF file.")
+    return byte_order, int.from_bytes(buf[4:8], byte_order)
+
+def read_tiff_ifd(buf, offset, byte_order):
+    """Return ([(entry offset, tag, (type, count, value field))], next IFD offset) for one IFD.
+
+    Entries are listed in file order, which the TIFF spec says is ascending
+    tag order but some writers ignore. The value field is the raw 4 bytes of
+    the entry: the value itself when it fits, otherwise its offset.
+    """
+    if offset < 8 or offset + 2 > len(buf):
+        raise ValueError(f"TIFF IFD offset {offset} is outside the file.")
+    count = int.from_bytes(buf[offset:offset + 2], byte_order)
+    end = offset + 2 + count * 12
+    if end + 4 > len(buf):
+        raise ValueError(f"TIFF IFD at offset {offset} runs past the end of the file.")
+    entries = []
+    for entry in range(offset + 2, end, 12):
+        entries.append((entry, int.from_bytes(buf[entry:entry + 2], byte_order),
+                        (int.from_bytes(buf[entry + 2:entry + 4], byte_order),
+                         int.from_bytes(buf[entry + 4:entry + 8], byte_order),
+                         bytes(buf[entry + 8:entry + 12]))))
+    return entries, int.from_bytes(buf[end:end + 4], byte_order)
+
+def read_tiff_entries(buf, offset, byte_order):
+    """Return ({tag: (type, count, value field)}, next IFD offset) for one IFD.
+
+    Of duplicated tags, the last one wins.
+    """
+    entries, next_ifd = read_tiff_ifd(buf, offset, byte_order)
+    return {tag: entry for _, tag, entry in entries}, next_ifd
+
+class _TiffUpdate:
+    """Patches and appended data that turn a TIFF file into its updated copy."""
+
+    def __init__(self, buf, byte_order):
+        self.buf = buf
+        self.byte_order = byte_order
+        self.patches = []
+        self.appendix = bytearray()
+
+    def pack(self, value, size=4):
+        return value.to_bytes(size, self.byte_order)
+
+    def allocate(self, data):
+        """Append data (word aligned, as TIFF requires) and return its offset."""
+        if (len(self.buf) + len(self.appendix)) & 1:
+            self.appendix += b"\x00"
+        offset = len(self.buf) + len(self.appendix)
+        if offset + len(data) > 0xFFFFFFFF:
+            raise ValueError("TIFF file would exceed 4 GB.")
+        self.appendix += data
+        return offset
+
+    def entry(self, field_type, data):
+        """Return (type, count, value field) for a new value, allocating it if needed."""
+        count = len(data) // TIFF_TYPE_SIZES[field_type]
+        if len(data) <= 4:
+            return field_type, count, data.ljust(4, b"\x00")
+        return field_type, count, self.pack(self.allocate(data))
+
+    def encode_entry(self, tag, entry):
+        field_type, count, field = entry
+        return self.pack(tag, 2) + self.pack(field_type, 2) + self.pack(count) + field
+
+    def update_ifd(self, offset, changes):
+        """Apply {tag: (type, data) or None} to the IFD at offset (None: none yet).
+
+        Changed entries are rewritten in place when the IFD keeps the same
+        tags and is well formed (ascending tags, no duplicates); otherwise a
+        new, sorted IFD is appended. Returns the IFD's offset.
+        """
+        if offset is None:
+            listed, next_ifd = [], 0
+        else:
+            listed, next_ifd = read_tiff_ifd(self.buf, offset, self.byte_order)
+        entries = {tag: entry for _, tag, entry in listed}
+        tags = [tag for _, tag, _ in listed]
+        in_order = all(a < b for a, b in zip(tags, tags[1:]))
+        updated = dict(entries)
+        for tag, value in changes.items():
+            if value is None:
+                updated.pop(tag, None)
+            else:
+                updated[tag] = self.entry(*value)
+        if updated == entries:
+            return offset
+        if offset is not None and in_order and updated.keys() == entries.keys():
+            for entry_offset, tag, entry in listed:
+                if updated[tag] != entry:
+                    self.patches.append((entry_offset, self.encode_entry(tag, updated[tag])))
+            return offset
+        ifd = self.pack(len(updated), 2) + b"".join(self.encode_entry(tag, updated[tag]) for tag in sorted(updated))
+        return self.allocate(ifd + self.pack(next_ifd))
+
+def update_tiff(buf, zeroth, exif, exif_pointer_tag):
+    """Plan changes to the tags of a TIFF file's IFD0 and Exif IFD.
+
+    zeroth and exif map tags to (field type, value bytes), or to None to
+    remove the tag. An Exif IFD is created if needed, and removing
+    exif_pointer_tag from IFD0 drops the whole Exif IFD. Returns (patches,
+    appendix): (offset, bytes) pairs to write over a copy of the file, and
+    bytes to append to it. The existing image data never moves, so every
+    offset in the file stays valid.
+    """
+    byte_order, ifd0_offset = tiff_header(buf)
+    update = _TiffUpdate(buf, byte_order)
+    zeroth = dict(zeroth)
+    if exif and zeroth.get(exif_pointer_tag, ()) is not None:
+        entries, _ = read_tiff_entries(buf, ifd0_offset, byte_order)
+        pointer = entries.get(exif_pointer_tag)
+        exif_offset = int.from_bytes(pointer[2], byte_order) if pointer else None
+        if exif_offset is None and not any(exif.values()):
+            new_offset = None  # Nothing to add to an Exif IFD that does not exist
+        else:
+            new_offset = update.update_ifd(exif_offset, exif)
+        if new_offset != exif_offset:
+            field_type = pointer[0] if pointer else TIFF_LONG
+            zeroth[exif_pointer_tag] = (field_type, update.pack(new_offset))
+    new_ifd0 = update.update_ifd(ifd0_offset, zeroth)
+    if new_ifd0 != ifd0_offset:
+        update.patches.append((4, update.pack(new_ifd0)))
+    return update.patches, bytes(update.appendix)
+
+def write_tiff(src, out, patches, appendix):
+    """Copy a TIFF file, apply update_tiff's patches and append its new data."""
+    size = os.fstat(src.fileno()).st_size
+    if copy_range(src, out, 0, size) < size:
+        raise ValueError("Image file was truncated while being rewritten.")
+    for offset, data in patches:
+        out.seek(offset)
+        out.write(data)
+    out.seek(0, os.SEEK_END)
+    out.write(appendix)
@@ -9,7 +9,7 @@ echo "📸 Installing Photo Metadata Tool..."
 
 # Create install directory
 mkdir -p "$INSTALL_DIR"
-cp main.py metadata_handler.py icon.png "$INSTALL_DIR"
+cp main.py metadata_handler.py cli.py preview.py thumbnails.py contact_sheet.py metadata_index.py journal.py rename_planner.py instrumentation.py xmp_sidecar.py image_formats.py async_handler.py server.py sharding.py icon.png "$INSTALL_DIR"
 
 # Create launcher
 cat > "$DESKTOP_FILE" <<EOF
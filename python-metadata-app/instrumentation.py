@@ -0,0 +1,217 @@
+# instrumentation.py
+#
+# Sinks for the instrumentation hook in metadata_handler. The handler reports
+# stage timings ("piexif.dump", "file.write", ...), counters (bytes read and
+# written, cache hits and misses, files per status) and errors to a single
+# sink set with metadata_handler.set_instrumentation. The default NullSink
+# drops everything.
+
+import json
+import logging
+import re
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+class NullSink:
+    """Discards every event. The default sink."""
+
+    def observe(self, stage, seconds):
+        pass
+
+    def increment(self, counter, amount=1):
+        pass
+
+    def error(self, operation, exception):
+        pass
+
+class LoggingSink(NullSink):
+    """Writes every event to a logger; errors are logged as warnings."""
+
+    def __init__(self, log=logger, level=logging.DEBUG):
+        self.log = log
+        self.level = level
+
+    def observe(self, stage, seconds):
+        self.log.log(self.level, "%s took %.3f ms", stage, seconds * 1000)
+
+    def increment(self, counter, amount=1):
+        self.log.log(self.level, "%s += %s", counter, amount)
+
+    def error(self, operation, exception):
+        self.log.warning("%s failed: %s: %s", operation, type(exception).__name__, exception)
+
+class MultiSink(NullSink):
+    """Forwards every event to several sinks."""
+
+    def __init__(self, *sinks):
+        self.sinks = sinks
+
+    def observe(self, stage, seconds):
+        for sink in self.sinks:
+            sink.observe(stage, seconds)
+
+    def increment(self, counter, amount=1):
+        for sink in self.sinks:
+            sink.increment(counter, amount)
+
+    def error(self, operation, exception):
+        for sink in self.sinks:
+            sink.error(operation, exception)
+
+class MetricsSink(NullSink):
+    """Aggregates events in memory for export as JSON or Prometheus text.
+
+    Safe to share between threads. Counters named "<cache>.hit" and
+    "<cache>.miss" are reported as a hit rate per cache.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages = {}    # stage -> [count, total seconds, max seconds]
+        self.counters = {}
+        self.errors = {}    # (operation, exception type) -> count
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            entry = self.stages.setdefault(stage, [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+
+    def increment(self, counter, amount=1):
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def error(self, operation, exception):
+        key = (operation, type(exception).__name__)
+        with self._lock:
+            self.errors[key] = self.errors.get(key, 0) + 1
+
+    def hit_rates(self):
+        rates = {}
+        with self._lock:
+            counters = dict(self.counters)
+        for name, hits in counters.items():
+            if name.endswith(".hit"):
+                cache = name[:-len(".hit")]
+                lookups = hits + counters.get(cache + ".miss", 0)
+                rates[cache] = hits / lookups if lookups else 0.0
+        for name in counters:
+            if name.endswith(".miss"):
+                rates.setdefault(name[:-len(".miss")], 0.0)
+        return rates
+
+    def snapshot(self):
+        with self._lock:
+            stages = {stage: {"count": count, "total_seconds": total, "mean_seconds": total / count,
+                              "max_seconds": peak}
+                      for stage, (count, total, peak) in self.stages.items()}
+            counters = dict(self.counters)
+            errors = [{"operation": operation, "type": kind, "count": count}
+                      for (operation, kind), count in self.errors.items()]
+        return {"stages": stages, "counters": counters, "errors": errors, "cache_hit_rates": self.hit_rates()}
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2, sort_keys=True)
+
+    def to_prometheus(self, prefix="photo_metadata"):
+        """Render the metrics in the Prometheus text exposition format."""
+        snapshot = self.snapshot()
+        lines = [f"# TYPE {prefix}_stage_seconds summary"]
+        for stage, values in sorted(snapshot["stages"].items()):
+            labels = f'{{stage="{_label(stage)}"}}'
+            lines.append(f"{prefix}_stage_seconds_count{labels} {values['count']}")
+            lines.append(f"{prefix}_stage_seconds_sum{labels} {values['total_seconds']:.6f}")
+        lines.append(f"# TYPE {prefix}_stage_seconds_max gauge")
+        for stage, values in sorted(snapshot["stages"].items()):
+            lines.append(f'{prefix}_stage_seconds_max{{stage="{_label(stage)}"}} {values["max_seconds"]:.6f}')
+        for counter, value in sorted(snapshot["counters"].items()):
+            name = f"{prefix}_{_metric_name(counter)}_total"
+            lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name} {value}")
+        lines.append(f"# TYPE {prefix}_errors_total counter")
+        for error in snapshot["errors"]:
+            lines.append(f'{prefix}_errors_total{{operation="{_label(error["operation"])}",'
+                         f'type="{_label(error["type"])}"}} {error["count"]}')
+        lines.append(f"# TYPE {prefix}_cache_hit_ratio gauge")
+        for cache, rate in sorted(snapshot["cache_hit_rates"].items()):
+            lines.append(f'{prefix}_cache_hit_ratio{{cache="{_label(cache)}"}} {rate:.4f}')
+        return "\n".join(lines) + "\n"
+
+def _metric_name(name):
+    return re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class RateMeter:
+    """Events per second over a sliding time window, for live progress."""
+
+    def __init__(self, window=5.0):
+        self.window = window
+        self._times = deque()
+
+    def tick(self, count=1):
+        now = time.monotonic()
+        self._times.extend([now] * count)
+        self._trim(now)
+
+    def rate(self):
+        now = time.monotonic()
+        self._trim(now)
+        if len(self._times) < 2:
+            return 0.0
+        span = max(now - self._times[0], 1e-9)
+        return len(self._times) / span
+
+    def _trim(self, now):
+        while self._times and now - self._times[0] > self.window:
+            self._times.popleft()
+
+class StartupProfiler:
+    """Named checkpoints of application start-up, timed from a start point.
+
+    start is a time.perf_counter() value taken as early as possible (before
+    the heavy imports). budget, in seconds, is how long the checkpoint named
+    budget_mark may take; over_budget() says whether it did. mark() may be
+    called from any thread.
+    """
+
+    def __init__(self, start=None, budget=None, budget_mark="first paint"):
+        self.start = time.perf_counter() if start is None else start
+        self.budget = budget
+        self.budget_mark = budget_mark
+        self._lock = threading.Lock()
+        self.marks = []    # (name, seconds since start)
+
+    def mark(self, name, at=None):
+        """Record checkpoint name now, or at an earlier time.perf_counter() value."""
+        at = time.perf_counter() if at is None else at
+        with self._lock:
+            self.marks.append((name, at - self.start))
+
+    def elapsed(self, name):
+        with self._lock:
+            return next((seconds for mark, seconds in self.marks if mark == name), None)
+
+    def over_budget(self):
+        elapsed = self.elapsed(self.budget_mark)
+        return self.budget is not None and elapsed is not None and elapsed > self.budget
+
+    def report(self):
+        """Return a table of every checkpoint, the time since the previous one and the budget."""
+        with self._lock:
+            marks = sorted(self.marks, key=lambda mark: mark[1])
+        lines = [f"{'checkpoint':<24}{'at (ms)':>10}{'step (ms)':>11}"]
+        previous = 0.0
+        for name, seconds in marks:
+            lines.append(f"{name:<24}{seconds * 1000:>10.1f}{(seconds - previous) * 1000:>11.1f}")
+            previous = seconds
+        if self.budget is not None:
+            elapsed = self.elapsed(self.budget_mark)
+            verdict = "not reached" if elapsed is None else "over budget" if elapsed > self.budget else "ok"
+            lines.append(f"budget: {self.budget_mark} within {self.budget * 1000:.0f} ms: {verdict}")
+        return "\n".join(lines)
@@ -0,0 +1,293 @@
+# journal.py
+#
+# Resumable batch runs. Progress is recorded in an append-only JSON-lines
+# journal so an interrupted run can pick up where it stopped, and originals are
+# kept as hard links in a backup folder so a run can be rolled back.
+#
+# Hard links are only taken where mh.atomic_write replaces the file (see there);
+# files it writes in place are copied instead.
+
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import time
+import image_formats
+import metadata_handler as mh
+
+# Files are marked done in the journal, which is then fsynced, in groups of this size
+FSYNC_EVERY = 100
+
+# Backup name suffix recording that the changed file did not exist before
+ABSENT_SUFFIX = ".absent"
+# Suffix of the record, next to each backup, naming the file it belongs to
+RECORD_SUFFIX = ".json"
+
+def backup_dir_for(journal_path):
+    return os.path.abspath(journal_path) + ".backup"
+
+def backup_path_for(backup_dir, path):
+    """Stable backup name for a file, so a resumed run reuses its backup."""
+    abspath = os.path.abspath(path)
+    digest = hashlib.sha1(abspath.encode("utf-8", errors="surrogateescape")).hexdigest()
+    return os.path.join(backup_dir, digest + os.path.splitext(path)[1])
+
+def record_path_for(backup):
+    """Path of the record belonging to a backup (".absent" or not)."""
+    if backup.endswith(ABSENT_SUFFIX):
+        backup = backup[:-len(ABSENT_SUFFIX)]
+    return backup + RECORD_SUFFIX
+
+def _write_backup_record(record_path, path, target, backup, sync):
+    with open(record_path, "w", encoding="utf-8") as f:
+        json.dump({"path": os.path.abspath(path), "target": os.path.abspath(target), "backup": backup}, f)
+        if sync:
+            f.flush()
+            os.fsync(f.fileno())
+    if sync:
+        mh.fsync_path(os.path.dirname(record_path))
+
+def backed_up_call(path, func, backup_dir, args, backup_target=None, sync=True):
+    """Per-file worker: keep the original in backup_dir, then run func.
+
+    backup_target maps the image path to the file func changes (such as its
+    XMP sidecar); by default that is the image itself. A target that does not
+    exist yet is backed up as an empty ".absent" marker, so rollback deletes
+    it. Symlinks are followed, so the backup and its record are of the real
+    file. Each backup gets a record naming its file, written (and with sync,
+    fsynced) before func runs, so rollback finds the backup even if the run
+    died before the journal marked the file done. An existing backup is kept
+    as-is, because after an interrupted run it may be the only copy of the
+    original, and is reported even when func now has nothing to do. A new
+    backup is dropped again when func leaves the file untouched.
+    """
+    target = os.path.realpath(backup_target(path) if backup_target else path)
+    backup = backup_path_for(backup_dir, target)
+    record_path = record_path_for(backup)
+    created = False
+    if os.path.exists(backup + ABSENT_SUFFIX):
+        backup += ABSENT_SUFFIX
+    elif not os.path.exists(backup):
+        if not os.path.exists(target):
+            backup += ABSENT_SUFFIX
+            open(backup, "wb").close()
+        elif mh.writes_in_place(target):
+            shutil.copy2(target, backup)  # The write would change a hard link too
+        else:
+            try:
+                os.link(target, backup)
+            except OSError:
+                shutil.copy2(target, backup)  # Different filesystem or no hard links
+        created = True
+    if created or not os.path.exists(record_path):
+        _write_backup_record(record_path, path, target, backup, sync)
+    linked = not backup.endswith(ABSENT_SUFFIX) and os.path.exists(target) and os.path.samefile(backup, target)
+    try:
+        with mh.backup_link(target) if linked else contextlib.nullcontext():
+            outcome = func(path, *args)
+    except BaseException:
+        if created:
+            os.remove(backup)
+            os.remove(record_path)
+        raise
+    if outcome == mh.STATUS_SKIPPED:
+        if created:
+            os.remove(backup)
+            os.remove(record_path)
+            return mh.STATUS_SKIPPED
+        # Changed by an interrupted run; rollback still has to restore it
+        result = {"status": mh.STATUS_SKIPPED}
+    else:
+        result = dict(outcome) if isinstance(outcome, dict) else {}
+    result["backup"] = backup
+    result["target"] = os.path.abspath(target)
+    return result
+
+def read_journal(journal_path):
+    """Return the journal records, ignoring a torn final line."""
+    records = []
+    if not os.path.exists(journal_path):
+        return records
+    with open(journal_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                break
+    return records
+
+class Journal:
+    """Append-only JSON-lines journal of a batch run."""
+
+    def __init__(self, journal_path, fsync_every=FSYNC_EVERY):
+        self.path = journal_path
+        self.fsync_every = fsync_every
+        self.pending = []
+        self._file = open(journal_path, "a", encoding="utf-8")
+
+    def write(self, record, sync=False):
+        record.setdefault("time", time.time())
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        if sync:
+            os.fsync(self._file.fileno())
+
+    def record_result(self, result):
+        """Queue a finished file; it is marked done at the next checkpoint."""
+        if result["status"] == mh.STATUS_FAILED:
+            self.write({"event": "failed", "path": result["path"], "error": result["error"]})
+            return
+        self.pending.append(result)
+        if len(self.pending) >= max(self.fsync_every, 1):
+            self.checkpoint()
+
+    def checkpoint(self):
+        """Mark pending files done in the journal.
+
+        mh.atomic_write has already fsynced each file and its directory, so
+        a file recorded as done has its new content on disk; only the journal
+        itself is fsynced here.
+        """
+        if not self.pending:
+            return
+        for result in self.pending:
+            self.write({"event": "done", "path": os.path.abspath(result["path"]),
+                        "status": result["status"], "backup": result.get("backup"),
+                        "target": result.get("target")})
+        self.pending = []
+        if self.fsync_every:
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        self.checkpoint()
+        self._file.close()
+
+def completed_paths(records):
+    return {r["path"] for r in records if r.get("event") == "done"}
+
+def run_journaled(journal_path, operation, func, image_paths, *args, resume=False, backup=True,
+                  backup_target=None, fsync_every=FSYNC_EVERY, on_result=None, **options):
+    """Run a per-file function over images with a journal, like run_batch.
+
+    With resume, files the journal already lists as done are skipped and the
+    run continues under the same journal. Without it the journal must not
+    exist yet. Unless backup is False, originals are kept for rollback();
+    backup_target is passed to backed_up_call.
+    fsync_every=0 never fsyncs the journal or the backup records. options are passed to run_batch; the
+    summary gains a "resumed" count.
+    """
+    records = read_journal(journal_path)
+    if records and not resume:
+        raise FileExistsError(f"Journal '{journal_path}' already exists; resume it or choose another path.")
+    if records and records[0].get("operation") != operation:
+        raise ValueError(f"Journal '{journal_path}' belongs to a '{records[0].get('operation')}' run.")
+    done = completed_paths(records)
+    resumed = 0
+    # Paths are scanned lazily, so a backup directory inside the scanned tree
+    # would otherwise feed the run its own backups
+    backup_prefix = os.path.join(os.path.abspath(backup_dir_for(journal_path)), "")
+
+    def remaining():
+        nonlocal resumed
+        for path in image_paths:
+            if os.path.abspath(path).startswith(backup_prefix):
+                continue
+            if os.path.abspath(path) in done:
+                resumed += 1
+                continue
+            yield path
+
+    journal = Journal(journal_path, fsync_every)
+
+    def record(result):
+        journal.record_result(result)
+        if on_result:
+            on_result(result)
+
+    try:
+        if records:
+            journal.write({"event": "resume"}, sync=True)
+        else:
+            journal.write({"event": "start", "operation": operation, "backup": backup}, sync=True)
+        if backup:
+            backup_dir = backup_dir_for(journal_path)
+            os.makedirs(backup_dir, exist_ok=True)
+            summary = mh.run_batch(backed_up_call, remaining(), func, backup_dir, args, backup_target,
+                                   bool(fsync_every), on_result=record, **options)
+        else:
+            summary = mh.run_batch(func, remaining(), *args, on_result=record, **options)
+        journal.checkpoint()
+        if not summary["cancelled"]:
+            journal.write({"event": "finish", "failed": summary["failed"]}, sync=True)
+    finally:
+        journal.close()
+    summary["resumed"] = resumed
+    return summary
+
+def read_backup_records(backup_dir):
+    """Return the backup records left in backup_dir by backed_up_call."""
+    records = []
+    if not os.path.isdir(backup_dir):
+        return records
+    for name in sorted(os.listdir(backup_dir)):
+        if not name.endswith(RECORD_SUFFIX):
+            continue
+        try:
+            with open(os.path.join(backup_dir, name), "r", encoding="utf-8") as f:
+                records.append(json.load(f))
+        except (OSError, ValueError):
+            continue  # Torn by a crash before its backup was used
+    return records
+
+def rollback(journal_path):
+    """Restore every file the journal changed from its backup.
+
+    Files the journal marked done are restored first, newest first, followed
+    by any backup whose file an interrupted run changed before marking it
+    done. Restored files are recorded in the journal, so an interrupted
+    rollback can simply be run again. Returns a summary like run_batch.
+    """
+    records = read_journal(journal_path)
+    if not records:
+        raise FileNotFoundError(f"Journal '{journal_path}' not found.")
+    restored = {r["path"] for r in records if r.get("event") == "restored"}
+    done = [r for r in reversed(records) if r.get("event") == "done" and r.get("backup")]
+    summary = {"total": 0, mh.STATUS_OK: 0, mh.STATUS_FAILED: 0, mh.STATUS_SKIPPED: 0,
+               "elapsed": 0.0, "failures": [], "cancelled": False}
+    start = time.perf_counter()
+    journal = Journal(journal_path, fsync_every=0)
+    try:
+        leftovers = [r for r in read_backup_records(backup_dir_for(journal_path)) if os.path.exists(r["backup"])]
+        for record in done + leftovers:
+            if record["path"] in restored:
+                continue
+            restored.add(record["path"])
+            summary["total"] += 1
+            target = os.path.realpath(record.get("target") or record["path"])
+            try:
+                if record["backup"].endswith(ABSENT_SUFFIX):
+                    if os.path.exists(target):
+                        os.remove(target)
+                    os.remove(record["backup"])
+                elif mh.writes_in_place(target):
+                    with open(record["backup"], "rb") as src:
+                        size = os.fstat(src.fileno()).st_size
+                        mh.atomic_write(target, lambda out: image_formats.copy_range(src, out, 0, size))
+                    os.remove(record["backup"])
+                else:
+                    shutil.move(record["backup"], target)
+                if os.path.exists(record_path_for(record["backup"])):
+                    os.remove(record_path_for(record["backup"]))
+                mh.invalidate_metadata_cache(record["path"])
+            except OSError as e:
+                summary[mh.STATUS_FAILED] += 1
+                summary["failures"].append({"path": record["path"], "status": mh.STATUS_FAILED,
+                                            "error": f"{type(e).__name__}: {e}"})
+                continue
+            summary[mh.STATUS_OK] += 1
+            journal.write({"event": "restored", "path": record["path"]}, sync=True)
+    finally:
+        journal.close()
+    summary["elapsed"] = time.perf_counter() - start
+    return summary
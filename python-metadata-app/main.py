@@ -1,35 +1,152 @@
+import time
+STARTED = time.perf_counter()  # Start-up is timed from here, before the other imports
+
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, simpledialog
-from PIL import Image, ImageTk
 import os
+import sys
+import queue
+import logging
+import threading
+import instrumentation
 import metadata_handler as mh
+import preview
+import thumbnails
+# Pillow's ImageTk, metadata_index, rename_planner and contact_sheet are
+# imported on first use so the window can paint before they load
+
+IMPORTED = time.perf_counter()
+
+logger = logging.getLogger(__name__)
+
+# File dialog filter; Tk matches patterns case-sensitively on Linux
+IMAGE_FILETYPES = [("Images", "*.jpg *.JPG *.jpeg *.JPEG *.png *.PNG *.webp *.WEBP *.tif *.TIF *.tiff *.TIFF"),
+                   ("All Files", "*")]
+
+# Seconds from launch until the window is first painted; override with
+# PHOTO_METADATA_STARTUP_BUDGET
+STARTUP_BUDGET = float(os.environ.get("PHOTO_METADATA_STARTUP_BUDGET", "0.5"))
+
+def open_index():
+    """Attach the metadata index if one has been built, else return None."""
+    import metadata_index
+    if not os.path.exists(metadata_index.INDEX_PATH):
+        return None
+    index = metadata_index.MetadataIndex()
+    index.attach()
+    return index
+
+def warm_imports():
+    """Import the modules deferred at start-up, so first use does not stall."""
+    from PIL import Image, ImageTk
+    import rename_planner
+    import contact_sheet
 
 class MetadataApp:
-    def __init__(self, root):
+    def __init__(self, root, profiler=None, defer=False):
+        """Build the window; with defer=True only the form is built.
+
+        A deferred app shows its fields and controls straight away and
+        finish_startup() adds the rest once the window has been painted.
+        """
         self.root = root
+        self.profiler = profiler or instrumentation.StartupProfiler(STARTED)
         self.root.title("📸 Photo Metadata Tool")
         self.root.geometry("1000x1800")
         self.root.minsize(800, 600)
 
         self.current_index = 0
         self.preview_enabled = tk.BooleanVar(value=True)
+        self.sidecar_enabled = tk.BooleanVar(value=False)
         self.tooltip_win = None
         self.last_tooltip_text = ""
         self.image_paths = []
-        self.templates = mh.list_templates()
-
-        self.fields = {
-            "Title": tk.StringVar(),
-            "Subject": tk.StringVar(),
-            "Tags": tk.StringVar(),
-            "Comments": tk.StringVar(),
-            "Authors": tk.StringVar(),
-            "Copyright": tk.StringVar()
-        }
+        self.previews = preview.PreviewCache()
+        self.prefetcher = preview.Prefetcher(self.previews)
+        self.thumbnail_store = None
+
+        # Keep an existing metadata index in step with edits made here;
+        # attached in the background by finish_startup()
+        self.index = None
+        self.contact_sheet = None
+        self.redraw_after_id = None
+        self.templates = []  # Listed in the background by finish_startup()
+        self.startup_pending = 0
+        self.on_startup_done = None
+
+        # Background batch jobs report back through this queue
+        self.job_queue = queue.Queue()
+        self.job_cancel = None
+        self.job_label = ""
+        self.job_done_callback = None
+        self.job_rate = instrumentation.RateMeter()
+
+        self.fields = {key: tk.StringVar() for key in mh.METADATA_FIELDS}
 
         self.template_var = tk.StringVar()
         self._setup_styles()
         self._build_ui()
+        self.profiler.mark("form built")
+        if not defer:
+            self.finish_startup()
+
+    def finish_startup(self, on_done=None):
+        """Second stage of start-up, once the form is on screen.
+
+        Builds the progress, preview and navigation panels, then lists the
+        templates, attaches the metadata index and imports Pillow on
+        background threads. on_done() is called on the Tk main loop when all
+        three have finished.
+        """
+        self._build_panels()
+        self.profiler.mark("panels built")
+        self.on_startup_done = on_done
+        self.startup_pending = 3
+        self.run_in_background(mh.list_templates, self._templates_listed)
+        self.run_in_background(open_index, self._index_attached)
+        self.run_in_background(warm_imports, lambda _: self._startup_step_done("imports warmed"))
+
+    def _templates_listed(self, templates):
+        if templates is not None:
+            self.templates = templates
+            self.template_menu['values'] = templates
+        self._startup_step_done("templates listed")
+
+    def _index_attached(self, index):
+        self.index = index
+        self._startup_step_done("index attached")
+
+    def _startup_step_done(self, name):
+        self.profiler.mark(name)
+        self.startup_pending -= 1
+        if self.startup_pending == 0 and self.on_startup_done:
+            self.on_startup_done()
+
+    def run_in_background(self, func, on_done):
+        """Call func() on a daemon thread and on_done(result) on the Tk main loop.
+
+        A failure is logged and reported to on_done as None.
+        """
+        results = queue.Queue(maxsize=1)
+
+        def worker():
+            try:
+                result = func()
+            except Exception:
+                logger.exception("Background start-up task %s failed", func.__name__)
+                result = None
+            results.put(result)
+
+        def poll():
+            try:
+                result = results.get_nowait()
+            except queue.Empty:
+                self.root.after(20, poll)
+                return
+            on_done(result)
+
+        threading.Thread(target=worker, daemon=True).start()
+        self.root.after(20, poll)
 
     def _setup_styles(self):
         style = ttk.Style()
@@ -84,8 +201,10 @@ class MetadataApp:
         control_frame.pack(fill="x", padx=5, pady=10)
 
         ttk.Button(control_frame, text="📁 Select Images", command=self.select_images).grid(row=0, column=0, padx=5, pady=3)
+        ttk.Button(control_frame, text="📂 Select Folder", command=self.select_folder).grid(row=1, column=0, padx=5, pady=3)
         ttk.Button(control_frame, text="✏️ Rename Current Image", command=self.rename_current_image).grid(row=0, column=1, padx=5, pady=3)
         ttk.Button(control_frame, text="🧾 Batch Rename All", command=self.batch_rename_images).grid(row=0, column=2, padx=5, pady=3)
+        ttk.Button(control_frame, text="🗂️ Contact Sheet", command=self.open_contact_sheet).grid(row=0, column=3, padx=5, pady=3)
 
 
 
@@ -105,9 +224,24 @@ class MetadataApp:
         status_frame = ttk.Frame(container)
         status_frame.pack(fill="x", pady=(10, 0))
         ttk.Checkbutton(status_frame, text="Show Preview", variable=self.preview_enabled, command=self.toggle_preview).pack(side="left", padx=(0, 10))
+        ttk.Checkbutton(status_frame, text="Write XMP Sidecars", variable=self.sidecar_enabled).pack(side="left", padx=(0, 10))
         self.status = ttk.Label(status_frame, text="Ready", anchor="w")
         self.status.pack(side="left", fill="x", expand=True)
 
+    def _build_panels(self):
+        container = self.scrollable_frame
+
+        # Batch Progress
+        progress_frame = ttk.Labelframe(container, text="Batch Progress", padding=10)
+        progress_frame.pack(fill="x", padx=5, pady=(10, 0))
+        progress_frame.columnconfigure(0, weight=1)
+        self.progress = ttk.Progressbar(progress_frame, mode="determinate")
+        self.progress.grid(row=0, column=0, sticky="ew", padx=5, pady=4)
+        self.cancel_button = ttk.Button(progress_frame, text="⛔ Cancel", command=self.cancel_job, state="disabled")
+        self.cancel_button.grid(row=0, column=1, padx=5, pady=4)
+        self.error_list = tk.Listbox(progress_frame, height=4)
+        self.error_list.grid(row=1, column=0, columnspan=2, sticky="ew", padx=5, pady=4)
+
         # Image Preview
         preview_frame = ttk.Labelframe(container, text="Image Preview", padding=10)
         preview_frame.pack(fill="both", expand=True, padx=10, pady=(10, 0))
@@ -129,22 +263,34 @@ class MetadataApp:
             ttk.Button(frame, text=text, command=cmd).grid(row=i, column=0, columnspan=2, sticky="ew", padx=5, pady=3)
 
     def select_images(self):
-        files = filedialog.askopenfilenames(title="Select Images", filetypes=[("JPEG Images", "*.JPG *.jpg *.jpeg")])
+        files = filedialog.askopenfilenames(title="Select Images", filetypes=IMAGE_FILETYPES)
         if files:
             self.image_paths = list(files)
             self.current_index = 0
             self.status.config(text=f"Selected {len(self.image_paths)} image(s)")
             self.show_preview(self.image_paths[self.current_index])
 
+    def select_folder(self):
+        folder = filedialog.askdirectory(title="Select Folder")
+        if not folder:
+            return
+        self.image_paths = sorted(mh.scan_images([folder]))
+        self.current_index = 0
+        if not self.image_paths:
+            self.status.config(text="No images found in folder")
+            return
+        self.status.config(text=f"Selected {len(self.image_paths)} image(s)")
+        self.show_preview(self.image_paths[self.current_index])
+
     def show_preview(self, image_path):
+        from PIL import ImageTk  # Imported on first use to keep start-up fast
         try:
             canvas_width = self.canvas.winfo_width()
             canvas_height = self.canvas.winfo_height()
             if canvas_width < 10 or canvas_height < 10:
                 return  # Skip early small sizes
 
-            image = Image.open(image_path)
-            image.thumbnail((canvas_width, canvas_height))
+            image = self.previews.get(image_path, (canvas_width, canvas_height))
             self.preview_image = ImageTk.PhotoImage(image)
 
             self.canvas.delete("all")
@@ -161,10 +307,28 @@ class MetadataApp:
             self.canvas.tag_bind(self.canvas_image_id, "<Leave>", self.hide_tooltip)
             self.canvas.tag_bind(self.canvas_image_id, "<Motion>", self.show_tooltip)
 
+            if len(self.image_paths) > 1:
+                self.prefetcher.prefetch(self.image_paths, self.current_index, (canvas_width, canvas_height))
+
         except Exception as e:
             self.canvas.delete("all")
             self.canvas.create_text(300, 300, text=f"Error loading image:\n{e}", fill="white")
 
+    def open_contact_sheet(self):
+        if not self.image_paths:
+            messagebox.showwarning("No Images", "Please select images first.")
+            return
+        if self.thumbnail_store is None:
+            self.thumbnail_store = thumbnails.ThumbnailStore()
+        from contact_sheet import ContactSheet  # Imported on first use to keep start-up fast
+        if self.contact_sheet is not None and not self.contact_sheet.closed:
+            self.contact_sheet.close()
+        self.contact_sheet = ContactSheet(self.root, self.image_paths, self.thumbnail_store, self.show_image_at)
+
+    def show_image_at(self, index):
+        self.current_index = index
+        self.show_preview(self.image_paths[index])
+
     def rename_current_image(self):
         if not self.image_paths:
             messagebox.showwarning("No Image", "Please select images first.")
@@ -179,54 +343,61 @@ class MetadataApp:
             return  # User cancelled
 
         new_path = os.path.join(directory, new_name + ext)
-        if os.path.exists(new_path):
-            messagebox.showerror("File Exists", f"A file named '{new_name + ext}' already exists.")
-            return
-
         try:
-            os.rename(old_path, new_path)
-            self.image_paths[self.current_index] = new_path
-            self.status.config(text=f"✏️ Renamed to {new_name + ext}")
-            self.show_preview(new_path)
+            mh.rename_image(old_path, new_path)
+        except FileExistsError as e:
+            messagebox.showerror("File Exists", str(e))
+            return
         except Exception as e:
             messagebox.showerror("Rename Failed", f"Could not rename file:\n{e}")
+            return
+
+        self.image_paths[self.current_index] = new_path
+        self.status.config(text=f"✏️ Renamed to {new_name + ext}")
+        self.show_preview(new_path)
 
     def batch_rename_images(self):
+        import rename_planner  # Imported on first use to keep start-up fast
         if not self.image_paths:
             messagebox.showwarning("No Images", "Please select images first.")
             return
 
-        base_name = simpledialog.askstring("Batch Rename", "Enter base filename (e.g. 2025-KYE-D3-P8):")
-        if not base_name:
+        pattern = simpledialog.askstring(
+            "Batch Rename",
+            "Enter base filename (e.g. 2025-KYE-D3-P8)\n"
+            f"or a pattern using {rename_planner.PATTERN_HELP}:")
+        if not pattern:
             return  # Cancelled
+        base = ""
+        if "{" not in pattern:
+            base, pattern = pattern, rename_planner.DEFAULT_PATTERN
+
+        def run(paths, on_result, cancel_event):
+            # Plans the whole set first; nothing is renamed if any name collides,
+            # and a failure or cancel part-way renames everything back
+            return rename_planner.rename_images(paths, pattern, base=base,
+                                                on_result=on_result, cancel_event=cancel_event)
+
+        def on_done(summary):
+            renamed = summary.get("renamed", {})
+            self.image_paths = [renamed.get(os.path.abspath(p), p) for p in self.image_paths]
+            self.current_index = 0
+            self.show_preview(self.image_paths[0])
+            if summary.get("rolled_back"):
+                messagebox.showerror("Rename Failed", "Renaming failed; all files were given their old names back.")
 
-        directory = os.path.dirname(self.image_paths[0])
-        ext = os.path.splitext(self.image_paths[0])[1].lower()
-        renamed = []
-
-        for idx, path in enumerate(self.image_paths, start=1):
-            new_filename = f"{base_name}-{idx}{ext}"
-            new_path = os.path.join(directory, new_filename)
-
-            if os.path.exists(new_path):
-                messagebox.showerror("File Exists", f"File '{new_filename}' already exists. Aborting rename.")
-                return
-
-            try:
-                os.rename(path, new_path)
-                renamed.append(new_path)
-            except Exception as e:
-                messagebox.showerror("Rename Failed", f"Failed to rename '{os.path.basename(path)}': {e}")
-                return
-
-        self.image_paths = renamed
-        self.current_index = 0
-        self.show_preview(self.image_paths[0])
-        self.status.config(text=f"🧾 Renamed {len(self.image_paths)} images using base '{base_name}'")
+        self.start_job("🧾 Renamed", None, self.image_paths, on_done=on_done, run=run)
 
 
 
     def _redraw_preview(self, event):
+        # Resizing fires <Configure> continuously; only redraw once it settles
+        if self.redraw_after_id:
+            self.root.after_cancel(self.redraw_after_id)
+        self.redraw_after_id = self.root.after(150, self._redraw_preview_now)
+
+    def _redraw_preview_now(self):
+        self.redraw_after_id = None
         if not self.image_paths or not self.preview_enabled.get():
             return
         self.show_preview(self.image_paths[self.current_index])
@@ -302,25 +473,108 @@ class MetadataApp:
         if not self.image_paths:
             messagebox.showwarning("No Images", "Please select image files first.")
             return
-        try:
-            mh.apply_metadata_to_images(self.image_paths, self.gather_metadata())
-            self.status.config(text="✅ Metadata applied successfully.")
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to apply metadata:\n{e}")
+        self.start_job("✅ Metadata applied", mh.apply_metadata_to_image, self.image_paths,
+                       mh.compile_metadata(self.gather_metadata()), False, self.sidecar_enabled.get())
 
     def clear_metadata(self):
         if not self.image_paths:
             messagebox.showwarning("No Images", "Please select image files first.")
             return
-        if messagebox.askyesno("Clear Metadata", f"Remove ALL metadata from {len(self.image_paths)} image(s)?"):
-            mh.clear_metadata_from_images(self.image_paths)
-            self.status.config(text="🧹 Metadata cleared successfully.")
+        if self.sidecar_enabled.get():
+            question = f"Remove this app's fields from the XMP sidecars of {len(self.image_paths)} image(s)?"
+        else:
+            question = f"Remove ALL metadata from {len(self.image_paths)} image(s)?"
+        if messagebox.askyesno("Clear Metadata", question):
+            self.start_job("🧹 Metadata cleared", mh.clear_metadata_from_image, self.image_paths,
+                           self.sidecar_enabled.get())
+
+    def start_job(self, label, func, paths, *args, on_done=None, run=None):
+        """Run func(path, *args) for every path on a background worker pool.
+
+        Per-file results are passed back through self.job_queue and picked up
+        by _poll_job_queue on the Tk main loop. Operations that handle the
+        paths as a whole pass run(paths, on_result, cancel_event) instead of
+        func, returning a summary like run_batch.
+        """
+        if self.job_cancel is not None:
+            messagebox.showwarning("Busy", "Another operation is still running.")
+            return
+        paths = list(paths)
+        self.job_label = label
+        self.job_done_callback = on_done
+        self.job_rate = instrumentation.RateMeter()
+        self.job_cancel = cancel_event = threading.Event()
+        self.progress.config(maximum=max(len(paths), 1), value=0)
+        self.error_list.delete(0, "end")
+        self.cancel_button.config(state="normal")
+        self.status.config(text=f"{label}: 0/{len(paths)}")
+
+        def worker():
+            def on_result(result):
+                self.job_queue.put(("result", result))
+
+            try:
+                if run:
+                    summary = run(paths, on_result, cancel_event)
+                else:
+                    summary = mh.run_batch(func, paths, *args, on_result=on_result, cancel_event=cancel_event)
+            except Exception as e:
+                summary = {"error": str(e)}
+            self.job_queue.put(("done", summary))
+
+        threading.Thread(target=worker, daemon=True).start()
+        self.root.after(100, self._poll_job_queue)
+
+    def _poll_job_queue(self):
+        try:
+            while True:
+                kind, payload = self.job_queue.get_nowait()
+                if kind == "result":
+                    self.progress.step(1)
+                    self.job_rate.tick()
+                    if payload["status"] == mh.STATUS_FAILED:
+                        self.error_list.insert("end", f"{os.path.basename(payload['path'])}: {payload['error']}")
+                    self.status.config(text=f"{self.job_label}: {int(self.progress['value'])}/{int(self.progress['maximum'])}"
+                                            f" — {self.job_rate.rate():.1f} files/s")
+                else:
+                    self._finish_job(payload)
+                    return
+        except queue.Empty:
+            pass
+        self.root.after(100, self._poll_job_queue)
+
+    def _finish_job(self, summary):
+        self.job_cancel = None
+        self.cancel_button.config(state="disabled")
+        if "error" in summary:
+            messagebox.showerror("Error", f"Operation failed:\n{summary['error']}")
+            self.status.config(text="Ready")
+            return
+        if self.job_done_callback:
+            self.job_done_callback(summary)
+        text = (f"{self.job_label}: {summary['ok']} ok, {summary['skipped']} skipped, "
+                f"{summary['failed']} failed ({summary['elapsed']:.1f}s)")
+        if summary["cancelled"]:
+            text += " — cancelled"
+        if summary.get("rolled_back"):
+            text += " — rolled back"
+        self.status.config(text=text)
+
+    def cancel_job(self):
+        if self.job_cancel is not None:
+            self.job_cancel.set()
+            self.cancel_button.config(state="disabled")
+            self.status.config(text=f"{self.job_label}: cancelling...")
 
     def save_template(self):
         metadata = self.gather_metadata()
         name = simpledialog.askstring("Template Name", "Enter a name for the template:")
         if name:
-            mh.save_template(name, metadata)
+            try:
+                mh.save_template(name, metadata)
+            except ValueError as e:
+                messagebox.showerror("Invalid Template Name", str(e))
+                return
             self.refresh_templates()
             self.template_var.set(name)
             self.status.config(text=f"💾 Template '{name}' saved.")
@@ -345,7 +599,7 @@ class MetadataApp:
             return
         if messagebox.askyesno("Delete Template", f"Are you sure you want to delete template '{name}'?"):
             try:
-                os.remove(os.path.join(mh.TEMPLATE_DIR, f"{name}.json"))
+                mh.delete_template(name)
                 self.refresh_templates()
                 self.template_var.set('')
                 self.status.config(text=f"🗑️ Template '{name}' deleted.")
@@ -357,7 +611,7 @@ class MetadataApp:
         self.template_menu['values'] = self.templates
 
     def view_metadata(self):
-        file_path = filedialog.askopenfilename(title="Select Image to View Metadata", filetypes=[("JPEG Images",  "*.JPG*.jpg *.jpeg")])
+        file_path = filedialog.askopenfilename(title="Select Image to View Metadata", filetypes=IMAGE_FILETYPES)
         if not file_path:
             return
         try:
@@ -379,7 +633,30 @@ class MetadataApp:
             messagebox.showerror("Error", f"Could not read metadata:\n{e}")
 
 
+def report_startup(profiler, show):
+    """Log the start-up profile; show=True prints it as well."""
+    report = profiler.report()
+    if show:
+        print(report)
+    else:
+        logger.debug("Start-up profile:\n%s", report)
+    if profiler.over_budget():
+        logger.warning("Window took %.0f ms to paint, over the %.0f ms start-up budget",
+                       profiler.elapsed(profiler.budget_mark) * 1000, profiler.budget * 1000)
+
+
 if __name__ == "__main__":
+    # --profile-startup prints the start-up profile once everything has loaded
+    show_profile = "--profile-startup" in sys.argv[1:]
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(name)s: %(message)s")
+    profiler = instrumentation.StartupProfiler(STARTED, budget=STARTUP_BUDGET)
+    profiler.mark("imports", at=IMPORTED)
     root = tk.Tk()
-    app = MetadataApp(root)
+    profiler.mark("tk ready")
+    app = MetadataApp(root, profiler=profiler, defer=True)
+    # Paint the form before building the rest of the window
+    root.update_idletasks()
+    root.update()
+    profiler.mark("first paint")
+    app.finish_startup(on_done=lambda: report_startup(profiler, show_profile))
     root.mainloop()
@@ -1,104 +1,831 @@
 # metadata_handler.py
 
 import os
+import contextlib
+import fnmatch
+import glob
 import json
-from PIL import Image
+import logging
+import shutil
+import tempfile
+import threading
+import mmap
+import time
+from collections import OrderedDict
+from concurrent.futures import Executor, ThreadPoolExecutor, FIRST_COMPLETED, wait
 import piexif
 from piexif import ExifIFD, ImageIFD
+import image_formats
+import instrumentation
+import xmp_sidecar
+
+logger = logging.getLogger(__name__)
 
 TEMPLATE_DIR = "templates"
-os.makedirs(TEMPLATE_DIR, exist_ok=True)
+
+# Per-user cache for derived data such as thumbnails
+CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+                         "photo-metadata")
+
+# Editable fields, in the order the GUI shows them
+METADATA_FIELDS = ("Title", "Subject", "Tags", "Comments", "Authors", "Copyright")
 
 # ----------------------------
 # TEMPLATE MANAGEMENT
 # ----------------------------
 
+def template_path(template_name):
+    """Return the file of a template, refusing names that would leave TEMPLATE_DIR."""
+    separators = {"/", os.sep, os.altsep} - {None}
+    if (not template_name or template_name.startswith(".") or ".." in template_name
+            or any(sep in template_name for sep in separators) or "\0" in template_name):
+        raise ValueError(f"Invalid template name '{template_name}'.")
+    return os.path.join(TEMPLATE_DIR, f"{template_name}.json")
+
 def save_template(template_name, metadata):
     """Save metadata as a reusable template (JSON)."""
-    path = os.path.join(TEMPLATE_DIR, f"{template_name}.json")
+    path = template_path(template_name)
+    os.makedirs(TEMPLATE_DIR, exist_ok=True)
     with open(path, 'w', encoding='utf-8') as f:
         json.dump(metadata, f, indent=4)
     return path
 
 def load_template(template_name):
     """Load a saved template into a metadata dictionary."""
-    path = os.path.join(TEMPLATE_DIR, f"{template_name}.json")
+    path = template_path(template_name)
     if not os.path.exists(path):
         raise FileNotFoundError(f"Template '{template_name}' not found.")
     with open(path, 'r', encoding='utf-8') as f:
         return json.load(f)
 
+def delete_template(template_name):
+    """Delete a saved template."""
+    os.remove(template_path(template_name))
+
 def list_templates():
     """Return a list of saved template names (no extension)."""
+    if not os.path.isdir(TEMPLATE_DIR):
+        return []
     return [f[:-5] for f in os.listdir(TEMPLATE_DIR) if f.endswith(".json")]
 
+# ----------------------------
+# JPEG SEGMENT I/O
+# ----------------------------
+
+JPEG_SOI = b"\xff\xd8"
+EXIF_HEADER = b"Exif\x00\x00"
+APP0 = 0xE0
+APP1 = 0xE1
+SOS = 0xDA
+EOI = 0xD9
+# Markers that stand alone without a length field (TEM, RST0-RST7)
+STANDALONE_MARKERS = {0x01, *range(0xD0, 0xD8)}
+
+def read_jpeg_header(f):
+    """Read the marker segments of an open JPEG up to the start of scan.
+
+    Returns (segments, scan_offset): a list of (marker, payload) tuples and the
+    file offset of the SOS marker. Everything from scan_offset onward is
+    entropy-coded image data that is copied through untouched on rewrite.
+    """
+    if f.read(2) != JPEG_SOI:
+        raise ValueError("Not a JPEG file.")
+
+    segments = []
+    while True:
+        prefix = f.read(1)
+        if prefix != b"\xff":
+            raise ValueError(f"Corrupt JPEG marker stream at offset {f.tell() - 1}.")
+        marker = f.read(1)
+        while marker == b"\xff":  # Fill bytes may pad any marker
+            marker = f.read(1)
+        if not marker:
+            raise ValueError("Unexpected end of file in JPEG header.")
+        marker = marker[0]
+
+        if marker in (SOS, EOI):
+            return segments, f.tell() - 2
+        if marker in STANDALONE_MARKERS:
+            segments.append((marker, None))
+            continue
+
+        length_bytes = f.read(2)
+        length = int.from_bytes(length_bytes, "big")
+        if len(length_bytes) < 2 or length < 2:
+            raise ValueError(f"Invalid JPEG segment length for marker 0x{marker:02X}.")
+        payload = f.read(length - 2)
+        if len(payload) < length - 2:
+            raise ValueError("Unexpected end of file in JPEG header.")
+        segments.append((marker, payload))
+
+def encode_jpeg_segment(marker, payload):
+    """Serialise a single (marker, payload) segment back to bytes."""
+    if payload is None:
+        return bytes((0xFF, marker))
+    if len(payload) + 2 > 0xFFFF:
+        raise ValueError(f"JPEG segment 0x{marker:02X} is too large ({len(payload)} bytes).")
+    return bytes((0xFF, marker)) + (len(payload) + 2).to_bytes(2, "big") + payload
+
+def is_exif_segment(marker, payload):
+    return marker == APP1 and payload is not None and payload.startswith(EXIF_HEADER)
+
+def get_exif_segment(segments):
+    """Return the Exif APP1 payload (including the Exif header) or None."""
+    for marker, payload in segments:
+        if is_exif_segment(marker, payload):
+            return payload
+    return None
+
+def replace_exif_segment(segments, exif_bytes):
+    """Return segments with every Exif APP1 removed and exif_bytes inserted.
+
+    The new APP1 goes right after any leading APP0 (JFIF/JFXX) segments, which
+    is where readers expect to find it. Pass exif_bytes=None to only remove.
+    """
+    kept = [(m, p) for m, p in segments if not is_exif_segment(m, p)]
+    if not exif_bytes:
+        return kept
+    position = 0
+    while position < len(kept) and kept[position][0] == APP0:
+        position += 1
+    kept.insert(position, (APP1, exif_bytes))
+    return kept
+
+# The process umask, for the permissions of newly created files
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+def fsync_path(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass  # Directories can't be fsynced on every platform
+    finally:
+        os.close(fd)
+
+# Real paths whose one extra hard link is a backup taken by the current thread
+_backup_links = threading.local()
+
+@contextlib.contextmanager
+def backup_link(path):
+    """Let atomic_write replace path although a backup hard-links it.
+
+    Replacing the file leaves the backup on the old content, which is the
+    point of the backup, so that one extra link does not count as another
+    name the write has to keep in step.
+    """
+    real = os.path.realpath(path)
+    if not hasattr(_backup_links, "paths"):
+        _backup_links.paths = set()
+    _backup_links.paths.add(real)
+    try:
+        yield
+    finally:
+        _backup_links.paths.discard(real)
+
+def writes_in_place(path):
+    """Whether atomic_write has to rewrite path in place instead of replacing it.
+
+    A replacement is a new inode: other hard links would keep the old content,
+    and only root can hand the new file to another owner or to a group it is
+    not in.
+    """
+    real = os.path.realpath(path)
+    try:
+        st = os.stat(real)
+    except FileNotFoundError:
+        return False
+    links = st.st_nlink - (real in getattr(_backup_links, "paths", ()))
+    if links > 1:
+        return True
+    if not hasattr(os, "geteuid") or os.geteuid() == 0:
+        return False
+    return st.st_uid != os.geteuid() or st.st_gid not in (os.getegid(), *os.getgroups())
+
+def atomic_write(image_path, write):
+    """Replace image_path with content produced by write(f).
+
+    write receives a temp file, opened for binary writing next to the real
+    file (symlinks are followed and stay links), which is renamed over it once
+    complete and fsynced, and the directory is fsynced after the rename.
+    Readers and crashes see either the old file or the new one, never a
+    half-written image. The new file keeps the original's mode, owner,
+    flags and extended attributes (including ACLs); its times are the write's.
+    Read-only files raise PermissionError. Where a replacement would split
+    hard links or lose the owner (see writes_in_place) the finished temp file
+    is instead copied into the original, which keeps those but is not atomic.
+
+    Because a replaced file is a new inode, a hard link taken before the write
+    keeps the original content; journal.py relies on this for its backups.
+    """
+    real = os.path.realpath(image_path)
+    try:
+        st = os.stat(real)
+    except FileNotFoundError:
+        st = None
+    if st is not None and (not st.st_mode & 0o222 or not os.access(real, os.W_OK)):
+        raise PermissionError(f"'{image_path}' is read-only.")
+    in_place = st is not None and writes_in_place(real)
+    fd, tmp_path = tempfile.mkstemp(prefix=".", suffix=".tmp", dir=os.path.dirname(real))
+    try:
+        with timed("file.write"):
+            with os.fdopen(fd, "wb") as out:
+                write(out)
+                count("bytes.written", out.tell())
+                out.flush()
+                os.fsync(out.fileno())
+            if in_place:
+                with open(tmp_path, "rb") as src, open(real, "r+b") as dst:
+                    size = os.fstat(src.fileno()).st_size
+                    dst.truncate(0)
+                    image_formats.copy_range(src, dst, 0, size)
+                    dst.flush()
+                    os.fsync(dst.fileno())
+                os.remove(tmp_path)
+                return
+            if st is None:
+                os.chmod(tmp_path, 0o666 & ~_UMASK)  # mkstemp creates files private
+            else:
+                tmp_st = os.stat(tmp_path)
+                if hasattr(os, "chown") and (tmp_st.st_uid, tmp_st.st_gid) != (st.st_uid, st.st_gid):
+                    os.chown(tmp_path, st.st_uid, st.st_gid)  # Before copystat, as chown clears setuid bits
+                shutil.copystat(real, tmp_path)
+                os.utime(tmp_path)  # copystat also copied the old times
+            os.replace(tmp_path, real)
+            fsync_path(os.path.dirname(real))
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def write_jpeg_segments(image_path, segments, scan_offset):
+    """Rewrite image_path with new header segments, copying scan data verbatim."""
+    def write(out):
+        with open(image_path, "rb") as src:
+            out.write(JPEG_SOI)
+            out.write(b"".join(encode_jpeg_segment(m, p) for m, p in segments))
+            size = os.fstat(src.fileno()).st_size
+            count("bytes.read", image_formats.copy_range(src, out, scan_offset, size - scan_offset))
+
+    atomic_write(image_path, write)
+
+def find_exif_segment(f):
+    """Scan an open JPEG for its Exif APP1 payload without reading the rest.
+
+    Only segment headers are read; other segments are skipped with seek and
+    the scan stops at the first Exif APP1 or at the start of scan. Returns the
+    payload (including the Exif header) or None.
+    """
+    if f.read(2) != JPEG_SOI:
+        raise ValueError("Not a JPEG file.")
+    while True:
+        header = f.read(2)
+        while header[1:2] == b"\xff":  # Fill bytes may pad any marker
+            header = header[1:] + f.read(1)
+        if len(header) < 2 or header[0] != 0xFF:
+            return None
+        marker = header[1]
+        if marker in (SOS, EOI):
+            return None
+        if marker in STANDALONE_MARKERS:
+            continue
+        length = int.from_bytes(f.read(2), "big")
+        if length < 2:
+            return None
+        if marker == APP1:
+            payload = f.read(length - 2)
+            if payload.startswith(EXIF_HEADER):
+                return payload
+        else:
+            f.seek(length - 2, os.SEEK_CUR)
+
+def is_jpeg(image_path):
+    with open(image_path, "rb") as f:
+        return f.read(2) == JPEG_SOI
+
+# ----------------------------
+# OTHER FORMATS
+# ----------------------------
+
+# Formats whose Exif block is read and replaced structurally, like JPEG's APP1;
+# TIFF files are their own Exif structure and are patched directly
+EXIF_BLOCK_FORMATS = ("jpeg", "png", "webp")
+
+# IFD0 tags clear_metadata_from_image removes from TIFF files, besides the
+# pointers to the Exif and GPS IFDs. Tags describing the image data stay.
+TIFF_METADATA_TAGS = {ImageIFD.ImageDescription, ImageIFD.Make, ImageIFD.Model, ImageIFD.Software,
+                      ImageIFD.DateTime, ImageIFD.Artist, ImageIFD.HostComputer, ImageIFD.Copyright,
+                      ImageIFD.XMLPacket, ImageIFD.Rating, ImageIFD.RatingPercent, 33723,  # IPTC-NAA
+                      ImageIFD.XPTitle, ImageIFD.XPComment, ImageIFD.XPAuthor, ImageIFD.XPKeywords,
+                      ImageIFD.XPSubject, ImageIFD.ExifTag, ImageIFD.GPSTag}
+
+def image_format(image_path):
+    """Return the sniffed format of an image ("jpeg", "png", ...) or None."""
+    with open(image_path, "rb") as f:
+        return sniff_image_format(f.read(12))
+
+def read_exif_block(image_path, fmt):
+    """Return the Exif block (with Exif header) of a JPEG, PNG or WebP, or None.
+
+    Only the image's headers are read.
+    """
+    finders = {"jpeg": find_exif_segment, "png": image_formats.find_png_exif, "webp": image_formats.find_webp_exif}
+    with timed("read.header"), open(image_path, "rb") as f:
+        data = finders[fmt](f)
+        count("bytes.read", f.tell())
+    if data and fmt != "jpeg":
+        data = EXIF_HEADER + data
+    return data
+
+def write_exif_block(image_path, fmt, exif_bytes, xmp=False):
+    """Replace the Exif block of a JPEG, PNG or WebP without touching its image data.
+
+    exif_bytes includes the Exif header; None removes the block. With xmp,
+    embedded XMP is removed as well (JPEGs lose every APP1 segment).
+    """
+    if fmt == "jpeg":
+        with timed("jpeg.header"), open(image_path, "rb") as f:
+            segments, scan_offset = read_jpeg_header(f)
+            count("bytes.read", f.tell())
+        if xmp:
+            segments = [(m, p) for m, p in segments if m != APP1]
+        write_jpeg_segments(image_path, replace_exif_segment(segments, exif_bytes), scan_offset)
+        return
+    writer = image_formats.write_png if fmt == "png" else image_formats.write_webp
+    tiff = exif_bytes[len(EXIF_HEADER):] if exif_bytes else None
+
+    def write(out):
+        with open(image_path, "rb") as src:
+            writer(src, out, tiff, xmp)
+            count("bytes.read", os.fstat(src.fileno()).st_size)
+
+    atomic_write(image_path, write)
+
+def has_embedded_metadata(image_path, fmt):
+    """True if a JPEG, PNG, WebP or TIFF has anything clear_metadata_from_image removes."""
+    with timed("read.header"), open(image_path, "rb") as f:
+        if fmt == "jpeg":
+            return any(marker == APP1 for marker, _ in read_jpeg_header(f)[0])
+        if fmt == "png":
+            return image_formats.png_has_metadata(f)
+        if fmt == "webp":
+            return image_formats.webp_has_metadata(f)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            byte_order, ifd0_offset = image_formats.tiff_header(buf)
+            entries, _ = image_formats.read_tiff_entries(buf, ifd0_offset, byte_order)
+            return not TIFF_METADATA_TAGS.isdisjoint(entries)
+
+def patch_tiff(image_path, zeroth, exif):
+    """Change IFD0 and Exif IFD tags of a TIFF file ({tag: (type, bytes) or None}).
+
+    Entries are rewritten in place where the directory keeps its shape and new
+    directories and values are appended otherwise, so strips and tiles stay
+    where they are. The patched copy replaces the file atomically.
+    """
+    with timed("tiff.header"), open(image_path, "rb") as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        patches, appendix = image_formats.update_tiff(buf, zeroth, exif, ImageIFD.ExifTag)
+
+    def write(out):
+        with open(image_path, "rb") as src:
+            image_formats.write_tiff(src, out, patches, appendix)
+            count("bytes.read", os.fstat(src.fileno()).st_size)
+
+    atomic_write(image_path, write)
+
+# ----------------------------
+# EXIF TAG PARSING
+# ----------------------------
+
+# Byte size of one value of each TIFF field type
+TIFF_TYPE_SIZES = image_formats.TIFF_TYPE_SIZES
+TIFF_ASCII = 2
+
+# The only tags read_metadata_from_image needs
+READ_0TH_TAGS = {ImageIFD.ImageDescription, ImageIFD.Artist, ImageIFD.Copyright,
+                 ImageIFD.XPSubject, ImageIFD.XPKeywords}
+READ_EXIF_TAGS = {ExifIFD.UserComment}
+
+def read_ifd(tiff, offset, byte_order, wanted):
+    """Return {tag: (type, raw value bytes)} for the wanted tags of one IFD.
+
+    tiff is the TIFF structure (bytes or mmap) and offsets are relative to its
+    start. Entries that point outside the buffer are ignored.
+    """
+    values = {}
+    if offset + 2 > len(tiff):
+        return values
+    count = int.from_bytes(tiff[offset:offset + 2], byte_order)
+    for entry in range(offset + 2, min(offset + 2 + count * 12, len(tiff) - 11), 12):
+        tag = int.from_bytes(tiff[entry:entry + 2], byte_order)
+        if tag not in wanted:
+            continue
+        field_type = int.from_bytes(tiff[entry + 2:entry + 4], byte_order)
+        size = TIFF_TYPE_SIZES.get(field_type, 1) * int.from_bytes(tiff[entry + 4:entry + 8], byte_order)
+        if size <= 4:
+            data = tiff[entry + 8:entry + 8 + size]
+        else:
+            pointer = int.from_bytes(tiff[entry + 8:entry + 12], byte_order)
+            if pointer + size > len(tiff):
+                continue
+            data = tiff[pointer:pointer + size]
+        values[tag] = (field_type, bytes(data))
+    return values
+
+def tiff_byte_order(tiff):
+    if tiff[:4] == b"II*\x00":
+        return "little"
+    if tiff[:4] == b"MM\x00*":
+        return "big"
+    raise ValueError("Invalid TIFF header in EXIF data.")
+
+def parse_exif_tags(tiff, zeroth_tags=READ_0TH_TAGS, exif_tags=READ_EXIF_TAGS):
+    """Parse selected 0th and Exif IFD tags from a TIFF structure.
+
+    Returns a piexif-style {"0th": {...}, "Exif": {...}} dictionary with raw
+    bytes values; ASCII values have their trailing NULs removed like piexif.
+    """
+    byte_order = tiff_byte_order(tiff)
+    zeroth_offset = int.from_bytes(tiff[4:8], byte_order)
+    zeroth = read_ifd(tiff, zeroth_offset, byte_order, set(zeroth_tags) | {ImageIFD.ExifTag})
+    exif = {}
+    if ImageIFD.ExifTag in zeroth and exif_tags:
+        exif_offset = int.from_bytes(zeroth.pop(ImageIFD.ExifTag)[1], byte_order)
+        exif = read_ifd(tiff, exif_offset, byte_order, exif_tags)
+    zeroth.pop(ImageIFD.ExifTag, None)
+
+    def values(ifd):
+        return {tag: data.rstrip(b"\x00") if field_type == TIFF_ASCII else data
+                for tag, (field_type, data) in ifd.items()}
+
+    return {"0th": values(zeroth), "Exif": values(exif)}
+
+def read_exif_tags(path, zeroth_tags=READ_0TH_TAGS, exif_tags=READ_EXIF_TAGS, fmt="jpeg"):
+    """Read selected EXIF tags from a JPEG, PNG or WebP by scanning only its header."""
+    payload = read_exif_block(path, fmt)
+    if not payload:
+        return {"0th": {}, "Exif": {}}
+    with timed("read.parse"):
+        return parse_exif_tags(payload[len(EXIF_HEADER):], zeroth_tags, exif_tags)
+
+def read_tiff_tags(path, zeroth_tags=READ_0TH_TAGS, exif_tags=READ_EXIF_TAGS):
+    """Read selected tags of a TIFF file through mmap, touching only its directories."""
+    with timed("read.parse"), open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        return parse_exif_tags(buf, zeroth_tags, exif_tags)
+
+def read_exif_thumbnail(path):
+    """Return the JPEG thumbnail embedded in a JPEG's EXIF block, or None."""
+    with open(path, "rb") as f:
+        payload = find_exif_segment(f)
+    if not payload:
+        return None
+    tiff = payload[len(EXIF_HEADER):]
+    byte_order = tiff_byte_order(tiff)
+    zeroth_offset = int.from_bytes(tiff[4:8], byte_order)
+    count = int.from_bytes(tiff[zeroth_offset:zeroth_offset + 2], byte_order)
+    next_pointer = zeroth_offset + 2 + count * 12
+    first_offset = int.from_bytes(tiff[next_pointer:next_pointer + 4], byte_order)
+    if not first_offset:
+        return None
+    first = read_ifd(tiff, first_offset, byte_order,
+                     {ImageIFD.JPEGInterchangeFormat, ImageIFD.JPEGInterchangeFormatLength})
+    if len(first) < 2:
+        return None
+    offset = int.from_bytes(first[ImageIFD.JPEGInterchangeFormat][1], byte_order)
+    length = int.from_bytes(first[ImageIFD.JPEGInterchangeFormatLength][1], byte_order)
+    thumbnail = tiff[offset:offset + length]
+    return thumbnail if thumbnail.startswith(JPEG_SOI) else None
+
 # ----------------------------
 # METADATA APPLICATION
 # ----------------------------
 
-def apply_metadata_to_image(image_path, metadata):
-    """Apply structured metadata to appropriate EXIF fields."""
-    img = Image.open(image_path)
+def apply_metadata_to_image(image_path, metadata, dry_run=False, sidecar=False):
+    """Apply structured metadata to appropriate EXIF fields.
+
+    metadata is a field dictionary or a MetadataPlan from compile_metadata.
+    Files whose tags already hold the planned values are left untouched and
+    reported as STATUS_SKIPPED. Otherwise the changed fields are returned as
+    {"changes": {...}}; with dry_run nothing is written.
+
+    JPEGs, PNGs and WebPs are updated losslessly by swapping their Exif
+    block (APP1 segment, eXIf chunk or EXIF chunk) and TIFFs by patching
+    their IFD entries; the image data is never decoded. Other formats fall
+    back to a Pillow re-save. With sidecar, the image is left alone and the
+    fields go to its XMP sidecar instead.
+    """
+    plan = compile_metadata(metadata)
+    if sidecar:
+        return apply_metadata_to_sidecar(image_path, plan, dry_run)
+    fmt = image_format(image_path)
+    if fmt == "tiff":
+        return apply_metadata_to_tiff(image_path, plan, dry_run)
+    if fmt in EXIF_BLOCK_FORMATS:
+        exif_bytes = read_exif_block(image_path, fmt)
+    else:
+        img = open_image(image_path)
+        exif_bytes = img.info.get("exif")
 
+    changes = plan.diff(parse_existing_tags(exif_bytes))
+    if not changes:
+        return STATUS_SKIPPED
+    if dry_run:
+        return {"changes": changes}
+
+    exif_dict = load_exif_dict(exif_bytes)
+    plan.apply_to(exif_dict)
+    with timed("piexif.dump"):
+        exif_bytes = piexif.dump(exif_dict)
+    if fmt in EXIF_BLOCK_FORMATS:
+        write_exif_block(image_path, fmt, exif_bytes)
+    else:
+        atomic_write(image_path, lambda out: save_image(img, out, exif=exif_bytes))
+    invalidate_metadata_cache(image_path)
+    notify_write("apply", image_path, plan.metadata)
+    return {"changes": changes}
+
+def apply_metadata_to_tiff(image_path, metadata, dry_run=False):
+    """apply_metadata_to_image for TIFF files: only the changed tags are rewritten."""
+    plan = compile_metadata(metadata)
+    existing = read_tiff_tags(image_path)
+    changes = plan.diff(existing)
+    if not changes:
+        return STATUS_SKIPPED
+    if dry_run:
+        return {"changes": changes}
+    updates = {"0th": {}, "Exif": {}}
+    for ifd, tags in plan.tags.items():
+        for tag, value in tags.items():
+            if existing[ifd].get(tag, b"") == value:
+                continue
+            field_type = piexif.TAGS["Image" if ifd == "0th" else "Exif"][tag]["type"]
+            if not value:
+                updates[ifd][tag] = None  # Empty fields are left out, as missing tags read as empty
+            else:
+                updates[ifd][tag] = (field_type, value + b"\x00" if field_type == TIFF_ASCII else value)
+    patch_tiff(image_path, updates["0th"], updates["Exif"])
+    invalidate_metadata_cache(image_path)
+    notify_write("apply", image_path, plan.metadata)
+    return {"changes": changes}
+
+def load_exif_dict(exif_bytes):
+    """Parse an Exif block with piexif, or return an empty EXIF dictionary."""
     try:
-        exif_dict = piexif.load(img.info.get("exif", b""))
+        with timed("piexif.load"):
+            return piexif.load(exif_bytes or b"")
     except Exception:
-        exif_dict = {"0th": {}, "Exif": {}, "GPS": {}, "1st": {}, "thumbnail": None}
+        return {"0th": {}, "Exif": {}, "GPS": {}, "1st": {}, "thumbnail": None}
 
-    # Extract fields
-    title = metadata.get("Title", "")
-    subject = metadata.get("Subject", "")
-    tags = metadata.get("Tags", "")
-    comments = metadata.get("Comments", "")
-    authors = metadata.get("Authors", "")
-    copyright_str = metadata.get("Copyright", "")
+def open_image(image_path):
+    """Open an image with Pillow for the re-save fallback.
 
-    # Standard fields (UTF-8)
-    exif_dict["0th"][ImageIFD.ImageDescription] = title.encode("utf-8", errors="replace")
-    exif_dict["0th"][ImageIFD.Artist] = authors.encode("utf-8", errors="replace")
-    exif_dict["0th"][ImageIFD.Copyright] = copyright_str.encode("utf-8", errors="replace")
+    Pillow is imported here rather than at module level: it is the slowest
+    import of the app, and JPEG, PNG, WebP and TIFF never need it.
+    """
+    from PIL import Image
+    with timed("image.open"):
+        return Image.open(image_path)
+
+def save_image(img, out, exif):
+    """Re-encode a non-JPEG image with new EXIF bytes (the slow fallback)."""
+    with timed("image.save"):
+        count("bytes.read", os.path.getsize(img.filename) if img.filename else 0)
+        img.save(out, format=img.format, exif=exif)
 
+def parse_existing_tags(exif_bytes):
+    """Parse the tags a plan compares against; unreadable EXIF counts as empty."""
+    if exif_bytes and exif_bytes.startswith(EXIF_HEADER):
+        try:
+            return parse_exif_tags(exif_bytes[len(EXIF_HEADER):])
+        except ValueError:
+            pass
+    return {"0th": {}, "Exif": {}}
+
+def apply_metadata_to_images(image_paths, metadata, **options):
+    """Apply metadata to a list of image files. See run_batch for options.
+
+    The metadata is compiled once and shared by every file.
+    """
+    dry_run = options.pop("dry_run", False)
+    sidecar = options.pop("sidecar", False)
+    return run_batch(apply_metadata_to_image, image_paths, compile_metadata(metadata), dry_run, sidecar, **options)
+
+# ----------------------------
+# XMP SIDECARS
+# ----------------------------
+
+def read_sidecar(image_path):
+    """Return the bytes of an image's XMP sidecar, or None if it has none."""
+    try:
+        with timed("sidecar.read"), open(xmp_sidecar.sidecar_path(image_path), "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    count("bytes.read", len(data))
+    return data
+
+def apply_metadata_to_sidecar(image_path, metadata, dry_run=False):
+    """Write metadata fields to an image's XMP sidecar, creating it if needed.
+
+    Behaves like apply_metadata_to_image: unchanged sidecars are reported as
+    STATUS_SKIPPED and dry_run only returns the changes. Fields are compared
+    with what read_metadata_from_image returns, the sidecar over the embedded
+    EXIF, and only changed fields are written.
+    """
+    plan = compile_metadata(metadata)
+    if not os.path.isfile(image_path):
+        raise FileNotFoundError(f"No such image: '{image_path}'")
+    data = read_sidecar(image_path)
+    try:
+        current = metadata_from_exif_dict(read_image_tags(image_path))
+    except Exception:
+        current = {}  # Nothing readable embedded for the sidecar to hide
+    if data:
+        current.update(xmp_sidecar.read_fields(data))
+    changes = {}
+    for field, value in plan.metadata.items():
+        if field == "Comments" and not value:
+            continue  # An empty comment leaves the existing one alone
+        old = current.get(field, "")
+        new = xmp_sidecar.normalize_value(field, value)
+        if xmp_sidecar.normalize_value(field, old) != new:
+            changes[field] = {"old": old, "new": new}
+    if not changes:
+        return STATUS_SKIPPED
+    if dry_run:
+        return {"changes": changes}
+    updated = xmp_sidecar.update_fields(data, {field: plan.metadata[field] for field in changes})
+    atomic_write(xmp_sidecar.sidecar_path(image_path), lambda out: out.write(updated))
+    invalidate_metadata_cache(image_path)
+    notify_write("apply", image_path, plan.metadata)
+    return {"changes": changes}
+
+def clear_metadata_from_sidecar(image_path):
+    """Remove the app's fields from an image's XMP sidecar.
+
+    Other tools' data in the sidecar is kept; a sidecar left with nothing
+    else in it is deleted. Returns STATUS_SKIPPED if there was nothing to
+    remove.
+    """
+    data = read_sidecar(image_path)
+    if not data or not xmp_sidecar.read_fields(data):
+        return STATUS_SKIPPED
+    remaining = xmp_sidecar.remove_fields(data)
+    path = xmp_sidecar.sidecar_path(image_path)
+    if remaining is None:
+        os.remove(path)
+    else:
+        atomic_write(path, lambda out: out.write(remaining))
+    invalidate_metadata_cache(image_path)
+    notify_write("clear", image_path)
+
+def _sidecar_signature(path):
+    try:
+        stat = os.stat(xmp_sidecar.sidecar_path(path))
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+def metadata_signature(path):
+    """Return (mtime_ns, size) covering an image and its XMP sidecar.
+
+    Either file changing changes the signature, which is what caches of the
+    merged metadata need to compare.
+    """
+    stat = os.stat(path)
+    sidecar = _sidecar_signature(path)
+    if sidecar is None:
+        return stat.st_mtime_ns, stat.st_size
+    return max(stat.st_mtime_ns, sidecar[0]), stat.st_size + sidecar[1]
+
+# ----------------------------
+# METADATA PLANS
+# ----------------------------
+
+# Where each field is stored: (IFD, tag)
+FIELD_TAGS = {
+    "Title": ("0th", ImageIFD.ImageDescription),
+    "Subject": ("0th", ImageIFD.XPSubject),
+    "Tags": ("0th", ImageIFD.XPKeywords),
+    "Comments": ("Exif", ExifIFD.UserComment),
+    "Authors": ("0th", ImageIFD.Artist),
+    "Copyright": ("0th", ImageIFD.Copyright),
+}
+
+def encode_field(field, value):
+    """Encode one field the way it is stored in EXIF, or None to leave it alone."""
     # Windows XP-specific tags (must be UTF-16LE + null)
-    def encode_xp(val):
-        return val.encode("utf-16le") + b"\x00\x00" if val else b""
+    if field in ("Subject", "Tags"):
+        return value.encode("utf-16le") + b"\x00\x00" if value else b""
+    # UserComment with ASCII prefix; an empty comment keeps the existing one
+    if field == "Comments":
+        return b"ASCII\x00\x00\x00" + value.encode("utf-8", errors="replace") if value else None
+    # Standard fields (UTF-8)
+    return value.encode("utf-8", errors="replace")
 
-    exif_dict["0th"][ImageIFD.XPSubject] = encode_xp(subject)
-    exif_dict["0th"][ImageIFD.XPKeywords] = encode_xp(tags)
+class MetadataPlan:
+    """Metadata fields pre-encoded into the EXIF tag values they are stored as.
 
-    # UserComment with ASCII prefix
-    if comments:
-        exif_dict["Exif"][ExifIFD.UserComment] = b"ASCII\x00\x00\x00" + comments.encode("utf-8", errors="replace")
+    Built once per batch so each file only costs a comparison against its
+    existing tags, plus a write when something actually differs.
+    """
 
-    # Save new EXIF to file
-    exif_bytes = piexif.dump(exif_dict)
-    img.save(image_path, exif=exif_bytes)
+    def __init__(self, metadata):
+        self.metadata = {key: metadata.get(key, "") for key in METADATA_FIELDS}
+        self.tags = {"0th": {}, "Exif": {}}
+        for field, value in self.metadata.items():
+            encoded = encode_field(field, value)
+            if encoded is not None:
+                ifd, tag = FIELD_TAGS[field]
+                self.tags[ifd][tag] = encoded
 
-def apply_metadata_to_images(image_paths, metadata):
-    """Apply metadata to a list of image files."""
-    for path in image_paths:
-        try:
-            apply_metadata_to_image(path, metadata)
-        except Exception as e:
-            print(f"❌ Failed to update {path}: {e}")
+    def diff(self, existing):
+        """Return {field: {"old": ..., "new": ...}} for fields that would change.
+
+        existing is a parse_exif_tags dictionary; missing tags count as empty.
+        """
+        changes = {}
+        old_metadata = None
+        for field, (ifd, tag) in FIELD_TAGS.items():
+            if tag in self.tags[ifd] and existing[ifd].get(tag, b"") != self.tags[ifd][tag]:
+                if old_metadata is None:
+                    old_metadata = metadata_from_exif_dict(existing)
+                changes[field] = {"old": old_metadata.get(field, ""), "new": self.metadata[field]}
+        return changes
+
+    def apply_to(self, exif_dict):
+        """Write the planned tags into a piexif dictionary."""
+        for ifd, tags in self.tags.items():
+            exif_dict[ifd].update(tags)
+
+def compile_metadata(metadata):
+    """Return a MetadataPlan for a field dictionary (plans pass through)."""
+    return metadata if isinstance(metadata, MetadataPlan) else MetadataPlan(metadata)
 
 # ----------------------------
 # READ METADATA
 # ----------------------------
 
-import piexif
-from piexif import ExifIFD, ImageIFD
+def read_metadata_from_image(path, raise_errors=False, sidecar=True):
+    """Return the app's metadata fields for an image, using the metadata cache.
 
-def read_metadata_from_image(path):
+    Fields in the image's XMP sidecar take precedence over embedded EXIF
+    ones; pass sidecar=False to read only what is embedded.
+    """
     try:
-        exif_dict = piexif.load(path)
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size, _sidecar_signature(path) if sidecar else False)
+        metadata = _metadata_cache_get(path, signature)
+        if metadata is None:
+            count("metadata_cache.miss")
+            metadata = _read_metadata_uncached(path, signature[2])
+            _metadata_cache_put(path, signature, metadata)
+        else:
+            count("metadata_cache.hit")
     except Exception as e:
-        print(f"Error reading EXIF metadata: {e}")
+        if raise_errors:
+            raise
+        _sink.error("read_metadata_from_image", e)
+        logger.warning("Error reading EXIF metadata from %s: %s", path, e)
         return {}
+    return dict(metadata)
+
+def _read_metadata_uncached(path, sidecar_signature=None):
+    metadata = metadata_from_exif_dict(read_image_tags(path))
+    if sidecar_signature:
+        data = read_sidecar(path)
+        if data:
+            metadata.update(xmp_sidecar.read_fields(data))
+    return metadata
 
+def read_image_tags(path, zeroth_tags=READ_0TH_TAGS, exif_tags=READ_EXIF_TAGS):
+    """Read selected 0th and Exif IFD tags from any supported image.
+
+    JPEGs, PNGs and WebPs are read from their headers only and TIFFs from
+    their directories; other formats go through piexif.
+    """
+    fmt = image_format(path)
+    if fmt in EXIF_BLOCK_FORMATS:
+        return read_exif_tags(path, zeroth_tags, exif_tags, fmt)
+    if fmt == "tiff":
+        return read_tiff_tags(path, zeroth_tags, exif_tags)
+    with timed("piexif.load"):
+        exif_dict = piexif.load(path)
+    return {"0th": {tag: value for tag, value in exif_dict.get("0th", {}).items() if tag in zeroth_tags},
+            "Exif": {tag: value for tag, value in exif_dict.get("Exif", {}).items() if tag in exif_tags}}
+
+def metadata_from_exif_dict(exif_dict):
+    """Decode the app's metadata fields from a piexif-style dictionary."""
     metadata = {}
 
     # Helper to decode XP fields (UTF-16LE with trailing nulls)
     def decode_xp_field(value):
+        if isinstance(value, tuple):  # piexif returns BYTE-typed tags as tuples
+            value = bytes(value)
         if isinstance(value, (bytes, bytearray)):
             try:
                 return value.decode('utf-16le').rstrip('\x00')
@@ -146,6 +873,43 @@ def read_metadata_from_image(path):
     return metadata
 
 
+# ----------------------------
+# METADATA CACHE
+# ----------------------------
+
+# Entries are keyed by absolute path and only valid while the file's mtime and
+# size (and those of its sidecar) still match, so writes from other processes
+# are picked up as well.
+METADATA_CACHE_SIZE = 1024
+_metadata_cache = OrderedDict()
+_metadata_cache_lock = threading.Lock()
+
+def _metadata_cache_get(path, signature):
+    key = os.path.abspath(path)
+    with _metadata_cache_lock:
+        entry = _metadata_cache.get(key)
+        if entry is None or entry[0] != signature:
+            return None
+        _metadata_cache.move_to_end(key)
+        return entry[1]
+
+def _metadata_cache_put(path, signature, metadata):
+    key = os.path.abspath(path)
+    with _metadata_cache_lock:
+        _metadata_cache[key] = (signature, metadata)
+        _metadata_cache.move_to_end(key)
+        while len(_metadata_cache) > METADATA_CACHE_SIZE:
+            _metadata_cache.popitem(last=False)
+
+def invalidate_metadata_cache(path=None):
+    """Forget cached metadata for one image, or for all images if path is None."""
+    with _metadata_cache_lock:
+        if path is None:
+            _metadata_cache.clear()
+        else:
+            _metadata_cache.pop(os.path.abspath(path), None)
+
+
 def decode_metadata_value(value):
     if isinstance(value, tuple):
         try:
@@ -166,15 +930,328 @@ def decode_metadata_value(value):
 # CLEAR METADATA
 # ----------------------------
 
-def clear_metadata_from_image(image_path):
-    """Remove all EXIF metadata from an image and preserve image content."""
+def clear_metadata_from_image(image_path, sidecar=False):
+    """Remove all EXIF metadata from an image and preserve image content.
+
+    For JPEGs every APP1 segment (Exif and XMP) is dropped from the marker
+    stream, PNGs and WebPs lose their Exif and XMP chunks and TIFFs the tags
+    in TIFF_METADATA_TAGS, all without touching the image data. Returns
+    STATUS_SKIPPED when there was nothing to remove. With sidecar, only the
+    app's fields in the XMP sidecar are removed (see
+    clear_metadata_from_sidecar).
+    """
+    if sidecar:
+        return clear_metadata_from_sidecar(image_path)
+    fmt = image_format(image_path)
+    if fmt is not None and not has_embedded_metadata(image_path, fmt):
+        return STATUS_SKIPPED
+    if fmt in EXIF_BLOCK_FORMATS:
+        write_exif_block(image_path, fmt, None, xmp=True)
+    elif fmt == "tiff":
+        patch_tiff(image_path, dict.fromkeys(TIFF_METADATA_TAGS), {})
+    else:
+        img = open_image(image_path)
+        atomic_write(image_path, lambda out: save_image(img, out, exif=b""))
+    invalidate_metadata_cache(image_path)
+    notify_write("clear", image_path)
+
+def clear_metadata_from_images(image_paths, **options):
+    """Remove EXIF metadata from a list of image files. See run_batch for options."""
+    sidecar = options.pop("sidecar", False)
+    return run_batch(clear_metadata_from_image, image_paths, sidecar, **options)
+
+# ----------------------------
+# RENAME
+# ----------------------------
+
+def rename_image(old_path, new_path):
+    """Rename an image and its XMP sidecar, refusing to overwrite existing files."""
+    old_sidecar, new_sidecar = xmp_sidecar.sidecar_path(old_path), xmp_sidecar.sidecar_path(new_path)
+    has_sidecar = os.path.exists(old_sidecar)
+    for path in (new_path, new_sidecar) if has_sidecar else (new_path,):
+        if os.path.exists(path):
+            raise FileExistsError(f"A file named '{os.path.basename(path)}' already exists.")
+    os.rename(old_path, new_path)
+    if has_sidecar:
+        os.rename(old_sidecar, new_sidecar)
+    invalidate_metadata_cache(old_path)
+    invalidate_metadata_cache(new_path)
+    notify_write("rename", old_path, new_path)
+
+# ----------------------------
+# WRITE HOOKS
+# ----------------------------
+
+# Callables notified as hook(event, path, detail) after a file is changed:
+# ("apply", path, metadata), ("clear", path, None), ("rename", old_path, new_path).
+# Hooks only see writes made in this process.
+_write_hooks = []
+
+def add_write_hook(hook):
+    _write_hooks.append(hook)
+
+def remove_write_hook(hook):
+    if hook in _write_hooks:
+        _write_hooks.remove(hook)
+
+def notify_write(event, path, detail=None):
+    for hook in list(_write_hooks):
+        try:
+            hook(event, path, detail)
+        except Exception as e:
+            logger.exception("Write hook failed for %s: %s", path, e)
+
+# ----------------------------
+# INSTRUMENTATION
+# ----------------------------
+
+# Receives stage timings, counters and errors; see instrumentation.py. Only
+# work done in this process is reported, so batches on the process executor
+# show up in the parent's per-file results but not in the sink.
+_NULL_SINK = instrumentation.NullSink()
+_sink = _NULL_SINK
+
+class _StageTimer:
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        _sink.observe(self.stage, time.perf_counter() - self.start)
+
+class _NoTimer:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+_NO_TIMER = _NoTimer()
+
+def set_instrumentation(sink):
+    """Report to sink from now on; None restores the no-op default."""
+    global _sink
+    _sink = sink or _NULL_SINK
+
+def get_instrumentation():
+    return _sink
+
+def timed(stage):
+    """Context manager that reports how long its block took as stage."""
+    return _NO_TIMER if _sink is _NULL_SINK else _StageTimer(stage)
+
+def count(counter, amount=1):
+    if _sink is not _NULL_SINK:
+        _sink.increment(counter, amount)
+
+# ----------------------------
+# FILE DISCOVERY
+# ----------------------------
+
+def sniff_image_format(head):
+    """Identify a supported image from its first 12 bytes, or return None."""
+    if head[:3] == b"\xff\xd8\xff":
+        return "jpeg"
+    if head[:8] == image_formats.PNG_SIGNATURE:
+        return "png"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    # Canon CR2 raw files are TIFF-based too but are left alone
+    if head[:4] in (b"II*\x00", b"MM\x00*") and head[8:10] != b"CR":
+        return "tiff"
+    return None
+
+def is_supported_image(path):
     try:
-        img = Image.open(image_path)
-        img.save(image_path, exif=b"")
+        with open(path, "rb") as f:
+            return sniff_image_format(f.read(12)) is not None
+    except OSError:
+        return False
+
+def _matches(patterns, name, relpath):
+    return any(fnmatch.fnmatch(name, p) or fnmatch.fnmatch(relpath, p) for p in patterns)
+
+def scan_images(roots, include=None, exclude=None, modified_since=None, recursive=True):
+    """Lazily yield supported images under the given directories.
+
+    Directories are read with os.scandir one at a time and files are
+    recognised by their magic bytes, not their extension, so memory stays
+    bounded on trees with millions of files. include/exclude are fnmatch
+    patterns tested against the file name and the path relative to its root;
+    excluded directories are not descended into. modified_since (a timestamp)
+    keeps only files modified at or after that time. Unreadable directories
+    are skipped.
+    """
+    for root in roots:
+        stack = [root]
+        while stack:
+            directory = stack.pop()
+            try:
+                entries = os.scandir(directory)
+            except OSError:
+                continue
+            subdirectories = []
+            with entries:
+                for entry in entries:
+                    relpath = os.path.relpath(entry.path, root)
+                    if exclude and _matches(exclude, entry.name, relpath):
+                        continue
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if recursive:
+                                subdirectories.append(entry.path)
+                            continue
+                        if not entry.is_file():
+                            continue
+                        if entry.name.startswith(".") and entry.name.endswith(".tmp"):
+                            continue  # Temp file of an in-progress atomic_write
+                        if include and not _matches(include, entry.name, relpath):
+                            continue
+                        if modified_since is not None and entry.stat().st_mtime < modified_since:
+                            continue
+                    except OSError:
+                        continue
+                    if is_supported_image(entry.path):
+                        yield entry.path
+            # Reversed so subdirectories are visited in listing order
+            stack.extend(reversed(subdirectories))
+
+def is_glob(target):
+    return any(c in target for c in "*?[")
+
+def iter_image_paths(targets, recursive=True, **filters):
+    """Lazily yield image paths from files, directories and glob patterns.
+
+    Directories go through scan_images (filters are passed on to it) and glob
+    patterns are expanded with iglob, so the full file list is never held in
+    memory. Explicit file arguments are passed through as-is so missing files
+    are reported.
+    """
+    for target in targets:
+        if os.path.isdir(target):
+            yield from scan_images([target], recursive=recursive, **filters)
+        elif is_glob(target):
+            for path in glob.iglob(target, recursive=recursive):
+                if os.path.isfile(path) and is_supported_image(path):
+                    yield path
+        else:
+            yield target
+
+# ----------------------------
+# BATCH ENGINE
+# ----------------------------
+
+STATUS_OK = "ok"
+STATUS_FAILED = "failed"
+STATUS_SKIPPED = "skipped"
+
+def run_one(func, path, args=()):
+    """Run func(path, *args) and describe the outcome as a result dictionary.
+
+    A per-file function signals that it had nothing to do by returning
+    STATUS_SKIPPED, and may return a dictionary of extra fields to merge into
+    the result; any exception marks the file as failed.
+    """
+    start = time.perf_counter()
+    result = {"path": path, "status": STATUS_OK, "elapsed": 0.0, "error": None}
+    operation = getattr(func, "__name__", "call")
+    try:
+        outcome = func(path, *args)
+        if outcome == STATUS_SKIPPED:
+            result["status"] = STATUS_SKIPPED
+        elif isinstance(outcome, dict):
+            result.update(outcome)
     except Exception as e:
-        print(f"❌ Failed to clear metadata from {image_path}: {e}")
+        result["status"], result["error"] = STATUS_FAILED, f"{type(e).__name__}: {e}"
+        _sink.error(operation, e)
+    result["elapsed"] = time.perf_counter() - start
+    _sink.observe(f"file.{operation}", result["elapsed"])
+    count(f"files.{result['status']}")
+    return result
+
+def _make_executor(executor, jobs):
+    """Return (executor, owned) for an executor name or an existing Executor."""
+    if isinstance(executor, Executor):
+        return executor, False
+    if executor == "thread":
+        return ThreadPoolExecutor(max_workers=jobs), True
+    if executor == "process":
+        from concurrent.futures import ProcessPoolExecutor  # Pulls in multiprocessing
+        return ProcessPoolExecutor(max_workers=jobs), True
+    raise ValueError(f"Unknown executor '{executor}' (expected 'thread' or 'process').")
+
+def _is_set(event):
+    return event is not None and event.is_set()
+
+def iter_batch(func, image_paths, *args, jobs=None, executor="thread", max_in_flight=None, cancel_event=None):
+    """Run func(path, *args) over image_paths on a worker pool.
+
+    Yields one result dictionary per file (see run_one) in completion order.
+    At most max_in_flight tasks (default: twice the worker count) are queued at
+    once, so image_paths may be a lazy iterator of any length. executor is
+    "thread", "process" or an Executor instance that the caller keeps owning.
+    Setting cancel_event (a threading.Event) stops new work from starting;
+    files already being processed are allowed to finish.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    max_in_flight = max_in_flight or jobs * 2
+
+    if jobs == 1 and not isinstance(executor, Executor):
+        for path in image_paths:
+            if _is_set(cancel_event):
+                return
+            yield run_one(func, path, args)
+        return
+
+    pool, owned = _make_executor(executor, jobs)
+    pending = set()
+    try:
+        for path in image_paths:
+            if _is_set(cancel_event):
+                break
+            pending.add(pool.submit(run_one, func, path, args))
+            if len(pending) >= max_in_flight:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        while pending:
+            if _is_set(cancel_event):
+                # Drop queued work, keep waiting for tasks that already started
+                pending = {future for future in pending if not future.cancel()}
+                if not pending:
+                    break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    finally:
+        for future in pending:
+            future.cancel()
+        if owned:
+            pool.shutdown(wait=True)
+
+def run_batch(func, image_paths, *args, on_result=None, **options):
+    """Run a per-file function over many images and return a summary.
 
-def clear_metadata_from_images(image_paths):
-    """Remove EXIF metadata from a list of image files."""
-    for path in image_paths:
-        clear_metadata_from_image(path)
+    options are passed to iter_batch (jobs, executor, max_in_flight,
+    cancel_event). on_result, if given, is called with every per-file result as
+    it completes. The summary holds the per-status counts, total elapsed time,
+    the failed results and whether the run was cancelled.
+    """
+    summary = {"total": 0, STATUS_OK: 0, STATUS_FAILED: 0, STATUS_SKIPPED: 0,
+               "elapsed": 0.0, "failures": [], "cancelled": False}
+    start = time.perf_counter()
+    for result in iter_batch(func, image_paths, *args, **options):
+        summary["total"] += 1
+        summary[result["status"]] += 1
+        if result["status"] == STATUS_FAILED:
+            summary["failures"].append(result)
+        if on_result:
+            on_result(result)
+    summary["elapsed"] = time.perf_counter() - start
+    summary["files_per_second"] = summary["total"] / summary["elapsed"] if summary["elapsed"] else 0.0
+    summary["cancelled"] = _is_set(options.get("cancel_event"))
+    return summary
@@ -0,0 +1,232 @@
+# metadata_index.py
+#
+# Persistent SQLite index of the app's metadata fields, with FTS5 full-text
+# search. Folder scans only re-read files whose mtime or size changed, and an
+# attached index follows writes made through metadata_handler.
+
+import os
+import sqlite3
+import threading
+import metadata_handler as mh
+
+INDEX_PATH = os.path.join(mh.CACHE_DIR, "index.sqlite")
+
+# Column name for each metadata field
+COLUMNS = {key: key.lower() for key in mh.METADATA_FIELDS}
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS images (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    {", ".join(f"{column} TEXT NOT NULL DEFAULT ''" for column in COLUMNS.values())}
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS images_fts USING fts5(
+    {", ".join(COLUMNS.values())}, content='images', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS images_ai AFTER INSERT ON images BEGIN
+    INSERT INTO images_fts(rowid, {", ".join(COLUMNS.values())})
+    VALUES (new.id, {", ".join(f"new.{c}" for c in COLUMNS.values())});
+END;
+CREATE TRIGGER IF NOT EXISTS images_ad AFTER DELETE ON images BEGIN
+    INSERT INTO images_fts(images_fts, rowid, {", ".join(COLUMNS.values())})
+    VALUES ('delete', old.id, {", ".join(f"old.{c}" for c in COLUMNS.values())});
+END;
+CREATE TRIGGER IF NOT EXISTS images_au AFTER UPDATE ON images BEGIN
+    INSERT INTO images_fts(images_fts, rowid, {", ".join(COLUMNS.values())})
+    VALUES ('delete', old.id, {", ".join(f"old.{c}" for c in COLUMNS.values())});
+    INSERT INTO images_fts(rowid, {", ".join(COLUMNS.values())})
+    VALUES (new.id, {", ".join(f"new.{c}" for c in COLUMNS.values())});
+END;
+"""
+
+# Rows are committed in groups of this size during a scan
+COMMIT_EVERY = 500
+
+def read_for_index(path):
+    """Per-file scan worker: stat and read the metadata of one image.
+
+    The stored mtime and size cover the image and its XMP sidecar together
+    (see metadata_handler.metadata_signature).
+    """
+    mtime_ns, size = mh.metadata_signature(path)
+    return {"metadata": mh.read_metadata_from_image(path, raise_errors=True),
+            "mtime_ns": mtime_ns, "size": size}
+
+def fts_phrase(text):
+    """Quote text as an FTS5 phrase so user input can't inject query syntax."""
+    return '"' + text.replace('"', '""') + '"'
+
+class MetadataIndex:
+    """SQLite-backed metadata index. Safe to share between threads."""
+
+    def __init__(self, db_path=INDEX_PATH):
+        self.db_path = db_path
+        if db_path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._lock = threading.RLock()
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(SCHEMA)
+            self._db.commit()
+
+    def close(self):
+        self.detach()
+        with self._lock:
+            self._db.close()
+
+    # ----------------------------
+    # UPDATES
+    # ----------------------------
+
+    def update(self, path, metadata, mtime_ns, size, commit=True):
+        """Insert or replace the row for one image."""
+        values = [metadata.get(key, "") for key in COLUMNS]
+        columns = ", ".join(COLUMNS.values())
+        updates = ", ".join(f"{c} = excluded.{c}" for c in ("mtime_ns", "size", *COLUMNS.values()))
+        with self._lock:
+            self._db.execute(
+                f"INSERT INTO images (path, mtime_ns, size, {columns}) VALUES (?, ?, ?, {', '.join('?' * len(COLUMNS))}) "
+                f"ON CONFLICT(path) DO UPDATE SET {updates}",
+                [os.path.abspath(path), mtime_ns, size, *values])
+            if commit:
+                self._db.commit()
+
+    def refresh(self, path):
+        """Re-read one image from disk, dropping it if it no longer exists."""
+        try:
+            result = read_for_index(path)
+        except FileNotFoundError:
+            self.remove(path)
+            return
+        self.update(path, result["metadata"], result["mtime_ns"], result["size"])
+
+    def remove(self, path):
+        with self._lock:
+            self._db.execute("DELETE FROM images WHERE path = ?", (os.path.abspath(path),))
+            self._db.commit()
+
+    def is_current(self, path, signature):
+        """Whether the row for path matches a metadata_signature (mtime_ns, size)."""
+        with self._lock:
+            row = self._db.execute("SELECT mtime_ns, size FROM images WHERE path = ?",
+                                   (os.path.abspath(path),)).fetchone()
+        return row == tuple(signature)
+
+    def scan(self, targets, recursive=True, prune=True, filters=None, on_result=None, **options):
+        """Bring the index up to date for files, directories and globs.
+
+        Unchanged files cost one stat; changed ones are re-read on the batch
+        engine (options are passed to run_batch, and on_result sees every
+        result after it is stored). filters go to scan_images.
+        With prune, rows under the scanned directories whose files have
+        disappeared are deleted; pruning is skipped when filters are active.
+        Returns the run_batch summary plus an "unchanged" and "removed" count.
+        """
+        filters = {k: v for k, v in (filters or {}).items() if v}
+        unchanged = 0
+        seen = set()
+
+        def changed_paths():
+            nonlocal unchanged
+            for path in mh.iter_image_paths(targets, recursive=recursive, **filters):
+                seen.add(os.path.abspath(path))
+                try:
+                    if self.is_current(path, mh.metadata_signature(path)):
+                        unchanged += 1
+                        continue
+                except OSError:
+                    pass  # Reported as a failure by the worker
+                yield path
+
+        pending = 0
+
+        def store(result):
+            nonlocal pending
+            if result["status"] == mh.STATUS_OK:
+                self.update(result["path"], result["metadata"], result["mtime_ns"], result["size"], commit=False)
+                pending += 1
+                if pending >= COMMIT_EVERY:
+                    with self._lock:
+                        self._db.commit()
+                    pending = 0
+            if on_result:
+                on_result(result)
+
+        summary = mh.run_batch(read_for_index, changed_paths(), on_result=store, **options)
+        with self._lock:
+            self._db.commit()
+
+        summary["unchanged"] = unchanged
+        summary["removed"] = self._prune(targets, seen) if prune and not filters else 0
+        return summary
+
+    def _prune(self, targets, seen):
+        removed = 0
+        for target in targets:
+            if not os.path.isdir(target):
+                continue
+            prefix = os.path.join(os.path.abspath(target), "")
+            with self._lock:
+                rows = self._db.execute("SELECT path FROM images WHERE substr(path, 1, ?) = ?",
+                                        (len(prefix), prefix)).fetchall()
+                stale = [(path,) for (path,) in rows if path not in seen]
+                self._db.executemany("DELETE FROM images WHERE path = ?", stale)
+                self._db.commit()
+            removed += len(stale)
+        return removed
+
+    # ----------------------------
+    # WRITE TRACKING
+    # ----------------------------
+
+    def attach(self):
+        """Keep the index updated from metadata_handler writes in this process."""
+        mh.add_write_hook(self._on_write)
+
+    def detach(self):
+        mh.remove_write_hook(self._on_write)
+
+    def _on_write(self, event, path, detail):
+        if event == "rename":
+            self.remove(path)
+            self.refresh(detail)
+        else:
+            self.refresh(path)
+
+    # ----------------------------
+    # SEARCH
+    # ----------------------------
+
+    def search(self, text=None, limit=None, **fields):
+        """Return [(path, metadata)] for images matching every given term.
+
+        text matches any field; keyword arguments named after fields (title,
+        tags, authors, ...) match that field only. Terms are matched as FTS5
+        phrases, so "tags='beach'" finds images whose Tags contain "beach".
+        """
+        terms = [fts_phrase(text)] if text else []
+        for name, value in fields.items():
+            if name not in COLUMNS.values():
+                raise ValueError(f"Unknown metadata field '{name}'.")
+            if value:
+                terms.append(f"{name} : {fts_phrase(value)}")
+        columns = ", ".join(f"images.{c}" for c in COLUMNS.values())
+        if terms:
+            sql = (f"SELECT images.path, {columns} FROM images_fts JOIN images ON images.id = images_fts.rowid "
+                   f"WHERE images_fts MATCH ? ORDER BY images.path")
+            params = [" AND ".join(terms)]
+        else:
+            sql, params = f"SELECT images.path, {columns} FROM images ORDER BY images.path", []
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+        return [(row[0], dict(zip(COLUMNS, row[1:]))) for row in rows]
+
+    def count(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM images").fetchone()[0]
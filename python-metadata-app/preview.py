@@ -0,0 +1,141 @@
+# preview.py
+#
+# Decoding and caching of preview bitmaps for the GUI. Previews are decoded at
+# the smallest cost that still fills the canvas: the embedded EXIF thumbnail
+# when it is big enough, otherwise a JPEG draft decode at reduced scale.
+
+import io
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import metadata_handler as mh
+
+# Previews are decoded for canvas sizes rounded up to this many pixels, so
+# small resizes reuse the same decoded bitmap.
+SIZE_BUCKET = 256
+
+def size_bucket(max_size):
+    width, height = max_size
+    return (-(-width // SIZE_BUCKET) * SIZE_BUCKET, -(-height // SIZE_BUCKET) * SIZE_BUCKET)
+
+def _fits(size, max_size):
+    """True if an image of size covers max_size without upscaling."""
+    return size[0] >= max_size[0] or size[1] >= max_size[1]
+
+def _same_aspect(a, b, tolerance=0.02):
+    return abs(a[0] / a[1] - b[0] / b[1]) <= tolerance * (b[0] / b[1])
+
+def load_preview(path, max_size):
+    """Decode an image scaled down to fit within max_size."""
+    from PIL import Image  # Imported on first use to keep start-up fast
+    image = Image.open(path)
+    if image.format == "JPEG":
+        try:
+            thumbnail = mh.read_exif_thumbnail(path)
+        except (OSError, ValueError):
+            thumbnail = None
+        if thumbnail:
+            thumb_image = Image.open(io.BytesIO(thumbnail))
+            if _fits(thumb_image.size, max_size) and _same_aspect(thumb_image.size, image.size):
+                image = thumb_image
+        # Let the JPEG decoder scale by 1/2, 1/4 or 1/8 while decoding
+        image.draft("RGB", max_size)
+    image.thumbnail(max_size)
+    image.load()
+    return image
+
+def image_nbytes(image):
+    return image.width * image.height * len(image.getbands())
+
+class PreviewCache:
+    """Thread-safe LRU of decoded previews, bounded by their total size in bytes.
+
+    Entries are keyed by (path, mtime, file size, size bucket), so an edited
+    file or a much larger canvas gets a fresh decode.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, path, max_size):
+        stat = os.stat(path)
+        return (os.path.abspath(path), stat.st_mtime_ns, stat.st_size, size_bucket(max_size))
+
+    def get(self, path, max_size):
+        """Return a preview of path that fits within max_size."""
+        key = self._key(path, max_size)
+        with self._lock:
+            image = self._entries.get(key)
+            if image is not None:
+                self._entries.move_to_end(key)
+        if image is None:
+            mh.count("preview_cache.miss")
+            with mh.timed("preview.decode"):
+                image = load_preview(path, key[3])
+            self._put(key, image)
+        else:
+            mh.count("preview_cache.hit")
+        if image.width > max_size[0] or image.height > max_size[1]:
+            image = image.copy()
+            image.thumbnail(max_size)
+        return image
+
+    def _put(self, key, image):
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = image
+            self.total_bytes += image_nbytes(image)
+            while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self.total_bytes -= image_nbytes(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+
+class Prefetcher:
+    """Warms the preview and metadata caches for images around the current one.
+
+    Work runs on a single background thread. Each prefetch() call supersedes
+    the previous one, so requests queued for images the user has already
+    skipped past are dropped before they are decoded.
+    """
+
+    def __init__(self, cache, radius=2):
+        self.cache = cache
+        self.radius = radius
+        self._generation = 0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch")
+
+    def prefetch(self, paths, index, max_size):
+        """Queue the next and previous `radius` entries of paths around index."""
+        self._generation += 1
+        generation = self._generation
+        neighbours = []
+        for distance in range(1, self.radius + 1):
+            for offset in (distance, -distance):
+                path = paths[(index + offset) % len(paths)]
+                if path != paths[index] and path not in neighbours:
+                    neighbours.append(path)
+        for path in neighbours:
+            self._executor.submit(self._load, generation, path, max_size)
+
+    def _load(self, generation, path, max_size):
+        if generation != self._generation:
+            return
+        try:
+            self.cache.get(path, max_size)
+            mh.read_metadata_from_image(path)
+        except Exception:
+            pass  # The user will see the error if they navigate to this image
+
+    def shutdown(self):
+        self._generation += 1
+        self._executor.shutdown(wait=False, cancel_futures=True)
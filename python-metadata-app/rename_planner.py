@@ -0,0 +1,362 @@
+# rename_planner.py
+#
+# Batch renaming as one all-or-nothing operation. The complete set of new
+# names is built and checked against a single listing of each directory before
+# anything is renamed, so every collision is reported up front. Files whose
+# current name is wanted by another file in the set (chains, swaps and cycles)
+# are first moved to temporary names, and XMP sidecars move with their images.
+# Every step is written to an undo log before it happens, and a failure or
+# cancel rolls the whole set back.
+
+import os
+import re
+import string
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from piexif import ExifIFD, ImageIFD
+import journal
+import metadata_handler as mh
+import xmp_sidecar
+
+DEFAULT_PATTERN = "{base}-{n}"
+UNDO_DIR = os.path.join(mh.CACHE_DIR, "renames")
+
+PATTERN_FIELDS = ("base", "n", "name", "date", "time", "year", "month", "day", "title", "authors")
+# Fields that need the image's EXIF data
+EXIF_FIELDS = {"date", "time", "year", "month", "day", "title", "authors"}
+PATTERN_HELP = ("{base}, {n} (counter, e.g. {n:03}), {name} (current name), "
+                "{date}, {time}, {year}, {month}, {day} (when taken), {title}, {authors}")
+
+UNSAFE_CHARS = re.compile(r'[\x00-\x1f<>:"/\\|?*]')
+TEMP_PREFIX = ".rename-"
+
+# ----------------------------
+# PLANNING
+# ----------------------------
+
+def pattern_fields(pattern):
+    """Return the field names used by a pattern, rejecting unknown ones."""
+    fields = set()
+    try:
+        for _, name, _, _ in string.Formatter().parse(pattern):
+            if name is None:
+                continue
+            if name not in PATTERN_FIELDS:
+                raise ValueError(f"Unknown field '{{{name}}}' in rename pattern; use {PATTERN_HELP}.")
+            fields.add(name)
+        pattern.format_map(dict.fromkeys(PATTERN_FIELDS, "") | {"n": 1})
+    except (IndexError, KeyError, TypeError) as e:
+        raise ValueError(f"Invalid rename pattern '{pattern}': {e}")
+    return fields
+
+def read_name_fields(path):
+    """Per-file planning worker: the EXIF-based pattern fields of one image.
+
+    The date comes from DateTimeOriginal, falling back to DateTime and then
+    to the file's modification time.
+    """
+    tags = mh.read_image_tags(path, {ImageIFD.DateTime, ImageIFD.ImageDescription, ImageIFD.Artist},
+                              {ExifIFD.DateTimeOriginal})
+    taken = tags["Exif"].get(ExifIFD.DateTimeOriginal) or tags["0th"].get(ImageIFD.DateTime)
+    try:
+        taken = datetime.strptime(taken.decode("ascii").strip(), "%Y:%m:%d %H:%M:%S")
+    except (AttributeError, UnicodeDecodeError, ValueError):
+        taken = datetime.fromtimestamp(os.stat(path).st_mtime)
+    metadata = mh.metadata_from_exif_dict(tags)
+    return {"fields": {
+        "date": taken.strftime("%Y-%m-%d"), "time": taken.strftime("%H%M%S"),
+        "year": taken.strftime("%Y"), "month": taken.strftime("%m"), "day": taken.strftime("%d"),
+        "title": metadata.get("Title", ""), "authors": metadata.get("Authors", ""),
+    }}
+
+def safe_filename(text):
+    """Make pattern output usable as a file name on every platform."""
+    return UNSAFE_CHARS.sub("_", text).strip().rstrip(".")
+
+def name_key(name):
+    # Names are compared case-insensitively so a plan that passes is also safe
+    # on case-insensitive filesystems
+    return os.path.normcase(name).casefold()
+
+def is_temp_name(path):
+    return os.path.basename(path).startswith(TEMP_PREFIX)
+
+class RenamePlan:
+    """The checked result of planning a batch rename.
+
+    renames holds (old_path, new_path) pairs, unchanged the paths that already
+    have their new name, and conflicts one {"path", "target", "error"} dict per
+    problem found. needs_temp is the set of old paths that another file in the
+    plan wants to take over, which therefore move through a temporary name,
+    and sidecars the old paths whose XMP sidecar moves along.
+    """
+
+    def __init__(self):
+        self.renames = []
+        self.unchanged = []
+        self.conflicts = []
+        self.needs_temp = set()
+        self.sidecars = set()
+
+    def conflict(self, path, target, error):
+        self.conflicts.append({"path": path, "target": target, "status": mh.STATUS_FAILED, "error": error})
+
+def plan_renames(image_paths, pattern=DEFAULT_PATTERN, base="", start=1, jobs=None, executor="thread"):
+    """Work out and check the new name of every image without renaming anything.
+
+    Files keep their directory and extension (lower-cased); pattern gives the
+    rest of the name. EXIF fields are read on the batch engine when the
+    pattern uses them. Each directory is listed once to find names that are
+    already taken.
+    """
+    fields = pattern_fields(pattern)
+    paths = [os.path.abspath(path) for path in image_paths]
+    exif = {}
+    if fields & EXIF_FIELDS:
+        results = mh.iter_batch(read_name_fields, set(paths), jobs=jobs, executor=executor)
+        exif = {result["path"]: result for result in results}
+
+    plan = RenamePlan()
+    by_directory = {}
+    seen = set()
+    for n, path in enumerate(paths, start=start):
+        if path in seen:
+            plan.conflict(path, None, "Listed more than once.")
+            continue
+        seen.add(path)
+        directory, name = os.path.split(path)
+        stem, ext = os.path.splitext(name)
+        values = {"base": base, "n": n, "name": stem}
+        if path in exif:
+            if exif[path]["status"] != mh.STATUS_OK:
+                plan.conflict(path, None, exif[path]["error"])
+                continue
+            values.update(exif[path]["fields"])
+        new_stem = safe_filename(pattern.format_map(values))
+        if not new_stem:
+            plan.conflict(path, None, "The pattern gives an empty name.")
+            continue
+        by_directory.setdefault(directory, []).append((path, os.path.join(directory, new_stem + ext.lower())))
+
+    for directory, pairs in by_directory.items():
+        with os.scandir(directory) as entries:
+            existing = {name_key(entry.name) for entry in entries}
+        claimed = {}
+        # Files that keep their name hold on to it
+        for old, new in pairs:
+            if old == new:
+                plan.unchanged.append(old)
+                claimed[name_key(os.path.basename(new))] = old
+        moving = {name_key(os.path.basename(old)): old for old, new in pairs if old != new}
+        moving_sidecars = {name_key(os.path.basename(xmp_sidecar.sidecar_path(old))) for old in moving.values()}
+        for old, new in pairs:
+            if old == new:
+                continue
+            key = name_key(os.path.basename(new))
+            # A sidecar already using the new name would be picked up by the
+            # renamed image, so it blocks the rename like a file would
+            sidecar = os.path.basename(xmp_sidecar.sidecar_path(new))
+            sidecar_taken = name_key(sidecar) in existing and name_key(sidecar) not in moving_sidecars
+            if key in claimed:
+                plan.conflict(old, new, f"'{os.path.basename(new)}' is also the new name of "
+                                        f"'{os.path.basename(claimed[key])}'.")
+            elif key in existing and key not in moving:
+                plan.conflict(old, new, f"A file named '{os.path.basename(new)}' already exists.")
+            elif sidecar_taken:
+                plan.conflict(old, new, f"A file named '{sidecar}' already exists.")
+            else:
+                claimed[key] = old
+                plan.renames.append((old, new))
+                if key in moving:
+                    plan.needs_temp.add(moving[key])
+                if name_key(os.path.basename(xmp_sidecar.sidecar_path(old))) in existing:
+                    plan.sidecars.add(old)
+    return plan
+
+# ----------------------------
+# EXECUTION
+# ----------------------------
+
+def new_summary():
+    return {"total": 0, mh.STATUS_OK: 0, mh.STATUS_FAILED: 0, mh.STATUS_SKIPPED: 0,
+            "elapsed": 0.0, "failures": [], "cancelled": False}
+
+def default_undo_log():
+    return os.path.join(UNDO_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.jsonl")
+
+def execute_renames(plan, undo_log=None, jobs=None, on_result=None, cancel_event=None):
+    """Carry out a RenamePlan as one all-or-nothing operation.
+
+    Plans with conflicts are refused as a whole. Directories are renamed in
+    parallel. If a rename fails or cancel_event is set, every completed step
+    is reversed. on_result is called (possibly from worker threads) for each
+    renamed file and each conflict. Returns a summary like run_batch plus
+    "renamed" ({old_path: new_path}), "rolled_back" and "undo_log".
+    """
+    start_time = time.perf_counter()
+    summary = new_summary()
+    summary.update(renamed={}, rolled_back=False, undo_log=None)
+    summary["total"] = len(plan.renames) + len(plan.unchanged) + len(plan.conflicts)
+    summary[mh.STATUS_SKIPPED] = len(plan.unchanged)
+    if plan.conflicts:
+        for conflict in plan.conflicts:
+            if on_result:
+                on_result(conflict)
+        summary[mh.STATUS_FAILED] = len(plan.conflicts)
+        summary["failures"] = list(plan.conflicts)
+        summary["elapsed"] = time.perf_counter() - start_time
+        return summary
+    if not plan.renames:
+        return summary
+
+    undo_log = undo_log or default_undo_log()
+    if journal.read_journal(undo_log):
+        raise FileExistsError(f"Undo log '{undo_log}' already exists; choose another path.")
+    os.makedirs(os.path.dirname(os.path.abspath(undo_log)), exist_ok=True)
+    summary["undo_log"] = undo_log
+
+    # Phase 1 moves names that other files want out of the way; phase 2 gives
+    # every file its new name. Steps are (from, to, old_path, new_path).
+    token = uuid.uuid4().hex[:12]
+    first, second = {}, {}
+    for i, (old, new) in enumerate(plan.renames):
+        directory = os.path.dirname(old)
+        source = old
+        if old in plan.needs_temp:
+            source = os.path.join(directory, f"{TEMP_PREFIX}{token}-{i}.tmp")
+            first.setdefault(directory, []).append((old, source, old, new))
+        second.setdefault(directory, []).append((source, new, old, new))
+
+    log = journal.Journal(undo_log, fsync_every=0)
+    steps = []
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def stopped():
+        return stop.is_set() or (cancel_event is not None and cancel_event.is_set())
+
+    def rename(source, target, sidecar=False):
+        if os.path.lexists(target):
+            raise FileExistsError(f"A file named '{os.path.basename(target)}' appeared during the rename.")
+        step = {"from": source, "to": target, "sidecar": sidecar}
+        with lock:
+            # Logged before renaming, so the undo also covers a step
+            # interrupted halfway
+            log.write({"event": "step", **step})
+            steps.append(step)
+        os.rename(source, target)
+
+    def run_steps(directory_steps):
+        for source, target, old, new in directory_steps:
+            if stopped():
+                return
+            try:
+                rename(source, target)
+                if old in plan.sidecars:
+                    rename(xmp_sidecar.sidecar_path(source), xmp_sidecar.sidecar_path(target), sidecar=True)
+            except OSError as e:
+                with lock:
+                    summary["failures"].append({"path": old, "target": new, "status": mh.STATUS_FAILED,
+                                                "error": f"{type(e).__name__}: {e}"})
+                stop.set()
+                return
+            mh.invalidate_metadata_cache(source)
+            if target == new:
+                mh.invalidate_metadata_cache(new)
+                mh.notify_write("rename", old, new)
+                with lock:
+                    summary["renamed"][old] = new
+                    if on_result:
+                        on_result({"path": old, "status": mh.STATUS_OK, "new_path": new, "error": None})
+
+    def run_phase(steps_by_directory):
+        groups = list(steps_by_directory.values())
+        workers = min(jobs or os.cpu_count() or 1, len(groups))
+        if workers <= 1:
+            for group in groups:
+                run_steps(group)
+        else:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rename") as pool:
+                list(pool.map(run_steps, groups))
+
+    try:
+        log.write({"event": "start", "renames": len(plan.renames)}, sync=True)
+        run_phase(first)
+        if not stopped():
+            log.write({"event": "phase", "phase": 2}, sync=True)
+            run_phase(second)
+        if stopped():
+            summary["cancelled"] = not stop.is_set()
+            summary["failures"] += undo_steps(steps)
+            summary["renamed"] = {}
+            summary["rolled_back"] = True
+            log.write({"event": "undone"}, sync=True)
+        else:
+            log.write({"event": "finish"}, sync=True)
+    finally:
+        log.close()
+
+    summary[mh.STATUS_OK] = len(summary["renamed"])
+    summary[mh.STATUS_FAILED] = len(summary["failures"])
+    summary["elapsed"] = time.perf_counter() - start_time
+    return summary
+
+def rename_images(image_paths, pattern=DEFAULT_PATTERN, base="", start=1, jobs=None, undo_log=None,
+                  on_result=None, cancel_event=None):
+    """Plan and carry out a batch rename; see plan_renames and execute_renames."""
+    plan = plan_renames(image_paths, pattern, base=base, start=start, jobs=jobs)
+    return execute_renames(plan, undo_log=undo_log, jobs=jobs, on_result=on_result, cancel_event=cancel_event)
+
+# ----------------------------
+# UNDO
+# ----------------------------
+
+def undo_steps(steps):
+    """Reverse logged rename steps, newest first. Returns failure dicts.
+
+    A step is only reversed while its target exists and its source is free,
+    so steps that never happened or were already undone are skipped.
+    """
+    failures = []
+    for step in reversed(steps):
+        source, target = step["from"], step["to"]
+        if not os.path.lexists(target) or os.path.lexists(source):
+            continue
+        try:
+            os.rename(target, source)
+        except OSError as e:
+            failures.append({"path": target, "target": source, "status": mh.STATUS_FAILED,
+                             "error": f"{type(e).__name__}: {e}"})
+            continue
+        mh.invalidate_metadata_cache(source)
+        mh.invalidate_metadata_cache(target)
+        if not step.get("sidecar") and not is_temp_name(source) and not is_temp_name(target):
+            mh.notify_write("rename", target, source)
+    return failures
+
+def undo_renames(undo_log):
+    """Give every file renamed by a logged run its old name back.
+
+    Can be run again after an interruption. Returns a summary like run_batch.
+    """
+    records = journal.read_journal(undo_log)
+    if not records:
+        raise FileNotFoundError(f"Undo log '{undo_log}' not found.")
+    steps = [r for r in records if r.get("event") == "step"]
+    start_time = time.perf_counter()
+    summary = new_summary()
+    originals = [step for step in steps if not is_temp_name(step["from"]) and not step.get("sidecar")]
+    summary["total"] = len(originals)
+    summary["failures"] = undo_steps(steps)
+    summary[mh.STATUS_FAILED] = len(summary["failures"])
+    summary[mh.STATUS_OK] = sum(1 for step in originals if os.path.lexists(step["from"]))
+    log = journal.Journal(undo_log, fsync_every=0)
+    try:
+        log.write({"event": "undone"}, sync=True)
+    finally:
+        log.close()
+    summary["elapsed"] = time.perf_counter() - start_time
+    return summary
@@ -0,0 +1,390 @@
+# server.py
+#
+# Local HTTP tagging service. One long-lived process keeps Pillow, piexif and
+# a worker pool warm so other tools can read, apply and clear metadata with a
+# request instead of importing the engine themselves. Requests and responses
+# are JSON; connections are kept alive between requests.
+#
+#   python3 cli.py serve --port 8765 --jobs 8
+#   curl -s localhost:8765/apply -H "Content-Type: application/json" -d '{"paths": ["shoot/"], "template": "Wedding"}'
+#   curl -s localhost:8765/jobs -H "Content-Type: application/json" \
+#        -d '{"operation": "apply", "paths": ["/archive"], "fields": {"Tags": "x"}}'
+#   curl -s localhost:8765/jobs/<id>
+#
+# Endpoints:
+#   GET    /health                 worker count and running jobs
+#   GET    /metrics                Prometheus text from the instrumentation sink
+#   GET    /templates              saved template names
+#   POST   /read, /apply, /clear   run on the given paths and return every result
+#   POST   /jobs                   start a background job ({"operation": ..., ...})
+#   GET    /jobs, /jobs/<id>       job status and counts
+#   GET    /jobs/<id>/results      kept results (?offset=0&limit=1000)
+#   DELETE /jobs/<id>              cancel a job
+#
+# The server reads and writes any path its user can, so it only listens on
+# localhost unless told otherwise. Web pages in the user's browser can reach
+# localhost too, so requests must name an allowed host (which defeats DNS
+# rebinding), may not come from a foreign Origin, and POST and DELETE must be
+# sent as application/json, which browsers won't send cross-site without a
+# CORS preflight this server never grants.
+
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import instrumentation
+import metadata_handler as mh
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+MAX_BODY_BYTES = 16 * 1024 * 1024
+# Finished jobs kept for status queries; older ones are forgotten
+MAX_FINISHED_JOBS = 200
+# Seconds an idle keep-alive connection stays open
+IDLE_TIMEOUT = 60
+# Host names always accepted in the Host and Origin headers
+LOCAL_HOSTS = {"localhost", "127.0.0.1", "::1"}
+
+def host_name(value):
+    """Lower-cased host of a Host header ("name:port") or an Origin URL, or None."""
+    if not value:
+        return None
+    return urlsplit(value if "://" in value else "//" + value).hostname
+
+class BadRequest(ValueError):
+    """A request the server refuses; reported as 400 with the message."""
+
+def read_one(path, sidecar=True):
+    return {"metadata": mh.read_metadata_from_image(path, raise_errors=True, sidecar=sidecar)}
+
+def _option(body, key, kind, default):
+    value = body.get(key, default)
+    if not isinstance(value, kind):
+        raise BadRequest(f"'{key}' must be a {kind.__name__}.")
+    return value
+
+def gather_metadata(body):
+    """Build a metadata dictionary from a request's "template" and "fields".
+
+    As in the GUI and CLI, fields that are neither in the template nor given
+    are written empty.
+    """
+    fields = _option(body, "fields", dict, {})
+    unknown = set(fields) - set(mh.METADATA_FIELDS)
+    if unknown:
+        raise BadRequest(f"Unknown field(s): {', '.join(sorted(unknown))}.")
+    if not all(isinstance(value, str) for value in fields.values()):
+        raise BadRequest("Field values must be strings.")
+    template = _option(body, "template", (str, type(None)), None)
+    if template is None and not fields:
+        raise BadRequest("Give 'fields', a 'template' or both.")
+    try:
+        metadata = mh.load_template(template) if template else {}
+    except (FileNotFoundError, ValueError) as e:
+        raise BadRequest(str(e))
+    metadata.update(fields)
+    return {key: metadata.get(key, "") for key in mh.METADATA_FIELDS}
+
+def build_task(operation, body):
+    """Return (func, args) for an operation and its request body."""
+    if operation == "read":
+        return read_one, (_option(body, "sidecar", bool, True),)
+    if operation == "apply":
+        plan = mh.compile_metadata(gather_metadata(body))
+        return mh.apply_metadata_to_image, (plan, _option(body, "dry_run", bool, False),
+                                            _option(body, "sidecar", bool, False))
+    if operation == "clear":
+        return mh.clear_metadata_from_image, (_option(body, "sidecar", bool, False),)
+    raise BadRequest(f"Unknown operation '{operation}' (expected read, apply or clear).")
+
+def request_paths(body):
+    """Lazily expand a request's "paths" (files, directories and globs)."""
+    paths = body.get("paths")
+    if not paths or not isinstance(paths, list) or not all(isinstance(p, str) for p in paths):
+        raise BadRequest("'paths' must be a non-empty list of strings.")
+    return mh.iter_image_paths(paths, recursive=_option(body, "recursive", bool, True))
+
+class Job:
+    """A background batch and its progress, safe to read from any thread."""
+
+    def __init__(self, operation, keep_results):
+        self.id = uuid.uuid4().hex[:12]
+        self.operation = operation
+        self.keep_results = keep_results
+        self.state = "queued"
+        self.created = time.time()
+        self.started = self.finished = None
+        self.counts = {mh.STATUS_OK: 0, mh.STATUS_SKIPPED: 0, mh.STATUS_FAILED: 0}
+        self.results = []
+        self.failures = []
+        self.error = None
+        self.cancel_event = threading.Event()
+        self.rate = instrumentation.RateMeter()
+        self._lock = threading.Lock()
+
+    def record(self, result):
+        with self._lock:
+            self.counts[result["status"]] += 1
+            if result["status"] == mh.STATUS_FAILED:
+                self.failures.append(result)
+            if self.keep_results:
+                self.results.append(result)
+            self.rate.tick()
+
+    def status(self):
+        with self._lock:
+            return {"id": self.id, "operation": self.operation, "state": self.state,
+                    "created": self.created, "started": self.started, "finished": self.finished,
+                    "total": sum(self.counts.values()), **self.counts,
+                    "files_per_second": self.rate.rate() if self.state == "running" else None,
+                    "failures": self.failures[:100], "error": self.error}
+
+    def result_page(self, offset, limit):
+        with self._lock:
+            return {"id": self.id, "offset": offset, "total": len(self.results),
+                    "results": self.results[offset:offset + limit]}
+
+    @property
+    def done(self):
+        return self.state not in ("queued", "running")
+
+class TaggingService:
+    """The warm worker pool and job table behind the HTTP handler.
+
+    Synchronous requests and background jobs share one thread pool of
+    `workers` threads, which lives as long as the service.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="tagging")
+        self.jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _batch_options(self):
+        return {"jobs": self.workers, "executor": self.pool}
+
+    def run(self, operation, body):
+        """Run an operation to completion; returns (results, summary)."""
+        func, args = build_task(operation, body)
+        results = []
+        summary = mh.run_batch(func, request_paths(body), *args, on_result=results.append, **self._batch_options())
+        del summary["failures"]  # Already among the results
+        return results, summary
+
+    def submit(self, body):
+        """Start a background job and return it."""
+        operation = _option(body, "operation", str, "")
+        func, args = build_task(operation, body)
+        paths = request_paths(body)
+        job = Job(operation, _option(body, "keep_results", bool, operation == "read"))
+        with self._lock:
+            self.jobs[job.id] = job
+            self._prune()
+        threading.Thread(target=self._run_job, args=(job, func, paths, args), daemon=True,
+                         name=f"job-{job.id}").start()
+        return job
+
+    def _run_job(self, job, func, paths, args):
+        job.state, job.started = "running", time.time()
+        try:
+            mh.run_batch(func, paths, *args, on_result=job.record, cancel_event=job.cancel_event,
+                         **self._batch_options())
+            job.state = "cancelled" if job.cancel_event.is_set() else "done"
+        except Exception as e:
+            logger.exception("Job %s failed", job.id)
+            job.state, job.error = "error", f"{type(e).__name__}: {e}"
+        job.finished = time.time()
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.done]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job_id]
+
+    def get_job(self, job_id):
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def list_jobs(self):
+        with self._lock:
+            return list(self.jobs.values())
+
+    def close(self):
+        """Cancel running jobs and wait for the pool to finish its current files."""
+        for job in self.list_jobs():
+            job.cancel_event.set()
+        self.pool.shutdown(wait=True)
+
+class RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive
+    server_version = "PhotoMetadata/1.0"
+    timeout = IDLE_TIMEOUT
+
+    @property
+    def service(self):
+        return self.server.service
+
+    def log_message(self, format, *args):
+        logger.info("%s %s", self.address_string(), format % args)
+
+    def send_json(self, payload, status=HTTPStatus.OK):
+        self.send_body(json.dumps(payload, ensure_ascii=False).encode("utf-8"), "application/json", status)
+
+    def send_body(self, data, content_type, status=HTTPStatus.OK):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(data)
+
+    def send_error_json(self, status, message):
+        self.send_json({"error": message}, status)
+
+    def read_body(self):
+        """Parse the request body as a JSON object."""
+        try:
+            body = json.loads(self.body or b"{}")
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            raise BadRequest(f"Invalid JSON: {e}")
+        if not isinstance(body, dict):
+            raise BadRequest("Request body must be a JSON object.")
+        return body
+
+    def check_sender(self, method):
+        """Return (status, message) for a request a web page could have forged, else None."""
+        allowed = self.server.allowed_hosts
+        host = self.headers.get("Host")
+        if host is not None and host_name(host) not in allowed:
+            return HTTPStatus.FORBIDDEN, f"Host '{host}' is not allowed."
+        origin = self.headers.get("Origin")
+        if origin is not None and host_name(origin) not in allowed:
+            return HTTPStatus.FORBIDDEN, f"Origin '{origin}' is not allowed."
+        if method in ("POST", "DELETE") and self.headers.get_content_type() != "application/json":
+            return HTTPStatus.UNSUPPORTED_MEDIA_TYPE, "Send requests as Content-Type: application/json."
+        return None
+
+    def route(self, method):
+        url = urlsplit(self.path)
+        parts = [part for part in url.path.split("/") if part]
+        query = parse_qs(url.query)
+        try:
+            # Always consume the body, or it would be read as the next request
+            # on this kept-alive connection
+            length = self.headers.get("Content-Length") or "0"
+            if not (length.isascii() and length.isdigit()):
+                # The body's end is unknown, so the connection can't be reused
+                self.close_connection = True
+                return self.send_error_json(HTTPStatus.BAD_REQUEST, "Invalid Content-Length.")
+            length = int(length)
+            if length > MAX_BODY_BYTES:
+                self.close_connection = True
+                return self.send_error_json(HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                                            f"Request body larger than {MAX_BODY_BYTES} bytes.")
+            self.body = self.rfile.read(length)
+            refusal = self.check_sender(method)
+            if refusal:
+                return self.send_error_json(*refusal)
+            if method == "POST" and len(parts) == 1 and parts[0] in ("read", "apply", "clear"):
+                results, summary = self.service.run(parts[0], self.read_body())
+                return self.send_json({"results": results, "summary": summary})
+            if parts == ["jobs"]:
+                if method == "POST":
+                    job = self.service.submit(self.read_body())
+                    return self.send_json(job.status(), HTTPStatus.ACCEPTED)
+                if method == "GET":
+                    return self.send_json({"jobs": [job.status() for job in self.service.list_jobs()]})
+            elif len(parts) in (2, 3) and parts[0] == "jobs":
+                job = self.service.get_job(parts[1])
+                if job is None:
+                    return self.send_error_json(HTTPStatus.NOT_FOUND, f"No job '{parts[1]}'.")
+                if len(parts) == 3 and parts[2] == "results" and method == "GET":
+                    offset = int(query.get("offset", ["0"])[0])
+                    limit = int(query.get("limit", ["1000"])[0])
+                    return self.send_json(job.result_page(max(0, offset), max(0, limit)))
+                if len(parts) == 2 and method == "GET":
+                    return self.send_json(job.status())
+                if len(parts) == 2 and method == "DELETE":
+                    job.cancel_event.set()
+                    return self.send_json(job.status())
+            elif parts == ["health"] and method == "GET":
+                running = sum(1 for job in self.service.list_jobs() if job.state == "running")
+                return self.send_json({"status": "ok", "workers": self.service.workers, "jobs_running": running})
+            elif parts == ["metrics"] and method == "GET":
+                return self.send_body(self.server.metrics.to_prometheus().encode("utf-8"),
+                                      "text/plain; version=0.0.4")
+            elif parts == ["templates"] and method == "GET":
+                return self.send_json({"templates": sorted(mh.list_templates())})
+            else:
+                return self.send_error_json(HTTPStatus.NOT_FOUND, f"No such endpoint: {url.path}")
+            return self.send_error_json(HTTPStatus.METHOD_NOT_ALLOWED, f"{method} is not allowed on {url.path}")
+        except ValueError as e:  # BadRequest, or a malformed query parameter
+            self.send_error_json(HTTPStatus.BAD_REQUEST, str(e))
+        except Exception as e:
+            logger.exception("Error handling %s %s", method, self.path)
+            self.send_error_json(HTTPStatus.INTERNAL_SERVER_ERROR, f"{type(e).__name__}: {e}")
+
+    def do_GET(self):
+        self.route("GET")
+
+    def do_HEAD(self):
+        self.route("GET")
+
+    def do_POST(self):
+        self.route("POST")
+
+    def do_DELETE(self):
+        self.route("DELETE")
+
+class TaggingServer(ThreadingHTTPServer):
+    """ThreadingHTTPServer carrying the TaggingService and metrics sink.
+
+    Requests are accepted for localhost, the address the server listens on
+    and allowed_hosts.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, service, metrics, allowed_hosts=()):
+        super().__init__(address, RequestHandler)
+        self.service = service
+        self.metrics = metrics
+        self.allowed_hosts = LOCAL_HOSTS | {host.lower() for host in (address[0], *allowed_hosts)}
+
+def make_server(host=DEFAULT_HOST, port=DEFAULT_PORT, workers=None, allowed_hosts=()):
+    """Create a server with its own worker pool; serve_forever() starts it.
+
+    allowed_hosts are extra host names clients may use to reach the server,
+    such as the machine's name when listening on all interfaces. A
+    MetricsSink is added to the instrumentation hook for /metrics, next to
+    whatever sink was already installed.
+    """
+    existing = mh.get_instrumentation()
+    if isinstance(existing, instrumentation.MetricsSink):
+        metrics = existing
+    else:
+        metrics = instrumentation.MetricsSink()
+        mh.set_instrumentation(instrumentation.MultiSink(existing, metrics))
+    return TaggingServer((host, port), TaggingService(workers), metrics, allowed_hosts)
+
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, workers=None, allowed_hosts=()):
+    """Serve until interrupted, then cancel running jobs and shut down."""
+    server = make_server(host, port, workers, allowed_hosts)
+    logger.info("Serving on http://%s:%s with %s worker(s)", *server.server_address[:2], server.service.workers)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.service.close()
@@ -0,0 +1,385 @@
+# sharding.py
+#
+# Sharded batch runs for trees too large for one machine. A manifest directory
+# on the shared filesystem splits the target list into shards, and any number
+# of workers, on one host or many, claim shards through lease files and record
+# the finished ones with done markers:
+#
+#   DIR/manifest.json           shard and file counts
+#   DIR/shards/000042.json      the shard's paths, one JSON string per line
+#   DIR/leases/apply/000042.3   lease on shard 42 for "apply", generation 3
+#   DIR/done/apply/000042       summary of the finished shard
+#
+# Lease files are created with O_EXCL, so exactly one worker gets each
+# generation. The holder renews its lease by touching the file; once it has not
+# been touched for the lease's ttl (or, on the same host, its process is gone),
+# the next worker to look creates the next generation and does the shard again.
+# Per-file operations skip files that are already up to date, so redoing part
+# of a shard is cheap. The old holder notices the newer generation at its next
+# renewal and stops.
+#
+#   sharding.create_manifest("/nas/run", mh.iter_image_paths(["/nas/archive"]))
+#   sharding.run_shards("/nas/run", "apply", mh.apply_metadata_to_image, plan)  # on every host
+
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+import metadata_handler as mh
+
+MANIFEST_NAME = "manifest.json"
+DEFAULT_SHARD_SIZE = 500
+# Seconds a lease stays valid without renewal; it is renewed every third of that
+LEASE_SECONDS = 300
+# Seconds a worker with nothing to claim waits before looking again
+POLL_SECONDS = 5
+
+HOST = socket.gethostname()
+
+def _shard_name(shard):
+    return f"{shard:06d}"
+
+def _write_file(path, text):
+    """Write text to path durably, replacing it in one step."""
+    fd, tmp_path = tempfile.mkstemp(prefix=".", suffix=".tmp", dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def _relative(path, base):
+    try:
+        return os.path.relpath(os.path.abspath(path), base)
+    except ValueError:
+        return os.path.abspath(path)  # Another drive on Windows
+
+def default_worker_id():
+    return f"{HOST}:{os.getpid()}"
+
+# ----------------------------
+# MANIFEST
+# ----------------------------
+
+def create_manifest(manifest_dir, image_paths, shard_size=DEFAULT_SHARD_SIZE):
+    """Split image_paths into shards of shard_size files under manifest_dir.
+
+    image_paths may be a lazy iterator. Paths are stored relative to
+    manifest_dir where possible, so hosts may mount the share at different
+    places as long as the manifest lives on it too. The manifest file is
+    written last, so an interrupted create leaves no usable manifest. Returns
+    the manifest dictionary.
+    """
+    if shard_size < 1:
+        raise ValueError("Shard size must be at least 1.")
+    manifest_path = os.path.join(manifest_dir, MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        raise FileExistsError(f"Manifest '{manifest_path}' already exists; choose another directory.")
+    shards_dir = os.path.join(manifest_dir, "shards")
+    os.makedirs(shards_dir, exist_ok=True)
+    base = os.path.abspath(manifest_dir)
+    shards = files = 0
+    batch = []
+
+    def flush():
+        nonlocal shards
+        _write_file(os.path.join(shards_dir, _shard_name(shards) + ".json"),
+                    "".join(json.dumps(path) + "\n" for path in batch))
+        shards += 1
+        batch.clear()
+
+    for path in image_paths:
+        batch.append(_relative(path, base))
+        files += 1
+        if len(batch) >= shard_size:
+            flush()
+    if batch:
+        flush()
+    manifest = {"version": 1, "shards": shards, "files": files, "shard_size": shard_size, "created": time.time()}
+    _write_file(manifest_path, json.dumps(manifest, indent=2))
+    return manifest
+
+def load_manifest(manifest_dir):
+    manifest_path = os.path.join(manifest_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        raise FileNotFoundError(f"No manifest in '{manifest_dir}'; create one with 'shard create'.")
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def read_shard(manifest_dir, shard):
+    """Return the absolute paths of one shard."""
+    base = os.path.abspath(manifest_dir)
+    with open(os.path.join(base, "shards", _shard_name(shard) + ".json"), "r", encoding="utf-8") as f:
+        return [os.path.normpath(os.path.join(base, json.loads(line))) for line in f if line.strip()]
+
+def _run_dirs(manifest_dir, operation):
+    lease_dir = os.path.join(manifest_dir, "leases", operation)
+    done_dir = os.path.join(manifest_dir, "done", operation)
+    os.makedirs(lease_dir, exist_ok=True)
+    os.makedirs(done_dir, exist_ok=True)
+    return lease_dir, done_dir
+
+def _done_shards(done_dir):
+    return {int(name) for name in os.listdir(done_dir) if name.isdigit()}
+
+def mark_done(manifest_dir, operation, shard, record):
+    _, done_dir = _run_dirs(manifest_dir, operation)
+    _write_file(os.path.join(done_dir, _shard_name(shard)), json.dumps(record, ensure_ascii=False))
+
+# ----------------------------
+# LEASES
+# ----------------------------
+
+def _lease_files(lease_dir):
+    """Map shard -> [(generation, path)] of its lease files, newest first."""
+    leases = {}
+    for name in os.listdir(lease_dir):
+        shard, _, generation = name.partition(".")
+        if shard.isdigit() and generation.isdigit():  # Skips temp files
+            leases.setdefault(int(shard), []).append((int(generation), os.path.join(lease_dir, name)))
+    for generations in leases.values():
+        generations.sort(reverse=True)
+    return leases
+
+def _process_alive(pid):
+    if os.name != "posix" or not isinstance(pid, int):
+        return True  # Can't tell; wait for the lease to expire
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def read_lease(path):
+    """Return (info, expired) for a lease file, or None if it has gone.
+
+    Expiry compares the file's mtime, set by the file server on network
+    shares, with this host's clock, so ttl must allow for clock skew.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            info = json.load(f)
+    except (OSError, ValueError):
+        info = {}  # Still being written, or its writer died first
+    expired = time.time() - stat.st_mtime > info.get("ttl", LEASE_SECONDS)
+    if not expired and info.get("host") == HOST:
+        expired = not _process_alive(info.get("pid"))
+    return info, expired
+
+class Lease:
+    """A worker's claim on one shard, from claim_shard."""
+
+    def __init__(self, path, shard, generation, ttl):
+        self.path = path
+        self.shard = shard
+        self.generation = generation
+        self.ttl = ttl
+        self.lost = threading.Event()  # Set once another worker has taken the shard over
+
+    def renew(self):
+        """Touch the lease; returns False once it has been taken over."""
+        if not self.lost.is_set():
+            successor = f"{self.path.rpartition('.')[0]}.{self.generation + 1}"
+            try:
+                if os.path.exists(successor):
+                    raise FileExistsError(successor)
+                os.utime(self.path)
+            except OSError:
+                self.lost.set()
+        return not self.lost.is_set()
+
+    def release(self, older_only=False):
+        """Remove this lease (and older generations of it)."""
+        for generation, path in _lease_files(os.path.dirname(self.path)).get(self.shard, []):
+            if generation < self.generation or (generation == self.generation and not older_only):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+def _create_lease(lease_dir, shard, generation, worker_id, ttl):
+    path = os.path.join(lease_dir, f"{_shard_name(shard)}.{generation}")
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+    except FileExistsError:
+        return None  # Another worker got this generation first
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump({"worker": worker_id, "host": HOST, "pid": os.getpid(), "ttl": ttl, "claimed": time.time()}, f)
+    lease = Lease(path, shard, generation, ttl)
+    lease.release(older_only=True)  # Tells a slow previous holder it has lost the shard
+    return lease
+
+def claim_shard(manifest_dir, operation, worker_id=None, ttl=LEASE_SECONDS):
+    """Lease the first shard that is neither done nor held by a live worker.
+
+    Returns a Lease, or None if there is nothing to claim right now. Relies on
+    exclusive file creation, which NFSv3 and later and SMB shares provide.
+    """
+    manifest = load_manifest(manifest_dir)
+    lease_dir, done_dir = _run_dirs(manifest_dir, operation)
+    done = _done_shards(done_dir)
+    leases = _lease_files(lease_dir)
+    for shard in range(manifest["shards"]):
+        if shard in done:
+            continue
+        generation = 0
+        if shard in leases:
+            newest, path = leases[shard][0]
+            state = read_lease(path)
+            if state is None or not state[1]:
+                continue  # Held by a live worker, or released since the listing
+            generation = newest + 1
+        lease = _create_lease(lease_dir, shard, generation, worker_id or default_worker_id(), ttl)
+        if lease is None:
+            continue
+        if os.path.exists(os.path.join(done_dir, _shard_name(shard))):
+            lease.release()  # Finished while this worker was looking
+            continue
+        return lease
+    return None
+
+# ----------------------------
+# RUNNING
+# ----------------------------
+
+class _AnyEvent:
+    """Cancel event for run_batch that is set once any of the given events is."""
+
+    def __init__(self, *events):
+        self.events = [event for event in events if event is not None]
+
+    def is_set(self):
+        return any(event.is_set() for event in self.events)
+
+def _keep_renewed(lease, stop):
+    while not stop.wait(lease.ttl / 3):
+        if not lease.renew():
+            return
+
+def run_shards(manifest_dir, operation, func, *args, worker_id=None, ttl=LEASE_SECONDS, wait=True,
+               on_result=None, on_shard=None, cancel_event=None, **options):
+    """Claim shards of a manifest one at a time and run func(path, *args) on their files.
+
+    operation names the run ("apply", "clear", ...): leases and done markers
+    are kept per operation, so one manifest can be read, then applied. With
+    wait, the worker keeps polling while other workers hold shards, so it
+    takes over any whose holder dies; otherwise it returns once there is
+    nothing left to claim. on_shard(shard, record) is called for every shard
+    finished here. options are passed to run_batch; a named executor is
+    started once and shared by all shards.
+
+    Returns a summary like run_batch for the files this worker processed,
+    with "shards" (finished here) and "lost" (taken over by another worker).
+    """
+    worker_id = worker_id or default_worker_id()
+    summary = {"total": 0, mh.STATUS_OK: 0, mh.STATUS_FAILED: 0, mh.STATUS_SKIPPED: 0,
+               "elapsed": 0.0, "failures": [], "cancelled": False, "shards": 0, "lost": 0}
+    start = time.perf_counter()
+    _, done_dir = _run_dirs(manifest_dir, operation)
+    jobs = options.get("jobs") or os.cpu_count() or 1
+    pool, owned = None, False
+    if jobs > 1:
+        pool, owned = mh._make_executor(options.get("executor", "thread"), jobs)
+        options["executor"] = pool
+    try:
+        while not mh._is_set(cancel_event):
+            lease = claim_shard(manifest_dir, operation, worker_id, ttl)
+            if lease is None:
+                if len(_done_shards(done_dir)) >= load_manifest(manifest_dir)["shards"] or not wait:
+                    break
+                if cancel_event is not None:
+                    cancel_event.wait(POLL_SECONDS)
+                else:
+                    time.sleep(POLL_SECONDS)
+                continue
+            stop = threading.Event()
+            heartbeat = threading.Thread(target=_keep_renewed, args=(lease, stop), daemon=True)
+            heartbeat.start()
+            try:
+                shard_summary = mh.run_batch(func, read_shard(manifest_dir, lease.shard), *args, on_result=on_result,
+                                             cancel_event=_AnyEvent(cancel_event, lease.lost), **options)
+            except BaseException:
+                lease.release()
+                raise
+            finally:
+                stop.set()
+                heartbeat.join()
+            for key in ("total", mh.STATUS_OK, mh.STATUS_FAILED, mh.STATUS_SKIPPED):
+                summary[key] += shard_summary[key]
+            summary["failures"].extend(shard_summary["failures"])
+            if lease.lost.is_set():
+                summary["lost"] += 1
+                continue
+            if mh._is_set(cancel_event):
+                lease.release()
+                break
+            record = {"shard": lease.shard, "worker": worker_id, "finished": time.time(),
+                      "elapsed": shard_summary["elapsed"],
+                      **{key: shard_summary[key] for key in ("total", mh.STATUS_OK, mh.STATUS_FAILED, mh.STATUS_SKIPPED)},
+                      "failures": [{"path": r["path"], "error": r["error"]} for r in shard_summary["failures"]]}
+            # Marked done before the lease goes, so the shard is never free to claim again
+            mark_done(manifest_dir, operation, lease.shard, record)
+            lease.release()
+            summary["shards"] += 1
+            if on_shard:
+                on_shard(lease.shard, record)
+    finally:
+        if owned:
+            pool.shutdown(wait=True)
+    summary["elapsed"] = time.perf_counter() - start
+    summary["files_per_second"] = summary["total"] / summary["elapsed"] if summary["elapsed"] else 0.0
+    summary["cancelled"] = mh._is_set(cancel_event)
+    return summary
+
+def shard_status(manifest_dir, operation):
+    """Summarize an operation's progress over a manifest.
+
+    Counts shards that are done, leased by a live worker, expired (their
+    holder is presumed dead) and pending, adds up the per-file counts of the
+    done shards and lists their failures and the live workers.
+    """
+    manifest = load_manifest(manifest_dir)
+    lease_dir, done_dir = _run_dirs(manifest_dir, operation)
+    status = {"operation": operation, "shards": manifest["shards"], "files": manifest["files"],
+              "done": 0, "leased": 0, "expired": 0, "pending": 0,
+              mh.STATUS_OK: 0, mh.STATUS_SKIPPED: 0, mh.STATUS_FAILED: 0, "failures": [], "workers": []}
+    done = _done_shards(done_dir)
+    leases = _lease_files(lease_dir)
+    workers = set()
+    for shard in range(manifest["shards"]):
+        if shard in done:
+            status["done"] += 1
+            try:
+                with open(os.path.join(done_dir, _shard_name(shard)), "r", encoding="utf-8") as f:
+                    record = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for key in (mh.STATUS_OK, mh.STATUS_SKIPPED, mh.STATUS_FAILED):
+                status[key] += record.get(key, 0)
+            status["failures"].extend(record.get("failures", []))
+            continue
+        state = read_lease(leases[shard][0][1]) if shard in leases else None
+        if state is None:
+            status["pending"] += 1
+        elif state[1]:
+            status["expired"] += 1
+        else:
+            status["leased"] += 1
+            workers.add(state[0].get("worker"))
+    status["workers"] = sorted(worker for worker in workers if worker)
+    return status
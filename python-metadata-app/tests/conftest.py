@@ -0,0 +1,36 @@
+# Shared fixtures for the test suite. Run from python-metadata-app with
+#
+#   python -m pytest -q
+
+import os
+import sys
+import tempfile
+
+import piexif
+import pytest
+from PIL import Image
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+# Keep caches, thumbnails and undo logs out of the real cache folder
+os.environ["XDG_CACHE_HOME"] = tempfile.mkdtemp(prefix="photo-metadata-tests-")
+
+def make_exif(description=b"Original", make=b"Camera"):
+    """Exif block with a Title, a tag the app does not manage and an Exif IFD entry."""
+    return piexif.dump({"0th": {piexif.ImageIFD.ImageDescription: description, piexif.ImageIFD.Make: make},
+                        "Exif": {piexif.ExifIFD.DateTimeOriginal: b"2020:01:02 03:04:05"}})
+
+def make_image(size=(64, 48)):
+    image = Image.new("RGB", size, (10, 200, 30))
+    for x in range(size[0]):
+        image.putpixel((x, x % size[1]), (x % 256, 0, 255))
+    return image
+
+@pytest.fixture
+def jpeg_factory(tmp_path):
+    """make(name, title="Original") writes a small JPEG with Exif and returns its path."""
+    def make(name, title="Original"):
+        path = str(tmp_path / name)
+        make_image().save(path, "JPEG", exif=make_exif(title.encode()))
+        return path
+    return make
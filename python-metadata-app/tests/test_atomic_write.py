@@ -0,0 +1,57 @@
+import os
+import stat
+
+import pytest
+
+import metadata_handler as mh
+
+def apply_title(path, title="New"):
+    return mh.apply_metadata_to_image(path, mh.compile_metadata({"Title": title}))
+
+def title(path):
+    return mh.read_metadata_from_image(path, raise_errors=True)["Title"]
+
+def test_symlink_stays_a_link_and_its_target_is_updated(tmp_path, jpeg_factory):
+    real = jpeg_factory("real.jpg")
+    link = str(tmp_path / "link.jpg")
+    os.symlink(real, link)
+    apply_title(link)
+    assert os.path.islink(link) and os.readlink(link) == real
+    assert title(real) == "New"
+    assert [name for name in os.listdir(tmp_path) if name.endswith(".tmp")] == []
+
+def test_read_only_file_is_refused_and_left_alone(jpeg_factory):
+    path = jpeg_factory("locked.jpg")
+    os.chmod(path, 0o444)
+    before = open(path, "rb").read()
+    with pytest.raises(PermissionError):
+        apply_title(path)
+    assert open(path, "rb").read() == before
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o444
+
+def test_mode_is_kept_and_times_are_the_writes(jpeg_factory):
+    path = jpeg_factory("photo.jpg")
+    os.chmod(path, 0o640)
+    os.utime(path, (1, 1))
+    apply_title(path)
+    st = os.stat(path)
+    assert stat.S_IMODE(st.st_mode) == 0o640
+    assert st.st_mtime > 1
+
+def test_hard_linked_file_is_written_in_place(tmp_path, jpeg_factory):
+    path = jpeg_factory("photo.jpg")
+    other = str(tmp_path / "other.jpg")
+    os.link(path, other)
+    inode = os.stat(path).st_ino
+    apply_title(path)
+    assert os.stat(path).st_ino == inode and os.path.samefile(path, other)
+    assert title(other) == "New"
+
+def test_extended_attributes_are_kept(jpeg_factory):
+    path = jpeg_factory("photo.jpg")
+    try:
+        os.setxattr(path, "user.rating", b"5")
+    except (AttributeError, OSError):
+        pytest.skip("no user extended attributes here")
+    apply_title(path)
+    assert os.getxattr(path, "user.rating") == b"5"
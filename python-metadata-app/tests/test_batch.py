@@ -0,0 +1,54 @@
+import threading
+
+import pytest
+
+import metadata_handler as mh
+
+@pytest.mark.parametrize("executor", ["thread", "process"])
+def test_results_are_reported_per_file(tmp_path, jpeg_factory, executor):
+    paths = [jpeg_factory(f"img{i}.jpg") for i in range(4)]
+    paths.append(jpeg_factory("same.jpg", title="New"))
+    broken = tmp_path / "broken.jpg"
+    broken.write_bytes(b"\xff\xd8 not really a jpeg")
+    paths.append(str(broken))
+
+    results = []
+    summary = mh.apply_metadata_to_images(paths, {"Title": "New"}, jobs=2, executor=executor,
+                                          on_result=results.append)
+    assert (summary["total"], summary["ok"], summary["skipped"], summary["failed"]) == (6, 4, 1, 1)
+    assert sorted(result["path"] for result in results) == sorted(paths)
+    [failure] = summary["failures"]
+    assert failure["path"] == str(broken) and failure["error"]
+    assert not summary["cancelled"]
+
+def test_paths_are_consumed_lazily_and_in_bounded_batches(jpeg_factory):
+    paths = [jpeg_factory(f"img{i}.jpg") for i in range(3)]
+    taken = []
+
+    def endless():
+        while True:
+            taken.append(paths[len(taken) % len(paths)])
+            yield taken[-1]
+
+    cancel = threading.Event()
+    results = []
+
+    def on_result(result):
+        results.append(result)
+        if len(results) == 5:
+            cancel.set()
+
+    summary = mh.run_batch(mh.read_metadata_from_image, endless(), jobs=2, max_in_flight=3,
+                           cancel_event=cancel, on_result=on_result)
+    assert summary["cancelled"] and summary["failed"] == 0
+    # Queued work is dropped on cancel, so at most max_in_flight more ran
+    assert 5 <= summary["total"] <= 5 + 3
+    assert len(taken) <= summary["total"] + 3 + 1
+
+def test_cancel_before_start_runs_nothing(jpeg_factory):
+    cancel = threading.Event()
+    cancel.set()
+    path = jpeg_factory("a.jpg")
+    summary = mh.apply_metadata_to_images([path], {"Title": "New"}, jobs=1, cancel_event=cancel)
+    assert summary["total"] == 0 and summary["cancelled"]
+    assert mh.read_metadata_from_image(path, raise_errors=True)["Title"] == "Original"
@@ -0,0 +1,97 @@
+import piexif
+import pytest
+from PIL import Image
+
+import image_formats
+import metadata_handler as mh
+from conftest import make_exif, make_image
+
+MAKE = 271
+EXIF_POINTER = 0x8769
+DATE_TIME_ORIGINAL = 36867
+
+def unsort_tiff(path):
+    """Move the last IFD0 entry to the front, as some writers leave them."""
+    with open(path, "r+b") as f:
+        buf = bytearray(f.read())
+        byte_order, offset = image_formats.tiff_header(buf)
+        count = int.from_bytes(buf[offset:offset + 2], byte_order)
+        start, end = offset + 2, offset + 2 + count * 12
+        buf[start:end] = buf[end - 12:end] + buf[start:end - 12]
+        f.seek(0)
+        f.write(buf)
+
+def save(path, kind):
+    image = make_image()
+    if kind == "jpeg":
+        image.save(path, "JPEG", exif=make_exif())
+    elif kind == "png":
+        image.save(path, "PNG", exif=make_exif())
+    elif kind == "webp":
+        image.save(path, "WEBP", lossless=True, exif=make_exif())
+    elif kind == "webp-simple":
+        image.save(path, "WEBP", quality=80)  # No VP8X header yet
+    elif kind.startswith("tiff"):
+        extra = [image.rotate(90)] if kind == "tiff-multipage" else []
+        image.save(path, "TIFF", exif=make_exif(), save_all=bool(extra), append_images=extra)
+        if kind == "tiff-unsorted":
+            unsort_tiff(path)
+
+def pixels(path):
+    with Image.open(path) as image:
+        frames = []
+        for frame in range(getattr(image, "n_frames", 1)):
+            image.seek(frame)
+            frames.append(image.convert("RGB").tobytes())
+        return frames
+
+def foreign_tags(path):
+    with Image.open(path) as image:
+        exif = image.getexif()
+        return exif.get(MAKE), exif.get_ifd(EXIF_POINTER).get(DATE_TIME_ORIGINAL)
+
+KINDS = ["jpeg", "png", "webp", "webp-simple", "tiff", "tiff-multipage", "tiff-unsorted"]
+
+@pytest.mark.parametrize("kind", KINDS)
+def test_apply_keeps_pixels_and_foreign_tags(tmp_path, kind):
+    path = str(tmp_path / ("image.tif" if kind.startswith("tiff") else f"image.{kind.split('-')[0]}"))
+    save(path, kind)
+    before_pixels, before_tags = pixels(path), foreign_tags(path)
+
+    changes = mh.apply_metadata_to_image(path, {"Title": "New title", "Tags": "beach; sunset", "Authors": "Jane"})
+    assert changes["changes"]["Title"]["new"] == "New title"
+    assert pixels(path) == before_pixels
+    assert foreign_tags(path) == before_tags
+    metadata = mh.read_metadata_from_image(path, raise_errors=True)
+    assert (metadata["Title"], metadata["Tags"], metadata["Authors"]) == ("New title", "beach; sunset", "Jane")
+    assert mh.apply_metadata_to_image(path, {"Title": "New title", "Tags": "beach; sunset", "Authors": "Jane"}) == \
+        mh.STATUS_SKIPPED
+
+    # Shorter values fit in place; they must land on the right entries too
+    mh.apply_metadata_to_image(path, {"Title": "T", "Tags": "beach; sunset", "Authors": "Jane"})
+    assert mh.read_metadata_from_image(path, raise_errors=True)["Title"] == "T"
+    assert pixels(path) == before_pixels
+    assert foreign_tags(path) == before_tags
+
+@pytest.mark.parametrize("kind", KINDS)
+def test_clear_keeps_pixels(tmp_path, kind):
+    path = str(tmp_path / ("image.tif" if kind.startswith("tiff") else f"image.{kind.split('-')[0]}"))
+    save(path, kind)
+    mh.apply_metadata_to_image(path, {"Title": "New title"})
+    before_pixels = pixels(path)
+
+    mh.clear_metadata_from_image(path)
+    assert pixels(path) == before_pixels
+    assert not mh.read_metadata_from_image(path, raise_errors=True).get("Title")
+    assert mh.clear_metadata_from_image(path) == mh.STATUS_SKIPPED
+
+def test_unsorted_ifd_is_rewritten_sorted(tmp_path):
+    path = str(tmp_path / "image.tif")
+    save(path, "tiff-unsorted")
+    mh.apply_metadata_to_image(path, {"Title": "X"})
+    with open(path, "rb") as f:
+        buf = f.read()
+    byte_order, offset = image_formats.tiff_header(buf)
+    tags = [tag for _, tag, _ in image_formats.read_tiff_ifd(buf, offset, byte_order)[0]]
+    assert tags == sorted(set(tags))
+    assert piexif.load(path)["0th"][piexif.ImageIFD.ImageDescription] == b"X"
@@ -0,0 +1,86 @@
+import os
+import subprocess
+import sys
+
+import journal
+import metadata_handler as mh
+from conftest import APP_DIR
+
+# Applies the plan to every file, then dies without a checkpoint once
+# img1.jpg has been written, like a crash or power cut mid-run
+CRASHING_RUN = """
+import os, sys
+sys.path.insert(0, {app_dir!r})
+import journal, metadata_handler as mh
+
+def apply_then_crash(path, plan):
+    outcome = mh.apply_metadata_to_image(path, plan)
+    if path.endswith("img1.jpg"):
+        os._exit(3)
+    return outcome
+
+journal.run_journaled({journal_path!r}, "apply", apply_then_crash, {paths!r},
+                      mh.compile_metadata({{"Title": "New"}}), jobs=1)
+"""
+
+def titles(paths):
+    return [mh.read_metadata_from_image(path, raise_errors=True)["Title"] for path in paths]
+
+def crash_run(journal_path, paths):
+    script = CRASHING_RUN.format(app_dir=APP_DIR, journal_path=journal_path, paths=paths)
+    assert subprocess.run([sys.executable, "-c", script]).returncode == 3
+
+def test_resume_after_crash_then_rollback_restores_everything(tmp_path, jpeg_factory):
+    paths = [jpeg_factory(f"img{i}.jpg", title=f"Old{i}") for i in range(3)]
+    originals = [open(path, "rb").read() for path in paths]
+    journal_path = str(tmp_path / "run.journal")
+    crash_run(journal_path, paths)
+    assert titles(paths) == ["New", "New", "Old2"]
+
+    summary = journal.run_journaled(journal_path, "apply", mh.apply_metadata_to_image, paths,
+                                    mh.compile_metadata({"Title": "New"}), resume=True, jobs=1)
+    assert summary["skipped"] == 2 and summary["ok"] == 1
+    assert titles(paths) == ["New", "New", "New"]
+
+    summary = journal.rollback(journal_path)
+    assert summary["ok"] == 3 and summary["failed"] == 0
+    assert [open(path, "rb").read() for path in paths] == originals
+    assert os.listdir(journal.backup_dir_for(journal_path)) == []
+
+def test_rollback_straight_after_crash(tmp_path, jpeg_factory):
+    paths = [jpeg_factory(f"img{i}.jpg", title=f"Old{i}") for i in range(3)]
+    originals = [open(path, "rb").read() for path in paths]
+    journal_path = str(tmp_path / "run.journal")
+    crash_run(journal_path, paths)
+
+    summary = journal.rollback(journal_path)
+    assert summary["ok"] == 2 and summary["failed"] == 0
+    assert [open(path, "rb").read() for path in paths] == originals
+    # Rolling back again finds nothing left to do
+    assert journal.rollback(journal_path)["total"] == 0
+
+def test_untouched_files_keep_no_backup(tmp_path, jpeg_factory):
+    paths = [jpeg_factory(f"img{i}.jpg", title="Same") for i in range(2)]
+    journal_path = str(tmp_path / "run.journal")
+    summary = journal.run_journaled(journal_path, "apply", mh.apply_metadata_to_image, paths,
+                                    mh.compile_metadata({"Title": "Same"}), jobs=1)
+    assert summary["skipped"] == 2
+    assert os.listdir(journal.backup_dir_for(journal_path)) == []
+
+def test_rollback_through_symlinks_and_hard_links(tmp_path, jpeg_factory):
+    real = jpeg_factory("real.jpg", title="Old0")
+    link = str(tmp_path / "link.jpg")
+    os.symlink(real, link)
+    linked = jpeg_factory("linked.jpg", title="Old1")
+    other_name = str(tmp_path / "other-name.jpg")
+    os.link(linked, other_name)
+    originals = [open(path, "rb").read() for path in (real, linked)]
+    journal_path = str(tmp_path / "run.journal")
+
+    journal.run_journaled(journal_path, "apply", mh.apply_metadata_to_image, [link, linked],
+                          mh.compile_metadata({"Title": "New"}), jobs=1)
+    assert titles([real, other_name]) == ["New", "New"]
+
+    assert journal.rollback(journal_path)["ok"] == 2
+    assert os.path.islink(link) and os.path.samefile(linked, other_name)
+    assert [open(path, "rb").read() for path in (real, other_name)] == originals
@@ -0,0 +1,35 @@
+from PIL import ImageCms
+
+import metadata_handler as mh
+from conftest import make_exif, make_image
+
+XMP = (b'<x:xmpmeta xmlns:x="adobe:ns:meta/"><rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">'
+       b'<rdf:Description xmlns:xmp="http://ns.adobe.com/xap/1.0/" xmp:Rating="5"/></rdf:RDF></x:xmpmeta>')
+
+def make_tagged_jpeg(path):
+    """JPEG with Exif, an ICC profile (APP2) and an XMP packet (APP1)."""
+    icc = ImageCms.ImageCmsProfile(ImageCms.createProfile("sRGB")).tobytes()
+    make_image().save(path, "JPEG", exif=make_exif(), icc_profile=icc, xmp=XMP)
+
+def split(path):
+    """Return (segments other than Exif, scan data from SOS to the end)."""
+    with open(path, "rb") as f:
+        segments, scan_offset = mh.read_jpeg_header(f)
+        f.seek(scan_offset)
+        return [s for s in segments if not mh.is_exif_segment(*s)], f.read()
+
+def test_apply_and_clear_keep_pixels_and_other_segments(tmp_path):
+    path = str(tmp_path / "tagged.jpg")
+    make_tagged_jpeg(path)
+    segments, scan = split(path)
+    assert any(m == 0xE2 and p.startswith(b"ICC_PROFILE") for m, p in segments)
+    assert any(m == mh.APP1 and XMP in p for m, p in segments)
+
+    mh.apply_metadata_to_image(path, mh.compile_metadata({"Title": "New", "Tags": "a; b"}))
+    assert mh.read_metadata_from_image(path, raise_errors=True)["Title"] == "New"
+    assert split(path) == (segments, scan)
+
+    # Clearing drops the XMP packet too, by design, and nothing else
+    mh.clear_metadata_from_image(path)
+    assert not mh.read_metadata_from_image(path, raise_errors=True).get("Title")
+    assert split(path) == ([s for s in segments if s[0] != mh.APP1], scan)
@@ -0,0 +1,70 @@
+import os
+
+import piexif
+import pytest
+
+import metadata_handler as mh
+from conftest import make_exif
+
+@pytest.fixture
+def uncached_reads(monkeypatch):
+    """List of paths read past the cache, starting from an empty cache."""
+    mh.invalidate_metadata_cache()
+    reads = []
+    read = mh._read_metadata_uncached
+
+    def counting(path, *args):
+        reads.append(path)
+        return read(path, *args)
+
+    monkeypatch.setattr(mh, "_read_metadata_uncached", counting)
+    yield reads
+    mh.invalidate_metadata_cache()
+
+def title(path):
+    return mh.read_metadata_from_image(path, raise_errors=True)["Title"]
+
+def test_repeated_reads_hit_the_cache(jpeg_factory, uncached_reads):
+    path = jpeg_factory("a.jpg")
+    mh.read_metadata_from_image(path)["Title"] = "mutated by the caller"
+    assert title(path) == "Original"
+    assert uncached_reads == [path]
+
+def test_writes_through_the_app_are_seen(jpeg_factory, uncached_reads):
+    path = jpeg_factory("a.jpg")
+    assert title(path) == "Original"
+    mh.apply_metadata_to_image(path, mh.compile_metadata({"Title": "New"}))
+    assert title(path) == "New"
+    mh.apply_metadata_to_image(path, mh.compile_metadata({"Title": "Sidecar"}), sidecar=True)
+    assert title(path) == "Sidecar"
+    mh.clear_metadata_from_image(path)
+    assert mh.read_metadata_from_image(path, sidecar=False).get("Title", "") == ""
+
+def test_external_writes_are_seen(jpeg_factory, uncached_reads):
+    path = jpeg_factory("a.jpg")
+    assert title(path) == "Original"
+    piexif.insert(make_exif(b"Changed by another tool"), path)
+    assert title(path) == "Changed by another tool"
+
+def test_invalidate_forgets_a_change_the_signature_misses(jpeg_factory, uncached_reads):
+    path = jpeg_factory("a.jpg")
+    assert title(path) == "Original"
+    st = os.stat(path)
+    with open(path, "r+b") as f:  # Same size, and the old mtime put back
+        data = f.read()
+        f.seek(data.index(b"Original"))
+        f.write(b"Replaced")
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert title(path) == "Original"
+    mh.invalidate_metadata_cache(path)
+    assert title(path) == "Replaced"
+
+def test_cache_is_bounded(jpeg_factory, uncached_reads, monkeypatch):
+    monkeypatch.setattr(mh, "METADATA_CACHE_SIZE", 2)
+    paths = [jpeg_factory(f"img{i}.jpg") for i in range(3)]
+    for path in paths + paths[-1:]:
+        mh.read_metadata_from_image(path)
+    assert len(mh._metadata_cache) == 2
+    assert uncached_reads == paths
+    mh.read_metadata_from_image(paths[0])  # Evicted as least recently used
+    assert uncached_reads == paths + paths[:1]
@@ -0,0 +1,38 @@
+import os
+
+import pytest
+
+import rename_planner
+
+def contents(paths):
+    return {os.path.basename(path): open(path, "rb").read() for path in paths}
+
+@pytest.mark.parametrize("order", [["2.jpg", "1.jpg"], ["2.jpg", "3.jpg", "1.jpg"]], ids=["swap", "cycle"])
+def test_swap_and_cycle_renames_then_undo(tmp_path, jpeg_factory, order):
+    paths = [jpeg_factory(name, title=name) for name in sorted(order)]
+    before = contents(paths)
+    # Numbering the files in this order hands each one the name of another
+    plan = rename_planner.plan_renames([str(tmp_path / name) for name in order], "{n}")
+    assert not plan.conflicts and len(plan.renames) == len(order)
+
+    summary = rename_planner.execute_renames(plan, undo_log=str(tmp_path / "undo.log"))
+    assert summary["ok"] == len(order) and not summary["rolled_back"]
+    after = contents(paths)
+    for n, old_name in enumerate(order, start=1):
+        assert after[f"{n}.jpg"] == before[old_name]
+    assert sorted(os.listdir(tmp_path)) == sorted(order + ["undo.log"])
+
+    summary = rename_planner.undo_renames(str(tmp_path / "undo.log"))
+    assert summary["failed"] == 0
+    assert contents(paths) == before
+
+def test_conflicting_plan_renames_nothing(tmp_path, jpeg_factory):
+    paths = [jpeg_factory(name) for name in ("a.jpg", "b.jpg")]
+    jpeg_factory("x-1.jpg")  # Not part of the batch, but in the way
+    before = contents(paths)
+    plan = rename_planner.plan_renames(paths, "{base}-{n}", base="x")
+    assert plan.conflicts
+
+    summary = rename_planner.execute_renames(plan, undo_log=str(tmp_path / "undo.log"))
+    assert summary["ok"] == 0 and summary["failed"]
+    assert contents(paths) == before
@@ -0,0 +1,74 @@
+import http.client
+import json
+import threading
+
+import pytest
+
+import metadata_handler as mh
+import server
+
+@pytest.fixture
+def tagging_server():
+    tagging = server.make_server("127.0.0.1", 0, workers=2)
+    thread = threading.Thread(target=tagging.serve_forever, daemon=True)
+    thread.start()
+    yield tagging
+    tagging.shutdown()
+    tagging.server_close()
+    tagging.service.close()
+
+def request(tagging, method, path, headers, body=None):
+    connection = http.client.HTTPConnection(*tagging.server_address[:2])
+    connection.request(method, path, body=body, headers=headers)
+    response = connection.getresponse()
+    payload = json.loads(response.read())
+    connection.close()
+    return response.status, payload
+
+@pytest.mark.parametrize("headers, status", [
+    ({"Content-Type": "text/plain", "Origin": "http://evil.example"}, 403),
+    ({"Content-Type": "text/plain"}, 415),
+    ({"Content-Type": "application/json", "Origin": "http://evil.example"}, 403),
+    ({"Content-Type": "application/json", "Host": "evil.example:8765"}, 403),
+])
+def test_forged_requests_are_refused(tagging_server, jpeg_factory, headers, status):
+    path = jpeg_factory("a.jpg", title="Original")
+    body = json.dumps({"paths": [path], "fields": {"Title": "pwned"}})
+    assert request(tagging_server, "POST", "/apply", headers, body)[0] == status
+    assert mh.read_metadata_from_image(path, raise_errors=True)["Title"] == "Original"
+
+def test_local_json_request_is_served(tagging_server, jpeg_factory):
+    path = jpeg_factory("a.jpg", title="Original")
+    port = tagging_server.server_address[1]
+    headers = {"Content-Type": "application/json", "Origin": f"http://localhost:{port}"}
+    status, payload = request(tagging_server, "POST", "/apply", headers,
+                              json.dumps({"paths": [path], "fields": {"Title": "New"}}))
+    assert status == 200 and payload["summary"]["ok"] == 1
+    assert mh.read_metadata_from_image(path, raise_errors=True)["Title"] == "New"
+
+@pytest.mark.parametrize("length", ["-1", "abc", "+5", "1e3"])
+def test_invalid_content_length_is_refused(tagging_server, length):
+    connection = http.client.HTTPConnection(*tagging_server.server_address[:2])
+    connection.putrequest("POST", "/apply")
+    connection.putheader("Content-Type", "application/json")
+    connection.putheader("Content-Length", length)
+    connection.endheaders()
+    response = connection.getresponse()
+    assert response.status == 400
+    assert json.loads(response.read()) == {"error": "Invalid Content-Length."}
+    # The server hangs up rather than reading the body as the next request
+    connection.sock.settimeout(5)
+    assert connection.sock.recv(1) == b""
+    connection.close()
+
+@pytest.mark.parametrize("name", ["../secrets", "/etc/passwd", "sub/name", ".hidden", ""])
+def test_template_names_cannot_leave_the_template_folder(name):
+    with pytest.raises(ValueError):
+        mh.template_path(name)
+
+def test_traversing_template_is_a_bad_request(tagging_server, jpeg_factory):
+    path = jpeg_factory("a.jpg", title="Original")
+    body = json.dumps({"paths": [path], "template": "../../../tmp/evil"})
+    status, payload = request(tagging_server, "POST", "/apply", {"Content-Type": "application/json"}, body)
+    assert status == 400 and "Invalid template name" in payload["error"]
+    assert mh.read_metadata_from_image(path, raise_errors=True)["Title"] == "Original"
@@ -0,0 +1,63 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+import sharding
+
+def write_lease(manifest_dir, shard, generation=0, **info):
+    lease_dir = os.path.join(manifest_dir, "leases", "apply")
+    os.makedirs(lease_dir, exist_ok=True)
+    path = os.path.join(lease_dir, f"{shard:06d}.{generation}")
+    lease = {"worker": "other", "host": sharding.HOST, "pid": os.getpid(), "ttl": 300, "claimed": time.time()}
+    lease.update(info)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(lease, f)
+    return path
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+def make_manifest(tmp_path, files=6, shard_size=3):
+    manifest_dir = str(tmp_path / "run")
+    paths = [str(tmp_path / f"f{i}") for i in range(files)]
+    sharding.create_manifest(manifest_dir, paths, shard_size)
+    return manifest_dir, paths
+
+def test_lease_of_dead_process_is_taken_over(tmp_path):
+    manifest_dir, _ = make_manifest(tmp_path)
+    stale = write_lease(manifest_dir, 0, pid=dead_pid())
+    lease = sharding.claim_shard(manifest_dir, "apply", "me")
+    assert (lease.shard, lease.generation) == (0, 1)
+    assert not os.path.exists(stale)
+    lease.release()
+
+def test_expired_lease_from_another_host_is_taken_over(tmp_path):
+    manifest_dir, _ = make_manifest(tmp_path)
+    stale = write_lease(manifest_dir, 0, host="elsewhere", ttl=1)
+    os.utime(stale, (time.time() - 10, time.time() - 10))
+    lease = sharding.claim_shard(manifest_dir, "apply", "me")
+    assert (lease.shard, lease.generation) == (0, 1)
+
+def test_live_lease_is_left_alone_and_holder_notices_takeover(tmp_path):
+    manifest_dir, _ = make_manifest(tmp_path)
+    write_lease(manifest_dir, 0)  # This process, so alive
+    lease = sharding.claim_shard(manifest_dir, "apply", "me")
+    assert lease.shard == 1
+    assert lease.renew()
+    write_lease(manifest_dir, 1, generation=1)  # Another worker takes shard 1 over
+    assert not lease.renew() and lease.lost.is_set()
+
+def test_run_finishes_shards_of_a_dead_worker(tmp_path):
+    manifest_dir, paths = make_manifest(tmp_path)
+    write_lease(manifest_dir, 0, pid=dead_pid())
+    seen = []
+    summary = sharding.run_shards(manifest_dir, "apply", seen.append, jobs=1)
+    assert summary["shards"] == 2 and summary["ok"] == len(paths)
+    assert sorted(seen) == sorted(paths)
+    status = sharding.shard_status(manifest_dir, "apply")
+    assert (status["done"], status["leased"], status["pending"]) == (2, 0, 0)
+    assert os.listdir(os.path.join(manifest_dir, "leases", "apply")) == []
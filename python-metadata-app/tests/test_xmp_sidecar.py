@@ -0,0 +1,28 @@
+import metadata_handler as mh
+import xmp_sidecar
+
+def test_empty_field_hides_embedded_value(jpeg_factory):
+    path = jpeg_factory("a.jpg", title="Embedded")
+    original = open(path, "rb").read()
+    assert mh.apply_metadata_to_image(path, {"Title": "Side"}, sidecar=True)["changes"]["Title"] == \
+        {"old": "Embedded", "new": "Side"}
+    assert mh.read_metadata_from_image(path)["Title"] == "Side"
+
+    assert mh.apply_metadata_to_image(path, {"Title": ""}, sidecar=True)["changes"]["Title"] == \
+        {"old": "Side", "new": ""}
+    assert mh.read_metadata_from_image(path)["Title"] == ""
+    assert mh.apply_metadata_to_image(path, {"Title": ""}, sidecar=True) == mh.STATUS_SKIPPED
+    assert mh.read_metadata_from_image(path, sidecar=False)["Title"] == "Embedded"
+    assert open(path, "rb").read() == original
+
+def test_blank_sidecar_first_apply(jpeg_factory):
+    path = jpeg_factory("a.jpg", title="Embedded")
+    assert mh.apply_metadata_to_image(path, {"Title": "", "Tags": ""}, sidecar=True)["changes"] == \
+        {"Title": {"old": "Embedded", "new": ""}}
+    assert mh.read_metadata_from_image(path)["Title"] == ""
+
+def test_empty_list_field_round_trip():
+    data = xmp_sidecar.update_fields(None, {"Tags": "beach; sunset", "Authors": ""})
+    assert xmp_sidecar.read_fields(data) == {"Tags": "beach; sunset", "Authors": ""}
+    data = xmp_sidecar.update_fields(data, {"Tags": ""})
+    assert xmp_sidecar.read_fields(data) == {"Tags": "", "Authors": ""}
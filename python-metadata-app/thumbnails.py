@@ -0,0 +1,65 @@
+# thumbnails.py
+#
+# Persistent on-disk thumbnail store. Thumbnails are small JPEGs keyed by the
+# image's absolute path, mtime and size, so reopening a folder only decodes
+# files that changed since the last visit.
+
+import hashlib
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+import metadata_handler as mh
+import preview
+
+THUMBNAIL_SIZE = 160
+THUMBNAIL_DIR = os.path.join(mh.CACHE_DIR, "thumbnails")
+
+class ThumbnailStore:
+    """Generates thumbnails on a worker pool and keeps them on disk."""
+
+    def __init__(self, cache_dir=THUMBNAIL_DIR, size=THUMBNAIL_SIZE, jobs=None):
+        self.cache_dir = cache_dir
+        self.size = size
+        self._executor = ThreadPoolExecutor(max_workers=jobs or os.cpu_count() or 1,
+                                            thread_name_prefix="thumbnail")
+
+    def cache_path(self, path):
+        stat = os.stat(path)
+        key = f"{os.path.abspath(path)}\0{stat.st_mtime_ns}\0{stat.st_size}\0{self.size}"
+        digest = hashlib.sha1(key.encode("utf-8", errors="surrogateescape")).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], digest + ".jpg")
+
+    def load(self, path):
+        """Return the thumbnail for path, generating and storing it if needed."""
+        from PIL import Image  # Imported on first use to keep start-up fast
+        cache_path = self.cache_path(path)
+        try:
+            image = Image.open(cache_path)
+            image.load()
+            mh.count("thumbnail_cache.hit")
+            return image
+        except (OSError, ValueError):
+            pass
+
+        mh.count("thumbnail_cache.miss")
+        with mh.timed("thumbnail.generate"):
+            image = preview.load_preview(path, (self.size, self.size))
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(cache_path))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                image.save(f, "JPEG", quality=85)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return image
+
+    def submit(self, path):
+        """Queue a thumbnail for background loading; returns a Future."""
+        return self._executor.submit(self.load, path)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
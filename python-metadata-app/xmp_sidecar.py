@@ -0,0 +1,161 @@
+# xmp_sidecar.py
+#
+# Reading and updating XMP sidecar files ("photo.jpg.xmp", the naming darktable
+# uses). Sidecar mode in metadata_handler stores the metadata fields here
+# instead of rewriting the image, so tagging costs a few KB of I/O whatever the
+# image size. Everything else in an existing sidecar (edit history, ratings,
+# other tools' namespaces) is kept as it is.
+
+import io
+import xml.etree.ElementTree as ET
+
+NAMESPACES = {
+    "x": "adobe:ns:meta/",
+    "rdf": "http://www.w3.org/1999/02/22-rdf-syntax-ns#",
+    "dc": "http://purl.org/dc/elements/1.1/",
+    "exif": "http://ns.adobe.com/exif/1.0/",
+    # XMP has no standard property for the Windows "Subject" field
+    "photometadata": "https://github.com/topplanecreator/Photo-metadata-editor/ns/1.0/",
+}
+XML_LANG = "{http://www.w3.org/XML/1998/namespace}lang"
+
+# Where each field is stored: (namespace prefix, property, RDF container).
+# Bag and Seq hold one item per ";"-separated entry of the field.
+FIELD_PROPERTIES = {
+    "Title": ("dc", "title", "Alt"),
+    "Subject": ("photometadata", "Subject", None),
+    "Tags": ("dc", "subject", "Bag"),
+    "Comments": ("exif", "UserComment", "Alt"),
+    "Authors": ("dc", "creator", "Seq"),
+    "Copyright": ("dc", "rights", "Alt"),
+}
+LIST_SEPARATOR = ";"
+
+for _prefix, _uri in NAMESPACES.items():
+    ET.register_namespace(_prefix, _uri)
+
+def sidecar_path(path):
+    return path + ".xmp"
+
+def _name(prefix, local):
+    return f"{{{NAMESPACES[prefix]}}}{local}"
+
+def _register_prefixes(data):
+    """Keep the prefixes a file already uses when it is written back."""
+    for _, (prefix, uri) in ET.iterparse(io.BytesIO(data), events=("start-ns",)):
+        if prefix and uri not in NAMESPACES.values():
+            try:
+                ET.register_namespace(prefix, uri)
+            except ValueError:
+                pass  # Reserved prefix such as "ns0"; ElementTree picks one
+
+def _parse(data):
+    """Return the x:xmpmeta root of a sidecar, creating an empty one if needed."""
+    if data:
+        _register_prefixes(data)
+        # Comments and processing instructions inside the packet are kept too
+        parser = ET.XMLParser(target=ET.TreeBuilder(insert_comments=True, insert_pis=True))
+        root = ET.fromstring(data, parser=parser)
+        if root.tag == _name("rdf", "RDF"):
+            wrapper = ET.Element(_name("x", "xmpmeta"))
+            wrapper.append(root)
+            root = wrapper
+        return root
+    root = ET.Element(_name("x", "xmpmeta"))
+    ET.SubElement(root, _name("rdf", "RDF"))
+    return root
+
+def _descriptions(root):
+    return root.iter(_name("rdf", "Description"))
+
+def _property_value(element, container):
+    items = list(element.iter(_name("rdf", "li")))
+    if not items:
+        # An empty rdf:Alt/Bag/Seq is an explicitly empty field
+        return "" if len(element) else element.text or ""
+    if container == "Alt":
+        default = [li for li in items if li.get(XML_LANG) == "x-default"]
+        return ((default or items)[0].text or "")
+    return f"{LIST_SEPARATOR} ".join((li.text or "").strip() for li in items if (li.text or "").strip())
+
+def normalize_value(field, value):
+    """The form a field value takes after a round trip through a sidecar."""
+    if FIELD_PROPERTIES[field][2] in ("Bag", "Seq"):
+        return f"{LIST_SEPARATOR} ".join(item.strip() for item in value.split(LIST_SEPARATOR) if item.strip())
+    return value
+
+def read_fields(data):
+    """Return the metadata fields present in sidecar XML bytes."""
+    metadata = {}
+    root = _parse(data)
+    for description in _descriptions(root):
+        for field, (prefix, local, container) in FIELD_PROPERTIES.items():
+            if field in metadata:
+                continue
+            name = _name(prefix, local)
+            if name in description.attrib:
+                metadata[field] = description.attrib[name]
+                continue
+            element = description.find(name)
+            if element is not None:
+                metadata[field] = _property_value(element, container)
+    return metadata
+
+def _remove_property(root, name):
+    for description in _descriptions(root):
+        description.attrib.pop(name, None)
+        for element in description.findall(name):
+            description.remove(element)
+
+def _add_property(description, name, container, value):
+    element = ET.SubElement(description, name)
+    if container is None:
+        element.text = value
+        return
+    holder = ET.SubElement(element, _name("rdf", container))
+    if container == "Alt":
+        values = [value]
+    else:
+        values = [item.strip() for item in value.split(LIST_SEPARATOR) if item.strip()]
+    for item in values:
+        li = ET.SubElement(holder, _name("rdf", "li"))
+        li.text = item
+        if container == "Alt":
+            li.set(XML_LANG, "x-default")
+
+def _serialize(root):
+    ET.indent(root, space=" ")
+    body = ET.tostring(root, encoding="utf-8", xml_declaration=False)
+    return b'<?xml version="1.0" encoding="UTF-8"?>\n' + body + b"\n"
+
+def update_fields(data, metadata):
+    """Return sidecar XML bytes with the given fields set.
+
+    data is the existing sidecar (or None). Empty fields are written as
+    empty properties, so they hide a value embedded in the image instead of
+    letting it show through again. An empty Comments field leaves the
+    existing comment alone, as in the EXIF writer.
+    """
+    root = _parse(data)
+    rdf = root.find(_name("rdf", "RDF"))
+    description = next(_descriptions(root), None)
+    if description is None:
+        description = ET.SubElement(rdf, _name("rdf", "Description"), {_name("rdf", "about"): ""})
+    for field, value in metadata.items():
+        if field not in FIELD_PROPERTIES or (field == "Comments" and not value):
+            continue
+        prefix, local, container = FIELD_PROPERTIES[field]
+        _remove_property(root, _name(prefix, local))
+        _add_property(description, _name(prefix, local), container, value)
+    return _serialize(root)
+
+def remove_fields(data):
+    """Return the sidecar without any of the app's fields, or None if nothing else is left."""
+    root = _parse(data)
+    for prefix, local, _ in FIELD_PROPERTIES.values():
+        _remove_property(root, _name(prefix, local))
+    about = _name("rdf", "about")
+    for description in _descriptions(root):
+        if len(description) or set(description.attrib) - {about}:
+            return _serialize(root)
+    return None